@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+"""
+Benchmark of the accuracy per likelihood call of dyPolyChord for the
+likelihoods in python_likelihoods, which have known evidences and posterior
+means.
+
+Many seeded repeats are run in parallel for each combination of likelihood,
+dynamic_goal, ninit and init_step, as well as for standard PolyChord with a
+constant number of live points. For each configuration the root mean squared
+errors of logZ and of the posterior means (averaged over parameters) relative
+to the reference values are reported, along with the mean number of
+likelihood calls and wall time per run. The efficiency gain is the reduction
+in the squared error per likelihood call relative to constant nlive PolyChord:
+
+    gain = (rmse_const ** 2 * nlike_const) / (rmse ** 2 * nlike)
+
+so a gain of 2 means a configuration needs half as many likelihood calls as
+standard PolyChord for the same accuracy (see the dynamic nested sampling
+paper for more details).
+
+The priors are uniform on [-half_width, half_width] in each dimension. The
+reference values are analytic for the Gaussian, GaussianMix and LogGammaMix
+likelihoods (up to negligible truncation by the prior), and are calculated by
+numerical integration on a grid for the other likelihoods (only possible in 2
+dimensions). Requires pypolychord. Run from the repository root with, for
+example:
+
+    python benchmarks/benchmark_accuracy.py --likelihoods gaussian rosenbrock \
+        --dynamic_goals 0 0.25 1 --nrepeat 20 --nproc 8
+"""
+from __future__ import print_function
+from __future__ import division
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import os
+import shutil
+import time
+import numpy as np
+import scipy.special
+import scipy.stats
+import nestcheck.data_processing
+import nestcheck.estimators
+import dyPolyChord.pypolychord_utils
+import dyPolyChord.python_likelihoods as likelihoods
+import dyPolyChord.python_priors as priors
+import dyPolyChord.run_dynamic_ns
+
+
+# Likelihood objects and the half width of the uniform prior in each dimension
+LIKELIHOODS = collections.OrderedDict([
+    ('gaussian', (likelihoods.Gaussian(sigma=1.), 10.)),
+    ('gaussian_mix', (likelihoods.GaussianMix(), 10.)),
+    ('loggamma_mix', (likelihoods.LogGammaMix(), 30.)),
+    ('gaussian_shell', (likelihoods.GaussianShell(), 5.)),
+    ('rastrigin', (likelihoods.Rastrigin(), 5.12)),
+    ('rosenbrock', (likelihoods.Rosenbrock(), 5.))])
+
+
+def get_reference(name, ndim, nquad=1001):
+    """Get the reference logZ and posterior means for a likelihood with a
+    uniform prior.
+
+    Parameters
+    ----------
+    name: str
+        Key of LIKELIHOODS.
+    ndim: int
+    nquad: int, optional
+        Number of grid points in each dimension for numerical integration.
+
+    Returns
+    -------
+    logz: float
+    means: 1d numpy array
+    """
+    likelihood, half_width = LIKELIHOODS[name]
+    if name in ['gaussian', 'gaussian_mix']:
+        if name == 'gaussian':
+            centres = np.zeros((1, ndim))
+            weights = np.ones(1)
+        else:
+            centres = np.zeros((len(likelihood.weights), ndim))
+            centres[:, :2] = likelihood.offsets
+            weights = np.asarray(likelihood.weights)
+        return gaussian_mix_reference(
+            centres, weights, likelihood.sigma, half_width)
+    elif name == 'loggamma_mix':
+        # Each dimension's likelihood is a normalised pdf, and the mean of a
+        # loggamma distribution with alpha=beta=1 is digamma(1)
+        means = np.zeros(ndim)
+        means[0] = scipy.special.digamma(1)
+        means[2:(ndim // 2) + 1] = scipy.special.digamma(1)
+        return -ndim * np.log(2 * half_width), means
+    assert ndim == 2, (
+        'no reference values for {} with ndim={} != 2'.format(name, ndim))
+    # Midpoint rule on a grid
+    points = -half_width + (np.arange(nquad) + 0.5) * (2 * half_width / nquad)
+    grid = np.stack(np.meshgrid(points, points, indexing='ij'), axis=-1)
+    grid = grid.reshape((-1, ndim))
+    logl = np.asarray([likelihood(theta)[0] for theta in grid])
+    logz = scipy.special.logsumexp(logl) - ndim * np.log(nquad)
+    weights = np.exp(logl - logl.max())
+    means = (grid * weights[:, None]).sum(axis=0) / weights.sum()
+    return logz, means
+
+
+def gaussian_mix_reference(centres, weights, sigma, half_width):
+    """Get the evidence and posterior means of a mixture of isotropic
+    Gaussians with a uniform prior on [-half_width, half_width] in each
+    dimension.
+
+    Parameters
+    ----------
+    centres: 2d numpy array
+        Centre of each component (one row per component).
+    weights: 1d numpy array
+        Weight of each component (summing to 1).
+    sigma: float
+    half_width: float
+
+    Returns
+    -------
+    logz: float
+    means: 1d numpy array
+    """
+    upper = (half_width - centres) / sigma
+    lower = (-half_width - centres) / sigma
+    # Probability mass of each component in each dimension inside the prior
+    mass = scipy.stats.norm.cdf(upper) - scipy.stats.norm.cdf(lower)
+    # Means of the truncated normals in each dimension
+    trunc_means = centres + sigma * (
+        scipy.stats.norm.pdf(lower) - scipy.stats.norm.pdf(upper)) / mass
+    comp_z = weights * np.prod(mass, axis=1)
+    logz = np.log(comp_z.sum()) - centres.shape[1] * np.log(2 * half_width)
+    means = (comp_z[:, None] * trunc_means).sum(axis=0) / comp_z.sum()
+    return logz, means
+
+
+def run_repeat(config, seed, **kwargs):
+    """Do one run and get its results.
+
+    Parameters
+    ----------
+    config: tuple
+        (name, dynamic_goal, ninit, init_step), where dynamic_goal is None
+        for standard PolyChord with a constant number of live points (in
+        which case ninit and init_step are ignored).
+    seed: int
+        PolyChord's seed.
+    ndim: int, optional
+    nlive_const: int, optional
+    num_repeats: int, optional
+    base_dir: str, optional
+
+    Returns
+    -------
+    result: dict
+        Containing the estimated logz and means, the number of likelihood
+        calls nlike and the wall time in seconds.
+    """
+    ndim = kwargs.pop('ndim', 2)
+    nlive_const = kwargs.pop('nlive_const', 250)
+    num_repeats = kwargs.pop('num_repeats', 10)
+    base_dir = kwargs.pop('base_dir', 'chains_benchmark')
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    name, dynamic_goal, ninit, init_step = config
+    likelihood, half_width = LIKELIHOODS[name]
+    run_polychord = dyPolyChord.pypolychord_utils.RunPyPolyChord(
+        likelihood, priors.Uniform(-half_width, half_width), ndim)
+    file_root = '{}_{}_{}_{}_{}_{}'.format(
+        name, ndim, dynamic_goal, ninit, init_step, seed).replace('.', '_')
+    settings_dict = {'file_root': file_root, 'base_dir': base_dir,
+                     'nlive': nlive_const, 'num_repeats': num_repeats,
+                     'seed': seed, 'feedback': -1, 'equals': False,
+                     'posteriors': False}
+    start_time = time.time()
+    if dynamic_goal is None:
+        run_polychord(dict(settings_dict, write_resume=False,
+                           read_resume=False))
+    else:
+        dyPolyChord.run_dynamic_ns.run_dypolychord(
+            run_polychord, dynamic_goal, settings_dict, ninit=ninit,
+            init_step=init_step, stats_means_errs=False)
+    wall_time = time.time() - start_time
+    run = nestcheck.data_processing.process_polychord_run(file_root, base_dir)
+    return {'logz': nestcheck.estimators.logz(run),
+            'means': np.asarray([nestcheck.estimators.param_mean(
+                run, param_ind=i) for i in range(ndim)]),
+            'nlike': run['output']['nlike'], 'time': wall_time}
+
+
+def summarise(results, reference):
+    """Get the errors and costs of a configuration's repeated runs.
+
+    Parameters
+    ----------
+    results: list of dicts
+        Output of run_repeat for each repeat.
+    reference: tuple
+        Reference logz and means.
+
+    Returns
+    -------
+    summary: dict
+    """
+    logz = np.asarray([res['logz'] for res in results])
+    means = np.vstack([res['means'] for res in results])
+    return {'logz_rmse': np.sqrt(np.mean((logz - reference[0]) ** 2)),
+            'mean_rmse': np.sqrt(np.mean((means - reference[1]) ** 2)),
+            'nlike': np.mean([res['nlike'] for res in results]),
+            'time': np.mean([res['time'] for res in results])}
+
+
+def efficiency_gain(summary, const_summary, key):
+    """Squared error per likelihood call of constant nlive PolyChord divided
+    by that of a configuration."""
+    return ((const_summary[key] ** 2 * const_summary['nlike']) /
+            (summary[key] ** 2 * summary['nlike']))
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--likelihoods', nargs='+', default=['gaussian'],
+                        choices=list(LIKELIHOODS.keys()))
+    parser.add_argument('--dynamic_goals', nargs='+', type=float,
+                        default=[0, 0.25, 1])
+    parser.add_argument('--ninits', nargs='+', type=int, default=[20])
+    parser.add_argument('--init_steps', nargs='+', type=int, default=None,
+                        help='defaults to ninit')
+    parser.add_argument('--nrepeat', type=int, default=10)
+    parser.add_argument('--ndim', type=int, default=2)
+    parser.add_argument('--nlive_const', type=int, default=250)
+    parser.add_argument('--num_repeats', type=int, default=10)
+    parser.add_argument('--nproc', type=int, default=None,
+                        help='worker processes (default one per CPU)')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of the first repeat')
+    parser.add_argument('--base_dir', default='chains_benchmark')
+    args = parser.parse_args()
+    configs = []
+    for name in args.likelihoods:
+        configs.append((name, None, None, None))
+        for goal, ninit in itertools.product(args.dynamic_goals, args.ninits):
+            for init_step in (args.init_steps or [ninit]):
+                configs.append((name, goal, ninit, init_step))
+    run_kwargs = {'ndim': args.ndim, 'nlive_const': args.nlive_const,
+                  'num_repeats': args.num_repeats, 'base_dir': args.base_dir}
+    # Space the seeds well apart as run_dypolychord increments them
+    seeds = [args.seed + 10000 * i for i in range(args.nrepeat)]
+    if not os.path.isdir(args.base_dir):
+        os.makedirs(args.base_dir)
+    futures = collections.OrderedDict()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.nproc) as pool:
+        for config in configs:
+            futures[config] = [pool.submit(
+                run_repeat, config, seed, **run_kwargs) for seed in seeds]
+        summaries = {}
+        references = {name: get_reference(name, args.ndim)
+                      for name in args.likelihoods}
+        for config, config_futures in futures.items():
+            summaries[config] = summarise(
+                [fut.result() for fut in config_futures],
+                references[config[0]])
+    shutil.rmtree(args.base_dir)
+    header = '{:<16}{:>7}{:>7}{:>7}{:>11}{:>11}{:>11}{:>9}{:>9}{:>9}'.format(
+        'likelihood', 'goal', 'ninit', 'step', 'logZ rmse', 'mean rmse',
+        'nlike', 'time', 'Z gain', 'mu gain')
+    print('{} repeats, ndim={}, nlive_const={}'.format(
+        args.nrepeat, args.ndim, args.nlive_const))
+    print(header)
+    for config in configs:
+        summary = summaries[config]
+        const_summary = summaries[(config[0], None, None, None)]
+        print(('{:<16}{:>7}{:>7}{:>7}{:>11.4f}{:>11.4f}{:>11.0f}{:>9.2f}'
+               '{:>9.2f}{:>9.2f}').format(
+                   config[0], *[('const' if val is None else val)
+                                for val in config[1:]],
+                   summary['logz_rmse'], summary['mean_rmse'],
+                   summary['nlike'], summary['time'],
+                   efficiency_gain(summary, const_summary, 'logz_rmse'),
+                   efficiency_gain(summary, const_summary, 'mean_rmse')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the per-call latency of python priors, comparing the
+default behaviour (a new output array is allocated on every call) with
+writing into a preallocated output array (preallocate=True).
+
+Priors are called once for every point PolyChord proposes, so their overhead
+matters for fast likelihoods. Run from the repository root with:
+
+    python benchmarks/benchmark_priors.py
+"""
+from __future__ import print_function
+import timeit
+import numpy as np
+import dyPolyChord.python_priors as priors
+
+
+def get_priors(ndim, **kwargs):
+    """Get a dictionary of the priors to benchmark.
+
+    Parameters
+    ----------
+    ndim: int
+        Number of parameters.
+    kwargs: dict, optional
+        Passed to the prior objects' __init__ methods.
+
+    Returns
+    -------
+    prior_dict: dict
+    """
+    block_sizes = [ndim // 2, ndim - (ndim // 2) - 4, 4]
+    prior_blocks = [priors.Uniform(-5, 5), priors.Gaussian(2.0),
+                    priors.Uniform(0, 1, sort=True)]
+    return {'uniform': priors.Uniform(-5, 5, **kwargs),
+            'gaussian': priors.Gaussian(2.0, **kwargs),
+            'adaptive sorted uniform': priors.Uniform(
+                0, 1, adaptive=True, sort=True, **kwargs),
+            'block': priors.BlockPrior(prior_blocks, block_sizes, **kwargs)}
+
+
+def time_call(prior, cube, number=20000, repeat=7):
+    """Get the minimum time per call of prior(cube) in microseconds."""
+    times = timeit.repeat(lambda: prior(cube), number=number, repeat=repeat)
+    return min(times) * 1e6 / number
+
+
+def main():
+    """Print per-call latency for each prior."""
+    np.random.seed(0)
+    for ndim in [10, 100]:
+        cube = np.random.random(ndim)
+        default = get_priors(ndim)
+        prealloc = get_priors(ndim, preallocate=True)
+        print('ndim={}'.format(ndim))
+        for name in sorted(default.keys()):
+            print('    {:<25}{:>8.2f} us (default) {:>8.2f} us '
+                  '(preallocate=True)'.format(
+                      name, time_call(default[name], cube),
+                      time_call(prealloc[name], cube)))
+
+
+if __name__ == '__main__':
+    main()
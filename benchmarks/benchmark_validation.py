@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Benchmark of the overhead of each validation level ('full', 'sampled' and
+'off') for the checks of combined runs (output_processing.check_run) and of
+nlive allocations (nlive_allocation.allocate), compared to nestcheck's
+check_ns_run.
+
+The checks are performed once per run_dypolychord call, so their overhead
+matters for runs with many samples. Run from the repository root with:
+
+    python benchmarks/benchmark_validation.py
+"""
+from __future__ import print_function
+import timeit
+import numpy as np
+import nestcheck.dummy_data
+import nestcheck.ns_run_utils
+import dyPolyChord.nlive_allocation
+import dyPolyChord.output_processing
+
+
+def time_func(func, number=3, repeat=3):
+    """Get the minimum time per call of func() in milliseconds."""
+    times = timeit.repeat(func, number=number, repeat=repeat)
+    return min(times) * 1e3 / number
+
+
+def main():
+    """Print the time taken by the checks at each validation level."""
+    np.random.seed(0)
+    levels = ['full', 'sampled', 'off']
+    for nthread, nsamples in [(100, 1000), (1000, 1000)]:
+        run = nestcheck.dummy_data.get_dummy_run(nthread, nsamples)
+        print('check_run: {} threads, {} samples'.format(
+            nthread, run['logl'].shape[0]))
+        print('    {:<25}{:>10.2f} ms'.format(
+            'nestcheck check_ns_run', time_func(
+                lambda: nestcheck.ns_run_utils.check_ns_run(run), number=1,
+                repeat=1)))
+        for level in levels:
+            print('    {:<25}{:>10.2f} ms'.format(
+                level, time_func(
+                    lambda: dyPolyChord.output_processing.check_run(
+                        run, validation=level))))
+    for nsamples in [10000, 1000000]:
+        init_run = nestcheck.dummy_data.get_dummy_run(1, nsamples)
+        init_run['nlive_array'] = np.full(nsamples, 10.)
+        print('allocate: {} samples'.format(nsamples))
+        for level in levels:
+            print('    {:<25}{:>10.2f} ms'.format(
+                level, time_func(
+                    lambda: dyPolyChord.nlive_allocation.allocate(
+                        init_run, nsamples * 10, 0.5, validation=level))))
+
+
+if __name__ == '__main__':
+    main()
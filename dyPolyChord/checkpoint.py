@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Checkpoint manifest recording which steps of run_dypolychord have finished,
+so that a call which did not finish (for example because the job was
+killed) can be resumed with resume=True.
+
+The manifest is saved to [base_dir]/[file_root]_checkpoint.pkl and also
+stores the outputs of each finished step needed by the later steps (see
+load_checkpoint).
+"""
+import os
+import nestcheck.io_utils
+
+
+def start_checkpoint(root_name, resume, **kwargs):
+    """Get the checkpoint manifest at the start of a call of run_dypolychord.
+
+    If resume is True, the manifest saved by a previous call is loaded (see
+    load_checkpoint). Otherwise any manifest or dynamic run .resume file left
+    by a previous call which did not finish is removed, so it is not
+    mistaken for this call's, and a new manifest is returned.
+
+    Parameters
+    ----------
+    root_name: str
+        File root. Equivalent to os.path.join(base_dir, file_root).
+    resume: bool
+    kwargs: dict
+        dynamic_goal, ninit, init_step and init_seed (see load_checkpoint).
+
+    Returns
+    -------
+    checkpoint: dict
+    """
+    if resume:
+        return load_checkpoint(root_name, **kwargs)
+    for path in [root_name + '_checkpoint.pkl', root_name + '_dyn.resume']:
+        remove_if_exists(path)
+    checkpoint = {'steps_done': []}
+    checkpoint.update(kwargs)
+    return checkpoint
+
+
+def save_checkpoint(checkpoint, root_name, step, write=True):
+    """Record that a step of run_dypolychord has finished in the checkpoint
+    manifest and save it to [root_name]_checkpoint.pkl.
+
+    Parameters
+    ----------
+    checkpoint: dict
+        Checkpoint manifest (see load_checkpoint for details of its contents).
+        Edited in place.
+    root_name: str
+        File root. Equivalent to os.path.join(base_dir, file_root).
+    step: int
+        Step which has just finished (1, 2, 3 or 4).
+    write: bool, optional
+        Whether to save the manifest to file. If False it is only updated in
+        memory (run_dypolychord only saves manifests when resume=True).
+    """
+    if step not in checkpoint['steps_done']:
+        checkpoint['steps_done'].append(step)
+    if not write:
+        return
+    nestcheck.io_utils.pickle_save(
+        checkpoint, root_name + '_checkpoint', overwrite_existing=True)
+
+
+def load_checkpoint(root_name, **kwargs):
+    """Load the checkpoint manifest saved by a previous call of
+    run_dypolychord, if there is one.
+
+    The manifest is a dictionary containing the list of finished steps
+    ('steps_done'), the settings which must match for the run to be resumed,
+    and the outputs of each finished step needed by the later steps:
+    'step_ndead', 'resume_outputs' and 'final_seed' from Step 1 and the
+    dynamic run's PolyChord settings ('dyn_settings') from Step 2.
+
+    Parameters
+    ----------
+    root_name: str
+        File root. Equivalent to os.path.join(base_dir, file_root).
+    dynamic_goal: float or int
+    ninit: int
+    init_step: int
+    init_seed: int
+        The seed setting of the initial run.
+
+    Returns
+    -------
+    checkpoint: dict
+        Manifest. If no manifest file is found, only contains the input
+        settings and an empty list of finished steps.
+    """
+    checkpoint_settings = {}
+    for key in ['dynamic_goal', 'ninit', 'init_step', 'init_seed']:
+        checkpoint_settings[key] = kwargs.pop(key)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    try:
+        checkpoint = nestcheck.io_utils.pickle_load(
+            root_name + '_checkpoint')
+    except (OSError, IOError, EOFError):
+        checkpoint = {'steps_done': []}
+        checkpoint.update(checkpoint_settings)
+        return checkpoint
+    for key, value in checkpoint_settings.items():
+        assert checkpoint[key] == value, (
+            'Cannot resume: the checkpoint has {0}={1} but you have {0}={2}. '
+            'Use different file_root or resume=False.'.format(
+                key, checkpoint[key], value))
+    return checkpoint
+
+
+def remove_if_exists(path):
+    """Remove a file, doing nothing if it does not exist.
+
+    Parameters
+    ----------
+    path: str
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
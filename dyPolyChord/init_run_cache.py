@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Persistent cache of completed initial exploratory runs (Step 1 of
+run_dypolychord).
+
+The initial run only depends on the likelihood, prior and the settings used
+for it, so it can be reused by later calls of run_dypolychord which only
+change settings such as dynamic_goal or nlive_const. Each cached run is stored
+in its own subdirectory of the cache directory, named using init_run_key,
+containing the initial run's output files, the resume files saved during it
+and a pickle with the remaining information needed for Step 2 (step_ndead,
+resume_outputs and final_seed).
+
+When the total size of the cache exceeds a limit, the least recently used
+entries are removed.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import warnings
+import nestcheck.io_utils
+
+
+def check_init_cache(init_cache, init_run_polychord):
+    """Check the init_cache argument of run_dypolychord.
+
+    Initial runs performed with a different callable to the dynamic run
+    (init_run_polychord) are only cached if init_cache contains 'init_name'
+    identifying it, so they never match runs of a different callable.
+
+    Parameters
+    ----------
+    init_cache: dict or None
+    init_run_polychord: callable or None
+
+    Returns
+    -------
+    init_cache: dict or None
+        None if the initial run cannot be cached.
+    init_name: str or None
+    """
+    if init_cache is None or init_run_polychord is None:
+        return init_cache, None
+    init_name = init_cache.get('init_name')
+    if init_name is None:
+        warnings.warn((
+            'Initial runs performed with init_run_polychord are not '
+            'cached unless init_cache contains "init_name" identifying '
+            'it.'), UserWarning)
+        return None, None
+    return init_cache, init_name
+
+
+def init_run_key(name, settings_dict, **kwargs):
+    """
+    Returns a string identifying an initial exploratory run (Step 1 of
+    run_dypolychord), for use as the name of its entry in a cache
+    directory. This is the input name followed by a
+    hash of all the settings which affect the initial run.
+
+    Parameters
+    ----------
+    name: str
+        Identifies the likelihood and prior (for example
+        '{likelihood_name}_{prior_name}_{prior_scale}_{ndim}d' as in
+        output_processing.settings_root). Runs with different likelihoods or
+        priors must have different names.
+    settings_dict: dict
+        PolyChord settings for the initial run (file_root and base_dir are
+        ignored).
+    init_step: int or None
+        Number of dead points between resume files (None if the initial run
+        does not save resume files).
+    seed_increment: int
+    merge_init: bool, optional
+        Whether the initial run is merged into the final output (False for
+        low fidelity initial runs).
+    init_name: str or None, optional
+        Identifies the callable used for the initial run if it differs from
+        the dynamic run's (None otherwise).
+
+    Returns
+    -------
+    key: str
+    """
+    init_step = kwargs.pop('init_step')
+    seed_increment = kwargs.pop('seed_increment')
+    merge_init = kwargs.pop('merge_init', True)
+    init_name = kwargs.pop('init_name', None)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    items = sorted((key, value) for key, value in settings_dict.items()
+                   if key not in ['file_root', 'base_dir'])
+    items += [('init_step', init_step), ('seed_increment', seed_increment)]
+    if not merge_init or init_name is not None:
+        # Keep the keys of existing cache entries unchanged
+        items += [('merge_init', merge_init), ('init_name', init_name)]
+    digest = hashlib.sha256(repr(items).encode('utf-8')).hexdigest()
+    return '{}_{}'.format(name, digest[:20]).replace('.', '_')
+
+
+def load_init_run(cache_dir, key, root_name):
+    """Copy a cached initial run's files to [root_name]_init*.
+
+    Parameters
+    ----------
+    cache_dir: str
+    key: str
+        Name of the cache entry (see init_run_key).
+    root_name: str
+        File root of the run. Equivalent to os.path.join(base_dir, file_root).
+
+    Returns
+    -------
+    info: dict or None
+        Contains step_ndead, resume_outputs and final_seed (as returned by
+        run_and_save_resumes). None if the run is not in the cache.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    info_path = os.path.join(entry_dir, 'info.pkl')
+    if not os.path.isfile(info_path):
+        return None
+    info = nestcheck.io_utils.pickle_load(info_path[:-4])
+    for filename in info['files']:
+        shutil.copyfile(os.path.join(entry_dir, filename),
+                        root_name + '_init' + filename)
+    # Record the use of the entry for least recently used eviction
+    os.utime(info_path, None)
+    return info
+
+
+def save_init_run(cache_dir, key, root_name, info, max_size=None):
+    """Save an initial run's files to the cache, then evict least recently
+    used entries if the cache is larger than max_size.
+
+    The entry is written to a temporary directory which is then renamed, so
+    other processes never see a partly written entry.
+
+    Parameters
+    ----------
+    cache_dir: str
+    key: str
+        Name of the cache entry (see init_run_key).
+    root_name: str
+        File root of the run. Equivalent to os.path.join(base_dir, file_root).
+    info: dict
+        Contains step_ndead, resume_outputs and final_seed (as returned by
+        run_and_save_resumes). step_ndead and resume_outputs can be None if
+        no resume files were saved.
+    max_size: int or None, optional
+        Maximum total size of the cache in bytes.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    info = dict(info)
+    info['files'] = ['.stats', '_dead-birth.txt', '_dead.txt']
+    if info['step_ndead']:
+        info['files'] += ['_{}.resume'.format(snd)
+                          for snd in sorted(set(info['step_ndead']))]
+    temp_dir = tempfile.mkdtemp(dir=cache_dir, prefix='.' + key)
+    try:
+        for filename in info['files']:
+            shutil.copyfile(root_name + '_init' + filename,
+                            os.path.join(temp_dir, filename))
+        nestcheck.io_utils.pickle_save(
+            info, os.path.join(temp_dir, 'info'), print_time=False)
+        # If another process has already saved the same run then its entry is
+        # kept
+        if not os.path.isdir(entry_dir):
+            os.rename(temp_dir, entry_dir)
+    finally:
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    if max_size is not None:
+        evict(cache_dir, max_size, keep=key)
+
+
+def evict(cache_dir, max_size, keep=None):
+    """Remove the least recently used cache entries until the total size of
+    the cache is at most max_size bytes.
+
+    Parameters
+    ----------
+    cache_dir: str
+    max_size: int
+        Maximum total size in bytes.
+    keep: str or None, optional
+        Key of an entry not to remove (for example one which has just been
+        saved).
+
+    Returns
+    -------
+    removed: list of strs
+        Keys of the removed entries.
+    """
+    entries = []
+    for key in os.listdir(cache_dir):
+        info_path = os.path.join(cache_dir, key, 'info.pkl')
+        if not os.path.isfile(info_path):
+            continue  # not a complete entry
+        size = sum(os.path.getsize(os.path.join(cache_dir, key, filename))
+                   for filename in os.listdir(os.path.join(cache_dir, key)))
+        entries.append((os.path.getmtime(info_path), key, size))
+    total = sum(entry[2] for entry in entries)
+    removed = []
+    for _, key, size in sorted(entries):
+        if total <= max_size:
+            break
+        if key == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+        removed.append(key)
+    return removed
@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+"""
+Functions for the initial exploratory run (Step 1 of run_dypolychord), which
+is performed in chunks saving .resume files so that the dynamic run can be
+resumed from different points, and for analysing it to calculate the
+settings for the dynamic run (Step 2).
+"""
+from __future__ import division  # Enforce float division in python2
+import copy
+import os
+import shutil
+import sys
+import traceback
+import warnings
+import numpy as np
+import nestcheck.data_processing
+import nestcheck.io_utils
+import dyPolyChord.checkpoint
+import dyPolyChord.init_run_cache
+import dyPolyChord.nlive_allocation
+import dyPolyChord.output_processing
+import dyPolyChord.progress_monitor
+import dyPolyChord.read_polychord_output
+# pylint: disable=bare-except
+
+
+def run_initial(run_polychord, settings_dict, checkpoint, **kwargs):
+    """Perform the initial exploratory run (Step 1 of run_dypolychord),
+    unless the checkpoint manifest shows it has already been done or a
+    matching run is found in the init_cache.
+
+    Parameters
+    ----------
+    run_polychord: callable
+        Callable which runs PolyChord with the desired likelihood and prior,
+        and takes a settings dictionary as its argument.
+    settings_dict: dict or None
+        PolyChord settings for the initial run (see init_run_settings). None
+        on MPI ranks other than 0.
+    checkpoint: dict or None
+        Checkpoint manifest (see checkpoint.load_checkpoint), which is
+        updated with the outputs of the initial run. None on MPI ranks other
+        than 0, or if no manifest is used.
+    root_name: str or None
+        File root. Equivalent to os.path.join(base_dir, file_root).
+    init_step: int
+        Number of samples taken between saving .resume files.
+    seed_increment: int
+    save_resumes: bool
+        Whether to save .resume files every init_step samples using
+        run_and_save_resumes. Otherwise PolyChord is run normally.
+    resume: bool, optional
+        Whether to save the checkpoint manifest to file.
+    init_cache: dict or None, optional
+        See run_dypolychord. Initial runs are only looked up in the cache
+        or saved to it on rank 0 and if they are seeded.
+    cache_key_kwargs: dict, optional
+        merge_init and init_name for init_run_cache.init_run_key.
+    progress: dict or None, optional
+        See progress_monitor.start_monitor.
+    comm: None or mpi4py MPI.COMM object, optional
+    compact_outputs: bool, optional
+        See run_and_save_resumes.
+
+    Returns
+    -------
+    step_ndead: list of ints or None
+        None if no resume files were saved.
+    resume_outputs: dict, 2d numpy array or None
+        None if no resume files were saved.
+    final_seed: int
+        All three are None on MPI ranks other than 0.
+    """
+    root_name = kwargs.pop('root_name')
+    init_step = kwargs.pop('init_step')
+    seed_increment = kwargs.pop('seed_increment')
+    save_resumes = kwargs.pop('save_resumes')
+    resume = kwargs.pop('resume', False)
+    init_cache = kwargs.pop('init_cache', None)
+    cache_key_kwargs = kwargs.pop('cache_key_kwargs', {})
+    progress = kwargs.pop('progress', None)
+    comm = kwargs.pop('comm', None)
+    compact_outputs = kwargs.pop('compact_outputs', False)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    rank = 0 if comm is None else comm.Get_rank()
+    keys = ['step_ndead', 'resume_outputs', 'final_seed']
+    if (rank == 0 and settings_dict['seed'] >= 0 and comm is not None and
+            comm.Get_size() > 1):
+        warnings.warn((
+            'N.B. seeded results will not be reproducable when running '
+            'dyPolyChord with multiple MPI processes. You have seed={} '
+            'and {} MPI processes.').format(
+                settings_dict['seed'], comm.Get_size()), UserWarning)
+    if checkpoint is None:
+        checkpoint = {'steps_done': []}
+    steps_done = checkpoint['steps_done']
+    if init_cache is not None and 1 not in steps_done and rank == 0:
+        # Look for a matching initial run in the cache. Unseeded runs are not
+        # cached as reusing them would make repeated runs correlated.
+        cache_key = dyPolyChord.init_run_cache.init_run_key(
+            init_cache['name'], settings_dict,
+            init_step=init_step if save_resumes else None,
+            seed_increment=seed_increment, **cache_key_kwargs)
+        if settings_dict['seed'] >= 0:
+            cache_info = dyPolyChord.init_run_cache.load_init_run(
+                init_cache['cache_dir'], cache_key, root_name)
+            if cache_info is not None:
+                for key in keys:
+                    checkpoint[key] = cache_info[key]
+                dyPolyChord.checkpoint.save_checkpoint(
+                    checkpoint, root_name, 1, write=resume)
+    if (resume or init_cache is not None) and comm is not None:
+        steps_done = comm.bcast(steps_done, root=0)
+    if 1 in steps_done:
+        return tuple(checkpoint.get(key) for key in keys)
+    monitor = dyPolyChord.progress_monitor.start_monitor(
+        progress, settings_dict) if rank == 0 else None
+    try:
+        if save_resumes:
+            outputs = run_and_save_resumes(
+                run_polychord, settings_dict, init_step, seed_increment,
+                comm=comm, compact_outputs=compact_outputs)
+        else:
+            # We definitely won't need to resume midway through in this
+            # case, so just run PolyChod normally
+            run_polychord(settings_dict, comm=comm)
+            outputs = (None, None, None)
+            if rank == 0:
+                final_seed = settings_dict['seed']
+                if final_seed >= 0:
+                    final_seed += seed_increment
+                outputs = (None, None, final_seed)
+    finally:
+        if monitor is not None:
+            monitor.stop()
+    if rank == 0:
+        checkpoint.update(zip(keys, outputs))
+        dyPolyChord.checkpoint.save_checkpoint(
+            checkpoint, root_name, 1, write=resume)
+        if init_cache is not None and settings_dict['seed'] >= 0:
+            dyPolyChord.init_run_cache.save_init_run(
+                init_cache['cache_dir'], cache_key, root_name,
+                dict(zip(keys, outputs)),
+                max_size=init_cache.get('max_size'))
+    return outputs
+
+
+def init_run_settings(settings_dict_in, init_settings, ninit):
+    """Get the PolyChord settings for the initial exploratory run.
+
+    Parameters
+    ----------
+    settings_dict_in: dict
+        PolyChord settings, as returned by
+        run_dynamic_ns.check_settings.
+    init_settings: dict or None
+        Settings which override settings_dict_in for the initial run only
+        (see check_init_settings).
+    ninit: int
+        Number of live points.
+
+    Returns
+    -------
+    settings_dict: dict
+    """
+    settings_dict = phase_settings(settings_dict_in, 'init')
+    settings_dict.update(check_init_settings(init_settings))
+    settings_dict['file_root'] = settings_dict['file_root'] + '_init'
+    settings_dict['nlive'] = ninit
+    return settings_dict
+
+
+def check_init_settings(init_settings):
+    """Check settings which override the PolyChord settings for the initial
+    run (see run_dypolychord).
+
+    Parameters
+    ----------
+    init_settings: dict or None
+
+    Returns
+    -------
+    init_settings: dict
+    """
+    if init_settings is None:
+        return {}
+    for key in ['file_root', 'base_dir', 'nlive', 'nlives', 'max_ndead',
+                'read_resume', 'write_resume', 'write_dead', 'write_stats']:
+        assert key not in init_settings, (
+            'init_settings cannot contain {0} (you tried to specify '
+            '{0}={1})'.format(key, init_settings[key]))
+    return init_settings
+
+
+def phase_settings(settings_dict_in, phase):
+    """Get a copy of the settings for the initial exploratory run (Step 1) or
+    the dynamic run (Step 3).
+
+    The grade_frac setting (the fraction of time PolyChord spends on the
+    parameters with each speed when using fast-slow decomposition) can be a
+    dict with keys 'init' and 'dyn' giving separate values for each run. For
+    example the initial run only needs to estimate where the posterior mass
+    lies, so it can spend a smaller fraction of its time on slow parameters.
+
+    Parameters
+    ----------
+    settings_dict_in: dict
+        PolyChord settings, as returned by
+        run_dynamic_ns.check_settings.
+    phase: str
+        'init' or 'dyn'.
+
+    Returns
+    -------
+    settings_dict: dict
+    """
+    assert phase in ['init', 'dyn'], phase
+    settings_dict = copy.deepcopy(settings_dict_in)
+    if isinstance(settings_dict.get('grade_frac'), dict):
+        settings_dict['grade_frac'] = settings_dict['grade_frac'][phase]
+    return settings_dict
+
+
+def run_and_save_resumes(run_polychord, settings_dict_in, init_step,
+                         seed_increment, comm=None, compact_outputs=False):
+    """
+    Run PolyChord pausing after every init_step dead points to save a resume
+    file.
+
+    Parameters
+    ----------
+    run_polychord: callable
+        Callable which runs PolyChord with the desired likelihood and prior,
+        and takes a settings dictionary as its argument.
+    settings_dict: dict
+        PolyChord settings to use (see run_dynamic_ns.check_settings for
+        information on allowed and default settings).
+    ninit_step: int, optional
+        Number of samples taken between saving .resume files in Step 1.
+    seed_increment: int, optional
+        If seeding is used (PolyChord seed setting >= 0), this increment is
+        added to PolyChord's random seed each time it is run to avoid
+        repeated points.
+        When running in parallel using MPI, PolyChord hashes the seed with the
+        MPI rank using IEOR. Hence you need seed_increment to be > number of
+        processors to ensure no two processes use the same seed.
+        When running repeated results you need to increment the seed used for
+        each run by some number >> seed_increment.
+    comm: None or mpi4py MPI.COMM object, optional
+        For MPI parallelisation.
+    compact_outputs: bool, optional
+        Whether to return resume_outputs as an array rather than a dict.
+
+    Returns
+    -------
+    step_ndead: list of ints
+        Numbers of dead points at which resume files are saved.
+    resume_outputs: dict or 2d numpy array
+        The numbers of dead points and likelihood calls in the .stats file at
+        each resume. If compact_outputs is False, this is a dict with the
+        numbers of dead points as keys and dicts containing 'ndead' and
+        'nlike' as values. Otherwise it is an array with a row of (ndead,
+        nlike) for each resume. See get_resume_counts.
+    final_seed: int
+        Random seed. This is incremented after each run so it can be used
+        when resuming without generating correlated points.
+    """
+    settings_dict = copy.deepcopy(settings_dict_in)
+    # set up rank if running with MPI
+    if comm is not None:
+        # Define variables for rank != 0
+        step_ndead = None
+        resume_outputs = None
+        final_seed = None
+        # Get rank
+        rank = comm.Get_rank()
+    else:
+        rank = 0
+    if rank == 0:
+        root_name = os.path.join(settings_dict['base_dir'],
+                                 settings_dict['file_root'])
+        try:
+            os.remove(root_name + '.resume')
+        except OSError:
+            pass
+        settings_dict['write_resume'] = True
+        settings_dict['read_resume'] = True
+        step_ndead = []
+        resume_outputs = {}
+    add_points = True
+    while add_points:
+        if rank == 0:
+            settings_dict['max_ndead'] = (len(step_ndead) + 1) * init_step
+        run_polychord(settings_dict, comm=comm)
+        if rank == 0:
+            try:
+                if settings_dict['seed'] >= 0:
+                    settings_dict['seed'] += seed_increment
+                ndead, nlike = (
+                    dyPolyChord.read_polychord_output.read_stats_counts(
+                        settings_dict['file_root'], settings_dict['base_dir']))
+                # Store run outputs for getting number of likelihood calls
+                # while accounding for resuming a run.
+                resume_outputs[ndead] = {'ndead': ndead, 'nlike': nlike}
+                step_ndead.append(ndead - settings_dict['nlive'])
+                if len(step_ndead) >= 2 and step_ndead[-1] == step_ndead[-2]:
+                    add_points = False
+                # store resume file in new file path
+                shutil.copyfile(
+                    root_name + '.resume',
+                    root_name + '_' + str(step_ndead[-1]) + '.resume')
+            except:  # pragma: no cover
+                if comm is None or comm.Get_size() == 1:
+                    raise
+                else:
+                    # print error info
+                    traceback.print_exc(file=sys.stdout)
+                    print('Error in process with rank == 0: '
+                          'forcing MPI abort.')
+                    sys.stdout.flush()  # Make sure message prints before abort
+                    comm.Abort(1)
+        if comm is not None:
+            add_points = comm.bcast(add_points, root=0)
+    if rank == 0:
+        final_seed = settings_dict['seed']
+        if compact_outputs:
+            resume_outputs = np.column_stack(
+                get_resume_counts(resume_outputs))
+    return step_ndead, resume_outputs, final_seed
+
+
+def get_resume_counts(resume_outputs):
+    """Get the numbers of dead points and likelihood calls at each resume of
+    the initial run.
+
+    Parameters
+    ----------
+    resume_outputs: dict or 2d numpy array
+        Output of run_and_save_resumes (in either format). Dicts containing
+        the whole .stats file output (from earlier versions of dyPolyChord)
+        can also be used.
+
+    Returns
+    -------
+    ndead: 1d numpy array
+        Numbers of dead points, in increasing order.
+    nlike: 1d numpy array
+        Numbers of likelihood calls (as floats, which may be np.nan if
+        PolyChord did not write them).
+    """
+    if isinstance(resume_outputs, dict):
+        ndead = np.asarray(sorted(resume_outputs.keys()), dtype=float)
+        nlike = np.asarray([resume_outputs[nd]['nlike'] for nd in
+                            sorted(resume_outputs.keys())], dtype=float)
+        return ndead, nlike
+    return resume_outputs[:, 0], resume_outputs[:, 1]
+
+
+def process_initial_run(settings_dict_in, **kwargs):
+    """Loads the initial exploratory run and analyses it to create the settings
+    for the second, dynamic run.
+
+    Parameters
+    ----------
+    settings_dict_in: dict
+        Initial PolyChord settings (see run_dynamic_ns.check_settings for
+        information on allowed and default settings).
+    dynamic_goal: float or int
+        Number in (0, 1) which determines how to allocate computational effort
+        between parameter estimation and evidence calculation. See the dynamic
+        nested sampling paper for more details.
+    nlive_const: int
+        Used to calculate total number of samples if max_ndead not specified in
+        settings. The total number of samples used is the estimated number that
+        would be taken by a nested sampling run with a constant number of live
+        points nlive_const.
+    ninit: int
+        Number of live points to use for the initial exporatory run (Step 1).
+    smoothing_filter: func
+        Smoothing to apply to the nlive allocation (if any).
+    step_ndead: list of ints
+        Numbers of dead points at which resume files are saved.
+    resume_outputs: dict or 2d numpy array
+        Numbers of dead points and likelihood calls at each resume, as
+        returned by run_and_save_resumes.
+    final_seed: int
+        Random seed at the end of the initial run.
+    validation: str, optional
+        Passed to nlive_allocation.allocate.
+    merge_init: bool, optional
+        Whether the initial run will be combined with the dynamic run in the
+        final output. If False (for low fidelity initial runs; see
+        run_dypolychord) the dynamic run samples the whole prior, and ninit is
+        added to its number of live points at every likelihood to replace the
+        initial run's live points.
+    cost_aware: bool, optional
+        Allocate live points using the number of likelihood calls per sample
+        at each likelihood, estimated from the initial run's resume_outputs
+        (or from its .stats file if there are none). See
+        nlive_allocation.get_sample_cost.
+    nlike_tot: int or None, optional
+        Total number of likelihood calls (including the initial run's) when
+        cost_aware=True. If None, the number expected for the total number of
+        samples at the initial run's mean cost per sample is used.
+    """
+    dynamic_goal = kwargs.pop('dynamic_goal')
+    nlive_const = kwargs.pop('nlive_const')
+    ninit = kwargs.pop('ninit')
+    smoothing_filter = kwargs.pop('smoothing_filter')
+    step_ndead = kwargs.pop('step_ndead')
+    resume_outputs = kwargs.pop('resume_outputs')
+    final_seed = kwargs.pop('final_seed')
+    validation = kwargs.pop('validation', 'full')
+    merge_init = kwargs.pop('merge_init', True)
+    cost_aware = kwargs.pop('cost_aware', False)
+    nlike_tot = kwargs.pop('nlike_tot', None)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    init_run = nestcheck.data_processing.process_polychord_run(
+        settings_dict_in['file_root'] + '_init',
+        settings_dict_in['base_dir'])
+    # Calculate max number of samples
+    if settings_dict_in['max_ndead'] > 0:
+        samp_tot = settings_dict_in['max_ndead']
+        assert (settings_dict_in['max_ndead']
+                > init_run['logl'].shape[0]), (
+                    'all points used in init run - '
+                    'none left for dynamic')
+    else:
+        samp_tot = init_run['logl'].shape[0] * (nlive_const / ninit)
+        assert nlive_const > ninit
+    if cost_aware:
+        sample_cost = init_sample_cost(init_run, resume_outputs)
+        # Allocate a budget of likelihood calls instead of samples
+        if nlike_tot is None:
+            samp_tot *= sample_cost.mean()
+        else:
+            samp_tot = nlike_tot
+    else:
+        sample_cost = None
+    dyn_info = dyPolyChord.nlive_allocation.allocate(
+        init_run, samp_tot, dynamic_goal,
+        smoothing_filter=smoothing_filter, validation=validation,
+        sample_cost=sample_cost)
+    if cost_aware:
+        dyn_info['nlike_tot'] = samp_tot
+    root_name = os.path.join(settings_dict_in['base_dir'],
+                             settings_dict_in['file_root'])
+    dyn_info['merge_init'] = merge_init
+    if not merge_init:
+        # The dynamic run needs the initial run's ninit live points as well
+        # as the allocated ones
+        dyn_info['nlives_dict'] = {logl: nlive + ninit for logl, nlive in
+                                   dyn_info['nlives_dict'].items()}
+    elif dyn_info['peak_start_ind'] != 0:
+        # subtract 1 as ndead=1 corresponds to point 0
+        resume_steps = np.asarray(step_ndead) - 1
+        # Work out which resume file to load. This is the first resume file
+        # before dyn_info['peak_start_ind']. If there are no such files then we
+        # do not reload and instead start the second dynamic run by samling
+        # from the entire prior.
+        indexes_before_peak = np.where(
+            resume_steps < dyn_info['peak_start_ind'])[0]
+        if indexes_before_peak.shape[0] > 0:
+            resume_ndead = step_ndead[indexes_before_peak[-1]]
+            # copy resume step to dynamic file root
+            shutil.copyfile(
+                root_name + '_init_' + str(resume_ndead) + '.resume',
+                root_name + '_dyn.resume')
+            # Save resume info
+            dyn_info['resume_ndead'] = resume_ndead
+            ndead, nlike = get_resume_counts(resume_outputs)
+            found = np.where((ndead == resume_ndead) & np.isfinite(nlike))[0]
+            # protect from error reading nlike from .stats file
+            if found.shape[0] > 0:
+                dyn_info['resume_nlike'] = int(nlike[found[0]])
+    nestcheck.io_utils.pickle_save(
+        dyn_info, root_name + '_dyn_info', overwrite_existing=True)
+    if dynamic_goal != 0 and step_ndead:
+        # Remove all the temporary resume files. Use set to avoid
+        # duplicates as these cause OSErrors.
+        for snd in set(step_ndead):
+            os.remove(root_name + '_init_' + str(snd) + '.resume')
+    settings_dict = phase_settings(settings_dict_in, 'dyn')
+    settings_dict['seed'] = final_seed
+    if settings_dict['seed'] >= 0:
+        assert settings_dict_in['seed'] >= 0, (
+            'if input seed was <0 it should not have been edited')
+    if dyn_info['peak_start_ind'] != 0 and merge_init:
+        settings_dict['nlive'] = ninit
+    else:
+        settings_dict['nlive'] = dyn_info['nlives_dict'][
+            min(dyn_info['nlives_dict'].keys())]
+    settings_dict['nlives'] = dyn_info['nlives_dict']
+    # To write .ini files correctly, read_resume must be type bool not
+    # np.bool
+    settings_dict['read_resume'] = (
+        bool(dyn_info['peak_start_ind'] != 0 and merge_init))
+    settings_dict['file_root'] = settings_dict_in['file_root'] + '_dyn'
+    return settings_dict
+
+
+def init_sample_cost(init_run, resume_outputs):
+    """Estimate the number of likelihood calls per sample at each of the
+    initial run's samples (see nlive_allocation.get_sample_cost) from the
+    numbers of dead points and likelihood calls at each resume, or from its
+    .stats file if no resume files were saved.
+
+    Parameters
+    ----------
+    init_run: dict
+        Initial run in nestcheck format, including its .stats file output.
+    resume_outputs: dict, 2d numpy array or None
+        Output of run_and_save_resumes.
+
+    Returns
+    -------
+    sample_cost: 1d numpy array
+    """
+    if resume_outputs is not None and len(resume_outputs) > 0:
+        ndead, nlike = get_resume_counts(resume_outputs)
+    else:
+        ndead = [init_run['output']['ndead']]
+        nlike = [dyPolyChord.output_processing.total_nlike(
+            init_run['output']['nlike'])]
+    return dyPolyChord.nlive_allocation.get_sample_cost(
+        init_run['logl'].shape[0], ndead, nlike)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+"""
+Functions for performing several dynamic nested sampling runs, either one
+after another with different settings (run_dypolychord_batch) or for several
+dynamic goals sharing one initial exploratory run (run_dypolychord_goals).
+"""
+from __future__ import division  # Enforce float division in python2
+import concurrent.futures
+import copy
+import os
+import shutil
+import sys
+import traceback
+import scipy.signal
+import dyPolyChord.checkpoint
+import dyPolyChord.initial_run
+import dyPolyChord.python_likelihoods
+import dyPolyChord.run_dynamic_ns
+import dyPolyChord.storage
+# pylint: disable=bare-except
+
+
+__all__ = ['run_dypolychord_batch', 'run_dypolychord_goals']
+
+
+def run_dypolychord_batch(run_polychord, dynamic_goal, settings_list,
+                          **kwargs):
+    """Performs several dynamic nested sampling runs one after another,
+    overlapping the processing and writing of each run's output (Step 4 of
+    run_dypolychord) with the sampling for the following runs.
+
+    Step 4 is performed on a background thread while the main thread starts
+    the next run. To limit the disk space used by intermediate output files
+    (which are only removed once Step 4 has finished), at most max_pending
+    runs can be waiting for Step 4; when this limit is reached the next run
+    does not start until the oldest has been processed.
+
+    Parameters
+    ----------
+    run_polychord: callable
+        Callable which runs PolyChord with the desired likelihood and prior,
+        and takes a settings dictionary as its argument.
+    dynamic_goal: float or int
+        Number in (0, 1) which determines how to allocate computational effort
+        between parameter estimation and evidence calculation.
+    settings_list: list of dicts
+        PolyChord settings to use for each run. Each must have a different
+        file_root.
+    max_pending: int, optional
+        Maximum number of runs waiting for their output to be processed.
+    kwargs: dict, optional
+        Passed to run_dypolychord (see its docstring for more details).
+    """
+    max_pending = kwargs.pop('max_pending', 1)
+    assert 'executor' not in kwargs, 'executor is set by this function.'
+    assert max_pending >= 1, 'max_pending={}'.format(max_pending)
+    file_roots = [settings.get('file_root', 'temp')
+                  for settings in settings_list]
+    assert len(set(file_roots)) == len(file_roots), (
+        'Each run must have a different file_root: {}'.format(file_roots))
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        for settings in settings_list:
+            # Outputs are processed in order on a single thread, so wait for
+            # the oldest pending runs until there is space in the queue.
+            # Calling result() also raises any errors straight away.
+            pending = [fut for fut in futures if not fut.done()]
+            for fut in pending[:len(pending) - max_pending + 1]:
+                fut.result()
+            for fut in futures:
+                if fut.done():
+                    fut.result()
+            future = dyPolyChord.run_dynamic_ns.run_dypolychord(
+                run_polychord, dynamic_goal, settings, executor=executor,
+                **kwargs)
+            if future is not None:
+                futures.append(future)
+        for fut in futures:
+            fut.result()
+
+
+def run_dypolychord_goals(run_polychord, dynamic_goals, settings_dict_in,
+                          **kwargs):
+    """Performs dynamic nested sampling runs for several different dynamic
+    goals, sharing a single initial exploratory run (Step 1) between them.
+
+    The initial run is performed once, saving resume files every init_step
+    dead points. The allocation of live points is then calculated separately
+    for each goal, and each dynamic run is resumed from its own choice of
+    the initial run's resume files. The dynamic runs (Steps 3 and 4) can be
+    performed concurrently using an executor.
+
+    The output files for each goal have file root
+    [file_root]_dg[dynamic_goal] (with any '.' replaced with '_').
+
+    Parameters
+    ----------
+    run_polychord: callable
+        Callable which runs PolyChord with the desired likelihood and prior,
+        and takes a settings dictionary as its argument.
+    dynamic_goals: list of floats or ints
+        Different dynamic goals, each in [0, 1].
+    settings_dict_in: dict
+        PolyChord settings to use (see run_dynamic_ns.check_settings for
+        information on allowed and default settings).
+    executor: concurrent.futures.Executor or None, optional
+        If not None, the dynamic runs are performed concurrently by submitting
+        them to the executor. Note that pypolychord can only perform one run
+        at a time in each process, so python likelihoods need a
+        concurrent.futures.ProcessPoolExecutor (and a picklable run_polychord)
+        whereas compiled likelihoods can use a ThreadPoolExecutor. Cannot be
+        used with MPI.
+    kwargs: dict, optional
+        nlive_const, ninit, init_step, seed_increment, smoothing_filter,
+        stats_means_errs, clean, comm, validation, compact, parallel_load,
+        init_run_polychord, init_settings, cost_aware, nlike_tot,
+        write_threads, fsync and storage; see the run_dypolychord docstring
+        for more details.
+
+    Returns
+    -------
+    file_roots: dict
+        File roots of the output for each dynamic goal.
+    """
+    try:
+        nlive_const = kwargs.pop('nlive_const', settings_dict_in['nlive'])
+    except KeyError:
+        nlive_const = kwargs.pop('nlive_const', 100)
+    ninit = kwargs.pop('ninit', 10)
+    init_step = kwargs.pop('init_step', ninit)
+    seed_increment = kwargs.pop('seed_increment', 100)
+    default_smoothing = (lambda x: scipy.signal.savgol_filter(
+        x, 1 + (2 * ninit), 3, mode='nearest'))
+    smoothing_filter = kwargs.pop('smoothing_filter', default_smoothing)
+    comm = kwargs.pop('comm', None)
+    stats_means_errs = kwargs.pop('stats_means_errs', True)
+    clean = kwargs.pop('clean', True)
+    executor = kwargs.pop('executor', None)
+    validation = kwargs.pop('validation', 'full')
+    compact = kwargs.pop('compact', False)
+    parallel_load = kwargs.pop('parallel_load', None)
+    init_run_polychord = kwargs.pop('init_run_polychord', None)
+    init_settings = kwargs.pop('init_settings', None)
+    cost_aware = kwargs.pop('cost_aware', False)
+    nlike_tot = kwargs.pop('nlike_tot', None)
+    write_threads = kwargs.pop('write_threads', 1)
+    fsync = kwargs.pop('fsync', False)
+    storage = kwargs.pop('storage', None)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    merge_init = init_run_polychord is None and not init_settings
+    if init_run_polychord is None:
+        init_run_polychord = run_polychord
+    assert executor is None or comm is None or comm.Get_size() == 1, (
+        'executor cannot be used with MPI')
+    file_roots = goal_file_roots(settings_dict_in.get('file_root', 'temp'),
+                                 dynamic_goals)
+    rank = 0 if comm is None else comm.Get_rank()
+    nhit_start = dyPolyChord.python_likelihoods.get_cache_hits(run_polychord)
+    # Step 1: do a single initial run, saving resume files
+    # ----------------------------------------------------
+    settings_dict = None  # define for rank != 0
+    root_name = None
+    output_settings = None
+    if rank == 0:
+        settings_dict_in, output_settings = (
+            dyPolyChord.run_dynamic_ns.check_settings(settings_dict_in))
+        root_name = os.path.join(settings_dict_in['base_dir'],
+                                 settings_dict_in['file_root'])
+        settings_dict = dyPolyChord.initial_run.init_run_settings(
+            settings_dict_in, init_settings, ninit)
+    # The low fidelity initial run (merge_init=False) is not resumed, so
+    # there is no need to save resume files
+    step_ndead, resume_outputs, final_seed = (
+        dyPolyChord.initial_run.run_initial(
+            init_run_polychord, settings_dict, None, root_name=root_name,
+            init_step=init_step, seed_increment=seed_increment,
+            save_resumes=merge_init, comm=comm,
+            compact_outputs=bool(compact)))
+    if not merge_init:
+        step_ndead, resume_outputs = [], {}
+    # Count likelihood calls answered from a CachedLikelihood's cache in the
+    # initial run, which is included in each goal's output if merged
+    init_cached = (dyPolyChord.python_likelihoods.count_cache_hits(
+        run_polychord, nhit_start, comm=comm) if merge_init else 0)
+    # Step 2: calculate an allocation of live points for each goal
+    # -------------------------------------------------------------
+    goal_settings = {}
+    dyn_settings = {}
+    if rank == 0:
+        goal_settings, dyn_settings = allocate_goals(
+            settings_dict_in, file_roots, step_ndead, clean=clean, comm=comm,
+            nlive_const=nlive_const, smoothing_filter=smoothing_filter,
+            resume_outputs=resume_outputs, ninit=ninit, final_seed=final_seed,
+            validation=validation, merge_init=merge_init,
+            cost_aware=cost_aware, nlike_tot=nlike_tot)
+    # Steps 3 and 4: do the dynamic runs and process their output
+    # ------------------------------------------------------------
+    output_kwargs = {'stats_means_errs': stats_means_errs, 'clean': clean,
+                     'comm': comm, 'validation': validation,
+                     'compact': compact, 'parallel_load': parallel_load,
+                     'write_threads': write_threads, 'fsync': fsync,
+                     'storage': storage}
+    if executor is None:
+        for goal in dynamic_goals:
+            run_and_process_dyn(
+                run_polychord, dyn_settings.get(goal),
+                goal_settings.get(goal), output_settings, dynamic_goal=goal,
+                nlike_cached=init_cached, **output_kwargs)
+    else:
+        futures = [executor.submit(
+            run_and_process_dyn, run_polychord, dyn_settings[goal],
+            goal_settings[goal], output_settings, dynamic_goal=goal,
+            nlike_cached=init_cached, **output_kwargs) for goal in
+                   dynamic_goals]
+        for fut in futures:
+            fut.result()
+    return file_roots
+
+
+def goal_file_roots(file_root, dynamic_goals):
+    """Get the file roots of the output for each dynamic goal in
+    run_dypolychord_goals.
+
+    Parameters
+    ----------
+    file_root: str
+    dynamic_goals: list of floats or ints
+
+    Returns
+    -------
+    file_roots: dict
+    """
+    file_roots = {}
+    for goal in dynamic_goals:
+        file_roots[goal] = '{}_dg{}'.format(file_root, goal).replace(
+            '.', '_')
+    assert len(set(file_roots.values())) == len(dynamic_goals), (
+        'dynamic_goals must be unique: {}'.format(dynamic_goals))
+    return file_roots
+
+
+def allocate_goals(settings_dict_in, file_roots, step_ndead, clean=True,
+                   **kwargs):
+    """Calculate the allocation of live points and the settings for each
+    goal's dynamic run (Step 2 of run_dypolychord) for
+    run_dypolychord_goals.
+
+    Each goal is given its own copy of the shared initial run's output and
+    resume files (see link_init_output), which are then processed by
+    initial_run.process_initial_run.
+
+    Parameters
+    ----------
+    settings_dict_in: dict
+        PolyChord settings, as returned by run_dynamic_ns.check_settings.
+    file_roots: dict
+        File root for each dynamic goal.
+    step_ndead: list of ints
+        Numbers of dead points at which resume files were saved.
+    clean: bool, optional
+        Whether to remove the shared initial run's files once they have
+        been copied.
+    comm: None or mpi4py MPI.COMM object, optional
+        For MPI parallelisation (this is only called on rank 0).
+    kwargs: dict
+        Passed to initial_run.process_initial_run.
+
+    Returns
+    -------
+    goal_settings: dict
+        settings_dict_in with each goal's file_root.
+    dyn_settings: dict
+        PolyChord settings for each goal's dynamic run.
+    """
+    comm = kwargs.pop('comm', None)
+    base_dir = settings_dict_in['base_dir']
+    root_name = os.path.join(base_dir, settings_dict_in['file_root'])
+    goal_settings = {}
+    dyn_settings = {}
+    try:
+        for goal, file_root in file_roots.items():
+            goal_settings[goal] = copy.deepcopy(settings_dict_in)
+            goal_settings[goal]['file_root'] = file_root
+            link_init_output(root_name, os.path.join(base_dir, file_root),
+                             step_ndead)
+            dyn_settings[goal] = dyPolyChord.initial_run.process_initial_run(
+                goal_settings[goal], step_ndead=step_ndead,
+                dynamic_goal=goal, **kwargs)
+            # The goal's copies of the resume files are no longer needed
+            # (process_initial_run removes them unless dynamic_goal=0)
+            for snd in set(step_ndead):
+                dyPolyChord.checkpoint.remove_if_exists(os.path.join(
+                    base_dir, file_root + '_init_{}.resume'.format(snd)))
+        if clean:
+            extras = ['_{}.resume'.format(snd) for snd in set(step_ndead)]
+            for extra in extras + ['.resume', '.stats', '_dead-birth.txt',
+                                   '_dead.txt']:
+                dyPolyChord.checkpoint.remove_if_exists(
+                    root_name + '_init' + extra)
+    except:  # pragma: no cover
+        if comm is None or comm.Get_size() == 1:
+            raise
+        else:
+            # print error info
+            traceback.print_exc(file=sys.stdout)
+            print('Error in process with rank == 0: forcing MPI abort.')
+            sys.stdout.flush()  # Make sure message prints before abort
+            comm.Abort(1)
+    return goal_settings, dyn_settings
+
+
+def run_and_process_dyn(run_polychord, settings_dict, settings_dict_in,
+                        output_settings, **kwargs):
+    """Do a dynamic run and process its output (Steps 3 and 4 of
+    run_dypolychord) for run_dypolychord_goals.
+
+    Parameters
+    ----------
+    run_polychord: callable
+    settings_dict: dict or None
+        PolyChord settings for the dynamic run, as returned by
+        initial_run.process_initial_run.
+    settings_dict_in: dict or None
+        PolyChord settings, as returned by run_dynamic_ns.check_settings.
+    output_settings: dict or None
+        Settings for writing output files, as returned by
+        run_dynamic_ns.check_settings.
+    storage: storage.Storage or None, optional
+        If not None, the final output files are put in this storage backend.
+    kwargs: dict
+        Passed to run_dynamic_ns.process_and_save_output. Cache hits in the
+        dynamic run are added to nlike_cached.
+
+    All the settings are None on MPI ranks other than 0, which do not
+    process the output.
+    """
+    comm = kwargs.get('comm')
+    storage = kwargs.pop('storage', None)
+    nhit_start = dyPolyChord.python_likelihoods.get_cache_hits(run_polychord)
+    run_polychord(settings_dict, comm=comm)
+    kwargs['nlike_cached'] = kwargs.get('nlike_cached', 0) + (
+        dyPolyChord.python_likelihoods.count_cache_hits(
+            run_polychord, nhit_start, comm=comm))
+    if comm is None or comm.Get_rank() == 0:
+        dyPolyChord.run_dynamic_ns.process_and_save_output(
+            settings_dict_in, output_settings, None, **kwargs)
+        if storage is not None:
+            dyPolyChord.storage.store_output_files(
+                settings_dict_in['base_dir'], settings_dict_in['file_root'],
+                storage, final_only=kwargs.get('clean', True))
+
+
+def link_init_output(root_name, goal_root_name, step_ndead):
+    """Make the output files and resume files of a shared initial run
+    available under the file root of one of run_dypolychord_goals's dynamic
+    goals. Hard links are used where possible so no extra disk space is
+    needed, with files copied otherwise.
+
+    Parameters
+    ----------
+    root_name: str
+        File root of the shared initial run (excluding '_init').
+    goal_root_name: str
+        File root for the dynamic goal (excluding '_init').
+    step_ndead: list of ints
+        Numbers of dead points at which resume files were saved.
+    """
+    for extra in ['.stats', '_dead-birth.txt', '_dead.txt'] + [
+            '_{}.resume'.format(snd) for snd in set(step_ndead)]:
+        src = root_name + '_init' + extra
+        dst = goal_root_name + '_init' + extra
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except (OSError, AttributeError):  # e.g. file system without links
+            shutil.copyfile(src, dst)
@@ -8,9 +8,11 @@ import itertools
 import numpy as np
 import nestcheck.ns_run_utils
 import nestcheck.data_processing
+import dyPolyChord.output_processing
 
 
-def allocate(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
+def allocate(init_run, samp_tot, dynamic_goal, smoothing_filter=None,
+             validation='full', sample_cost=None):
     """Calculates an allocation of life points for dynamic run, checks the
     output allocation and the smoothing applied, and returns the information
     needed for the dynamic run in a dictionary.
@@ -27,18 +29,35 @@ def allocate(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
     dynamic_goal: float
     smoothing_filter: function or None, optional
         Smoothing for nlive array. Set to None for no smoothing.
+    validation: str, optional
+        How thoroughly to check the inputs and the allocation: 'full',
+        'sampled' or 'off'. With 'full' the sorting of the initial run's logls
+        is checked in full, and the allocation is checked to have a single
+        block of nonzero nlive and no turning points lost when removing
+        repeated values. With 'sampled' the sorting of logls is checked using
+        output_processing.check_sorted(validation='sampled') and the
+        allocation checks are skipped, and with 'off' no checks are
+        performed. The checks needed to choose between the smoothed and
+        unsmoothed allocations when dynamic_goal=0 are always performed.
+    sample_cost: 1d numpy array or None, optional
+        Passed to dyn_nlive_array. If not None, samp_tot is a total number of
+        likelihood calls rather than samples.
 
     Returns
     -------
     dyn_info: dict
     """
-    assert np.all(np.diff(init_run['logl']) >= 0), (
-        'the minimum logl diff is {}'.format(np.diff(init_run['logl']).min()))
+    assert validation in ['full', 'sampled', 'off'], (
+        'validation={} not in ["full", "sampled", "off"]'.format(validation))
+    dyPolyChord.output_processing.check_sorted(
+        init_run['logl'], validation=validation)
     # Calculate nlive allocation with and without smoothing
     nlives = dyn_nlive_array(init_run, samp_tot, dynamic_goal,
-                             smoothing_filter=smoothing_filter)
+                             smoothing_filter=smoothing_filter,
+                             sample_cost=sample_cost)
     nlives_unsmoothed = dyn_nlive_array(init_run, samp_tot, dynamic_goal,
-                                        smoothing_filter=None)
+                                        smoothing_filter=None,
+                                        sample_cost=sample_cost)
     # Perform some checks
     if dynamic_goal == 0:
         if not np.all(np.diff(nlives) <= 0):
@@ -58,19 +77,21 @@ def allocate(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
             'For most likelihoods we expect this to equal zero (although '
             'it may be nonzero if there is significant posterior mass '
             'at the edge of the prior).'.format(nlives[0]), UserWarning)
-    assert nlives.min() == 0
-    # Find number of blocks where nlive is nonzero
-    nonzero_blocks = np.asarray(
-        [k for k, g in itertools.groupby(nlives != 0)])
-    assert nonzero_blocks.sum() == 1, (
-        'nlive becomes zero then becomes nonzero! nonzero_blocks='
-        + str(nonzero_blocks))
+    if validation != 'off':
+        assert nlives.min() == 0
     # Get the indexes of nlives points which are different to the previous
     # points (i.e. remove consecutive duplicates, keeping first occurance)
     inds_to_use = np.concatenate(
         (np.asarray([0]), np.where(np.diff(nlives) != 0)[0] + 1))
-    assert (count_turning_points(nlives) ==
-            count_turning_points(nlives[inds_to_use]))
+    if validation == 'full':
+        # Find number of blocks where nlive is nonzero
+        nonzero = (nlives != 0).astype(int)
+        nonzero_blocks = nonzero[0] + (np.diff(nonzero) == 1).sum()
+        assert nonzero_blocks == 1, (
+            'nlive becomes zero then becomes nonzero! nonzero_blocks='
+            + str(nonzero_blocks))
+        assert (count_turning_points(nlives) ==
+                count_turning_points(nlives[inds_to_use]))
     # Check logl = approx -inf is mapped to the starting number of live points
     nlives_dict = {-1.e100: int(nlives[0])}
     for ind in inds_to_use:
@@ -83,7 +104,8 @@ def allocate(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
     return dyn_info
 
 
-def dyn_nlive_array(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
+def dyn_nlive_array(init_run, samp_tot, dynamic_goal, smoothing_filter=None,
+                    sample_cost=None):
     r"""Calculate the dynamic nlive allocation from the theoretical, point
     importance-based allocation. This allows for the samples taken in the
     initial run, including areas where more samples than were needed have been
@@ -97,6 +119,14 @@ def dyn_nlive_array(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
 
     where :math:`n` is the local number of live points.
 
+    If the cost of each sample :math:`c(\log X)` (the number of likelihood
+    calls PolyChord needs to generate it) is specified, the allocation is
+    instead proportional to importance divided by :math:`\sqrt{c}`, which
+    minimises the variance of the results for a fixed number of likelihood
+    calls, and samp_tot is the expected number of likelihood calls
+
+    .. math:: N_\mathrm{like} = \int c(\log X) n(\log X) \mathrm{d}\log X.
+
     See Appendix F of "Dynamic nested sampling: an improved algorithm for
     parameter estimation and evidence calculation" (Higson et al., 2019) for
     more information.
@@ -113,6 +143,10 @@ def dyn_nlive_array(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
     dynamic_goal: float
     smoothing_filter: function or None, optional
         Smoothing for nlive array. Set to None for no smoothing.
+    sample_cost: 1d numpy array or None, optional
+        Number of likelihood calls per sample at each likelihood in
+        init_run['logl'] (see get_sample_cost). If None, all samples are
+        assumed to have the same cost.
 
     Returns
     -------
@@ -120,13 +154,21 @@ def dyn_nlive_array(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
         Number of live points corresponding to each likelihood in
         init_run['logl'].
     """
-    assert samp_tot > init_run['logl'].shape[0]
+    if sample_cost is None:
+        sample_cost = np.ones(init_run['logl'].shape[0])
+    assert samp_tot > sample_cost.sum()
     # Calculate the importance of each point
-    importance = sample_importance(init_run, dynamic_goal)
+    importance = (sample_importance(init_run, dynamic_goal)
+                  / np.sqrt(sample_cost))
+    if dynamic_goal == 0:
+        # Evidence importance decreases with logl, so keep the allocation
+        # non-increasing even if the cost falls
+        importance = np.minimum.accumulate(importance)
     # Calculate theoretical nlive allocation, which is proportional to
-    # importance and normalised to produce an expected samp_tot samples
+    # importance and normalised to produce an expected samp_tot samples (or
+    # likelihood calls)
     logx_init = nestcheck.ns_run_utils.get_logx(init_run['nlive_array'])
-    norm = samp_tot / np.abs(np.trapz(importance, x=logx_init))
+    norm = samp_tot / np.abs(np.trapz(importance * sample_cost, x=logx_init))
     importance_nlive = importance * norm
     # Account for the points already sampled
     importance_nlive -= init_run['nlive_array'][0]
@@ -137,11 +179,61 @@ def dyn_nlive_array(init_run, samp_tot, dynamic_goal, smoothing_filter=None):
     nlive_array = np.clip(nlive_array, 0, None)
     # Renormalise to account for nlives below zero (i.e. regions where we have
     # already taken too many samples) as we cannot take negative samples.
-    samp_remain = samp_tot - init_run['logl'].shape[0]
-    nlive_array *= samp_remain / np.abs(np.trapz(nlive_array, x=logx_init))
+    samp_remain = samp_tot - sample_cost.sum()
+    nlive_array *= samp_remain / np.abs(
+        np.trapz(nlive_array * sample_cost, x=logx_init))
     return np.rint(nlive_array)
 
 
+def get_sample_cost(nsample, ndead, nlike):
+    """Estimate the number of likelihood calls used to generate each sample
+    of a run from the numbers of dead points and likelihood calls recorded at
+    checkpoints during the run (for example the initial run's resume files).
+
+    The cost of samples between consecutive checkpoints is the change in the
+    number of likelihood calls divided by the change in the number of dead
+    points. Samples after the last checkpoint are given the cost of the
+    samples before it. Checkpoints without new dead points or with an unknown
+    (non-finite) number of likelihood calls are skipped, and if none are
+    left all samples are given a cost of 1 with a warning.
+
+    Parameters
+    ----------
+    nsample: int
+        Number of samples in the run.
+    ndead: 1d numpy array
+        Number of dead points at each checkpoint.
+    nlike: 1d numpy array
+        Number of likelihood calls at each checkpoint.
+
+    Returns
+    -------
+    sample_cost: 1d numpy array
+        Likelihood calls per sample for each of the run's samples, in order
+        of increasing logl.
+    """
+    order = np.argsort(ndead)
+    ndead = np.concatenate(([0], np.asarray(ndead)[order]))
+    nlike = np.concatenate(([0], np.asarray(nlike, dtype=float)[order]))
+    # Ignore checkpoints with no new dead points (e.g. when the run finished
+    # before reaching max_ndead) and with unknown numbers of likelihood calls
+    # (PolyChord writes asterisks in .stats files when they are too large)
+    dndead = np.diff(ndead)
+    dnlike = np.diff(nlike)
+    keep = (dndead > 0) & np.isfinite(dnlike) & (dnlike > 0)
+    if not np.any(keep):
+        warnings.warn((
+            'Cannot estimate the cost of samples from ndead={} and nlike={}. '
+            'I am assuming all samples have the same cost.').format(
+                ndead[1:], nlike[1:]), UserWarning)
+        return np.ones(nsample)
+    rates = dnlike[keep] / dndead[keep].astype(float)
+    ends = ndead[1:][keep]
+    # Sample i is dead point number i + 1
+    inds = np.searchsorted(ends, np.arange(1, nsample + 1))
+    return rates[np.minimum(inds, rates.shape[0] - 1)]
+
+
 def sample_importance(run, dynamic_goal):
     """
     Calculate the importance of each sample in the run.
@@ -2,12 +2,15 @@
 """
 Functions for loading and processing dyPolyChord dynamic nested sampling runs.
 """
+import functools
 import os
 import warnings
 import numpy as np
+import scipy.special
 import nestcheck.ns_run_utils
 import nestcheck.data_processing
 import nestcheck.io_utils as iou
+import dyPolyChord.read_polychord_output
 
 
 def settings_root(likelihood_name, prior_name, ndim, **kwargs):
@@ -66,6 +69,23 @@ def process_dypolychord_run(file_root, base_dir, **kwargs):
     dup_warn: bool, optional
         Whether to give a UserWarning if there are duplicate point
         loglikelihood values.
+    nlike_cached: int, optional
+        Number of likelihood calls which were answered from a cache (see
+        python_likelihoods.CachedLikelihood) rather than evaluated. These are
+        subtracted from the number of likelihood calls in run['output'].
+    validation: str, optional
+        How thoroughly to check the combined run: 'full', 'sampled' or 'off'
+        (see check_run).
+    compact: bool or str, optional
+        If True, the initial and dynamic runs are converted with compact_run
+        as soon as they are loaded, so the combined run stores thread_labels
+        and nlive_array as int32. If 'float32', theta is also stored as
+        float32. logl is always float64.
+    parallel_load: dict or None, optional
+        If not None, the initial and dynamic runs' output files are loaded
+        with read_polychord_output.process_polychord_run, which parses the
+        dead-birth files in parallel. The dict contains its keyword arguments
+        (for example nproc and chunk_size).
 
     Returns
     -------
@@ -77,19 +97,32 @@ def process_dypolychord_run(file_root, base_dir, **kwargs):
     dynamic_goal = kwargs.pop('dynamic_goal')
     dup_assert = kwargs.pop('dup_assert', False)
     dup_warn = kwargs.pop('dup_warn', False)
+    nlike_cached = kwargs.pop('nlike_cached', 0)
+    validation = kwargs.pop('validation', 'full')
+    compact = kwargs.pop('compact', False)
+    parallel_load = kwargs.pop('parallel_load', None)
     if kwargs:
         raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
-    init = nestcheck.data_processing.process_polychord_run(
-        file_root + '_init', base_dir, dup_assert=dup_assert,
-        dup_warn=dup_warn)
-    assert np.all(init['thread_min_max'][:, 0] == -np.inf), (
-        'Initial run contains threads not starting at -inf.\n'
-        'thread_min_max=' + str(init['thread_min_max']))
-    dyn = nestcheck.data_processing.process_polychord_run(
-        file_root + '_dyn', base_dir, dup_assert=dup_assert,
-        dup_warn=dup_warn)
+    assert compact in [False, True, 'float32'], (
+        'compact={} not in [False, True, "float32"]'.format(compact))
+    if parallel_load is None:
+        load_run = nestcheck.data_processing.process_polychord_run
+    else:
+        load_run = functools.partial(
+            dyPolyChord.read_polychord_output.process_polychord_run,
+            **parallel_load)
     dyn_info = iou.pickle_load(os.path.join(
         base_dir, file_root + '_dyn_info'))
+    if dyn_info.get('merge_init', True):
+        init = load_run(file_root + '_init', base_dir)
+        if compact:
+            compact_run(init, float32_theta=(compact == 'float32'))
+        assert np.all(init['thread_min_max'][:, 0] == -np.inf), (
+            'Initial run contains threads not starting at -inf.\n'
+            'thread_min_max=' + str(init['thread_min_max']))
+    dyn = load_run(file_root + '_dyn', base_dir)
+    if compact:
+        compact_run(dyn, float32_theta=(compact == 'float32'))
     if dynamic_goal == 0:
         # If dynamic_goal == 0 then nlive should only decrease, so check all
         # threads start by sampling
@@ -98,14 +131,30 @@ def process_dypolychord_run(file_root, base_dir, **kwargs):
     # Get info to run
     run_output = {'file_root': file_root,
                   'base_dir': base_dir}
-    if 'resume_ndead' not in dyn_info:
+    if not dyn_info.get('merge_init', True):
+        # The initial run was a low fidelity run only used for calculating
+        # the allocation of live points (see run_dynamic_ns.run_dypolychord),
+        # so the output is just the dynamic run.
+        run = dyn
+        try:
+            run_output['nlike'] = total_nlike(dyn['output']['nlike'])
+        except KeyError:
+            pass # protect from error reading nlike from .stats file
+    elif 'resume_ndead' not in dyn_info:
         # The dynamic run was not resumed part way through the initial run:
         # hence there are no samples repeated in both runs' files and we can
-        # simply combine dyn and init using standard nestcheck functions.
-        run = nestcheck.ns_run_utils.combine_ns_runs([init, dyn])
+        # simply combine dyn and init using standard nestcheck functions
+        # (nestcheck requires int64 thread labels, so compact runs are
+        # combined with combine_run_threads instead).
+        if compact:
+            dyn['thread_labels'] += init['thread_min_max'].shape[0]
+            run = combine_run_threads([init, dyn])
+        else:
+            run = nestcheck.ns_run_utils.combine_ns_runs([init, dyn])
         try:
             run_output['nlike'] = (
-                init['output']['nlike'] + dyn['output']['nlike'])
+                total_nlike(init['output']['nlike'])
+                + total_nlike(dyn['output']['nlike']))
         except KeyError:
             pass # protect from error reading nlike from .stats file
     else:
@@ -114,17 +163,136 @@ def process_dypolychord_run(file_root, base_dir, **kwargs):
         run = combine_resumed_dyn_run(init, dyn, dyn_info['resume_ndead'])
         try:
             run_output['nlike'] = (
-                init['output']['nlike'] + dyn['output']['nlike']
+                total_nlike(init['output']['nlike'])
+                + total_nlike(dyn['output']['nlike'])
                 - dyn_info['resume_nlike'])
         except KeyError:
             pass # protect from error reading nlike from .stats file
+    if nlike_cached and 'nlike' in run_output:
+        run_output['nlike'] -= nlike_cached
     run['output'] = run_output
-    # check the nested sampling run has the expected properties
-    nestcheck.ns_run_utils.check_ns_run(
-        run, dup_assert=dup_assert, dup_warn=dup_warn)
+    # check the nested sampling run has the expected properties. Duplicates are
+    # checked once for the combined run (which contains all the points in
+    # init and dyn) rather than separately for each run.
+    check_run(run, dup_assert=dup_assert, dup_warn=dup_warn,
+              validation=validation)
     return run
 
 
+def total_nlike(nlike):
+    """
+    Get the total number of likelihood calls from the nlike value read from a
+    PolyChord .stats file. When PolyChord uses fast-slow sampling (more than
+    one parameter speed), nestcheck reads nlike as a list with the number of
+    calls for each speed, and these are summed as in
+    read_polychord_output.read_stats_counts.
+
+    Parameters
+    ----------
+    nlike: int, float or list
+
+    Returns
+    -------
+    nlike: int or float
+    """
+    if isinstance(nlike, (list, tuple, np.ndarray)):
+        return sum(nlike)
+    return nlike
+
+
+def reweight_run(run, **kwargs):
+    """
+    Importance reweight a nested sampling run to a modified likelihood and/or
+    prior, without doing a new run.
+
+    The changes are specified as functions giving the change in log-likelihood
+    and log-prior density, which are evaluated on the run's samples in batches.
+    Each sample's posterior weight is multiplied by the exponential of the sum
+    of the changes. The new prior should be normalised for the new evidence
+    estimate to be correct.
+
+    Reweighting only gives accurate results if the modified posterior is well
+    sampled by the original run. A UserWarning is given if the effective sample
+    size falls below min_ess_ratio times its value for the original run, in
+    which case a new run is recommended.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run in nestcheck format (for example from
+        process_dypolychord_run).
+    delta_logl: func or None, optional
+        Maps a 2d array of parameter values (one row per sample) to a 1d array
+        of the differences between the new and old log-likelihoods.
+    delta_logprior: func or None, optional
+        Maps a 2d array of parameter values (one row per sample) to a 1d array
+        of the differences between the new and old log-prior densities.
+    batch_size: int, optional
+        Number of samples to pass to delta_logl and delta_logprior at once.
+    min_ess_ratio: float, optional
+        See above.
+
+    Returns
+    -------
+    reweighted: dict
+        Contains the new log-likelihoods ('logl'), log posterior weights
+        ('logw'), evidence estimate ('logz'), effective sample size ('ess')
+        and its ratio to the original run's effective sample size
+        ('ess_ratio').
+    """
+    delta_logl = kwargs.pop('delta_logl', None)
+    delta_logprior = kwargs.pop('delta_logprior', None)
+    batch_size = kwargs.pop('batch_size', 10000)
+    min_ess_ratio = kwargs.pop('min_ess_ratio', 0.1)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    nsamp = run['logl'].shape[0]
+    deltas = {}
+    for name, func in [('logl', delta_logl), ('logprior', delta_logprior)]:
+        deltas[name] = np.zeros(nsamp)
+        if func is None:
+            continue
+        for start in range(0, nsamp, batch_size):
+            batch = deltas[name][start:start + batch_size]
+            batch[:] = func(run['theta'][start:start + batch_size, :])
+    logw_old = nestcheck.ns_run_utils.get_logw(run)
+    logw = logw_old + deltas['logl'] + deltas['logprior']
+    assert np.any(logw > -np.inf), 'All samples have zero reweighted weight'
+    reweighted = {'logl': run['logl'] + deltas['logl'],
+                  'logw': logw,
+                  'logz': scipy.special.logsumexp(logw),
+                  'ess': effective_sample_size(logw)}
+    reweighted['ess_ratio'] = (reweighted['ess'] /
+                               effective_sample_size(logw_old))
+    if reweighted['ess_ratio'] < min_ess_ratio:
+        warnings.warn((
+            'Reweighting reduced the effective sample size from {0:.1f} to '
+            '{1:.1f} (ratio {2:.3f} < min_ess_ratio={3}). The modified '
+            'posterior is not well sampled by the run, so results may be '
+            'inaccurate: consider doing a new run.').format(
+                effective_sample_size(logw_old), reweighted['ess'],
+                reweighted['ess_ratio'], min_ess_ratio), UserWarning)
+    return reweighted
+
+
+def effective_sample_size(logw):
+    """
+    Kish's effective sample size (sum w)^2 / sum(w^2) for samples with
+    weights w.
+
+    Parameters
+    ----------
+    logw: 1d numpy array
+        Log sample weights (need not be normalised).
+
+    Returns
+    -------
+    ess: float
+    """
+    w_rel = np.exp(logw - logw.max())
+    return w_rel.sum() ** 2 / (w_rel ** 2).sum()
+
+
 def combine_resumed_dyn_run(init, dyn, resume_ndead):
     """
     Merge initial run and dynamic run which was resumed from it, including
@@ -153,53 +321,504 @@ def combine_resumed_dyn_run(init, dyn, resume_ndead):
     for key in ['nlive_array', 'logl', 'thread_labels']:
         init[key] = init[key][resume_ndead:]
     # We also need to remove the points that were live when the resume file was
-    # written, as these show up as samples in both dyn and init
-    live_inds = []
-    empty_thread_inds = []
-    for i, th_lab in enumerate(np.unique(init['thread_labels'])):
-        th_inds = np.where(init['thread_labels'] == th_lab)[0]
-        live_logl = init['logl'][th_inds[0]]
-        init['thread_min_max'][i, 0] = live_logl
-        if np.where(dyn['logl'] == live_logl)[0].shape[0] > 0:
-            live_inds.append(th_inds[0])
-            if th_inds.shape[0] == 1:
-                empty_thread_inds.append(i)
-        else:
-            warnings.warn(
-                ('Expected live point at resume should be present in dynamic '
-                 'run. If there are no further errors, this warning can be '
-                 'ignored.\nlogl={}, th_lab={}, inds={}, init samples (after '
-                 'removing first resume_ndead)={}, unique threads in init={}, '
-                 'dyn samples={}, resume_ndead={}.').format(
-                     str(live_logl), th_lab,
-                     np.where(dyn['logl'] == live_logl),
-                     init['logl'].shape[0],
-                     np.unique(init['thread_labels']).shape[0],
-                     dyn['logl'].shape[0], resume_ndead), UserWarning)
+    # written, as these show up as samples in both dyn and init. These are the
+    # first point in each thread of init (as its points are sorted by logl).
+    _, first_inds, counts = np.unique(
+        init['thread_labels'], return_index=True, return_counts=True)
+    live_logl = init['logl'][first_inds]
+    init['thread_min_max'][:first_inds.shape[0], 0] = live_logl
+    in_dyn = match_logl(live_logl, dyn['logl']) >= 0
+    for i in np.where(~in_dyn)[0]:
+        warnings.warn(
+            ('Expected live point at resume should be present in dynamic '
+             'run. If there are no further errors, this warning can be '
+             'ignored.\nlogl={}, th_lab={}, init samples (after '
+             'removing first resume_ndead)={}, unique threads in init={}, '
+             'dyn samples={}, resume_ndead={}.').format(
+                 str(live_logl[i]), init['thread_labels'][first_inds[i]],
+                 init['logl'].shape[0], first_inds.shape[0],
+                 dyn['logl'].shape[0], resume_ndead), UserWarning)
+    live_inds = first_inds[in_dyn]
+    empty_thread_inds = np.where(in_dyn & (counts == 1))[0]
     # Remove the live points at resume from init
     init['theta'] = np.delete(init['theta'], live_inds, axis=0)
     for key in ['nlive_array', 'logl', 'thread_labels']:
         init[key] = np.delete(init[key], live_inds)
     # Deal with the case that one of the threads is now empty
-    if empty_thread_inds:
+    if empty_thread_inds.shape[0] > 0:
         # remove any empty threads from logl_min_max
         init['thread_min_max'] = np.delete(
             init['thread_min_max'], empty_thread_inds, axis=0)
         # Now we need to reorder the thread labels to avoid gaps
-        thread_labels_new = np.full(init['thread_labels'].shape, np.nan)
-        for i, th_lab in enumerate(np.unique(init['thread_labels'])):
-            inds = np.where(init['thread_labels'] == th_lab)[0]
-            thread_labels_new[inds] = i
-            # Check the newly relabelled thread label matches thread_min_max
-            assert init['thread_min_max'][i, 0] <= init['logl'][inds[0]]
-            assert init['thread_min_max'][i, 1] == init['logl'][inds[-1]]
-        assert np.all(~np.isnan(thread_labels_new))
-        init['thread_labels'] = thread_labels_new.astype(int)
+        _, thread_labels_new = np.unique(
+            init['thread_labels'], return_inverse=True)
+        # Check the newly relabelled thread labels match thread_min_max
+        first_inds, last_inds = thread_end_inds(thread_labels_new)
+        assert np.all(init['thread_min_max'][:, 0] <=
+                      init['logl'][first_inds])
+        assert np.all(init['thread_min_max'][:, 1] ==
+                      init['logl'][last_inds])
+        init['thread_labels'] = thread_labels_new.astype(
+            init['thread_labels'].dtype)
     # Add the init threads to dyn with new labels that continue on from the dyn
     # labels
     init['thread_labels'] += dyn['thread_min_max'].shape[0]
-    run = nestcheck.ns_run_utils.combine_threads(
-        nestcheck.ns_run_utils.get_run_threads(dyn) +
-        nestcheck.ns_run_utils.get_run_threads(init),
-        assert_birth_point=False)
+    return combine_run_threads([dyn, init])
+
+
+def combine_run_threads(run_list):
+    """
+    Combine the threads of several runs into a single run, where some
+    threads may start part way through the run.
+
+    Equivalent to
+
+    .. code-block:: python
+
+        nestcheck.ns_run_utils.combine_threads(
+            sum([nestcheck.ns_run_utils.get_run_threads(run)
+                 for run in run_list], []))
+
+    but using a single sort rather than splitting the runs into threads, so
+    the cost is O(n log n) in the number of samples rather than O(n) per
+    thread. The only difference is when a thread's starting logl is shared by
+    several samples: the first is used rather than one chosen at random.
+
+    The dtypes of the first run's thread_labels, nlive_array (if present) and
+    theta are kept (see compact_run).
+
+    Parameters
+    ----------
+    run_list: list of dicts
+        Runs in nestcheck format. Their thread labels must be distinct and
+        together number the rows of their stacked thread_min_max arrays.
+
+    Returns
+    -------
+    run: dict
+        Combined run in nestcheck format.
+    """
+    thread_min_max = np.vstack([run['thread_min_max'] for run in run_list])
+    logl = np.concatenate([run['logl'] for run in run_list])
+    order = np.argsort(logl, kind='mergesort')
+    # Make array with columns [logl, thread label, change in nlive] for use
+    # with nestcheck.ns_run_utils.dict_given_run_array. theta is combined
+    # separately so it is not copied into a float64 array.
+    samples = np.zeros((logl.shape[0], 3))
+    samples[:, 0] = logl[order]
+    samples[:, 1] = np.concatenate(
+        [run['thread_labels'] for run in run_list])[order]
+    # nlive decreases by 1 at the end of each thread...
+    _, last_inds = thread_end_inds(samples[:, 1])
+    samples[last_inds, 2] -= 1
+    # ...and increases by 1 at the point where each thread which does not
+    # sample the whole prior starts (or the nearest point if it is missing).
+    logl_starts = thread_min_max[:, 0][thread_min_max[:, 0] != -np.inf]
+    inds = match_logl(logl_starts, samples[:, 0])
+    missing = np.where(inds == -1)[0]
+    if missing.shape[0] > 0:
+        pos = np.searchsorted(samples[:, 0], logl_starts[missing])
+        below = np.maximum(pos - 1, 0)
+        above = np.minimum(pos, samples.shape[0] - 1)
+        inds[missing] = np.where(
+            np.abs(samples[above, 0] - logl_starts[missing]) <
+            np.abs(samples[below, 0] - logl_starts[missing]), above, below)
+    np.add.at(samples[:, 2], inds, 1)
+    run = nestcheck.ns_run_utils.dict_given_run_array(samples, thread_min_max)
+    run['theta'] = np.concatenate(
+        [run_in['theta'] for run_in in run_list])[order]
+    run['thread_labels'] = run['thread_labels'].astype(
+        run_list[0]['thread_labels'].dtype)
+    if 'nlive_array' in run_list[0]:
+        run['nlive_array'] = run['nlive_array'].astype(
+            run_list[0]['nlive_array'].dtype)
     return run
+
+
+def compact_run(run, float32_theta=False):
+    """
+    Convert a run's thread_labels and nlive_array to int32 in place, and
+    optionally its theta to float32. logl is kept as float64 so samples are
+    ordered exactly as in the output files.
+
+    For runs with many parameters this roughly halves the memory used by the
+    run if float32_theta is True. Other dyPolyChord functions keep the dtypes
+    of compact runs. nestcheck functions which check runs (such as
+    nestcheck.ns_run_utils.check_ns_run) require int64 thread labels; use
+    check_run instead.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run in nestcheck format.
+    float32_theta: bool, optional
+
+    Returns
+    -------
+    run: dict
+        The input run.
+    """
+    assert run['thread_min_max'].shape[0] < np.iinfo(np.int32).max
+    run['thread_labels'] = run['thread_labels'].astype(np.int32)
+    nlive_array = run['nlive_array'].astype(np.int32)
+    assert np.array_equal(nlive_array, run['nlive_array']), (
+        'nlive_array contains non-integer values: {}'.format(
+            run['nlive_array']))
+    run['nlive_array'] = nlive_array
+    if float32_theta:
+        run['theta'] = run['theta'].astype(np.float32)
+    return run
+
+
+def resample_counts(logw, **kwargs):
+    """
+    Get the number of copies of each sample to include in a set of equally
+    weighted posterior samples.
+
+    Uses systematic or residual resampling, both of which produce a fixed
+    number of samples in O(n) operations. The counts for systematic resampling
+    differ from their expected values (nsample times the sample's normalised
+    weight) by less than 2, so the resulting equally weighted samples have
+    much less noise than those from independently accepting or rejecting each
+    sample.
+
+    Parameters
+    ----------
+    logw: 1d numpy array
+        Log posterior weights of the samples (for example from
+        nestcheck.ns_run_utils.get_logw).
+    nsample: int or None, optional
+        Total number of equally weighted samples. If None, this is set to the
+        expected number of samples from accepting each sample with probability
+        equal to its weight divided by the maximum weight (as in
+        nestcheck.write_polychord_output.write_run_output).
+    method: str, optional
+        Either 'systematic' or 'residual'.
+    seed: int or None, optional
+        Seed for the random number generator. A numpy.random.RandomState
+        instance is used so results do not depend on numpy's global random
+        state.
+
+    Returns
+    -------
+    counts: 1d numpy array of ints
+        Number of copies of each sample. Sums to nsample.
+    """
+    nsample = kwargs.pop('nsample', None)
+    method = kwargs.pop('method', 'systematic')
+    seed = kwargs.pop('seed', None)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    assert method in ['systematic', 'residual'], (
+        'method={} not in ["systematic", "residual"]'.format(method))
+    w_rel = np.exp(logw - logw.max())
+    if nsample is None:
+        nsample = int(np.round(w_rel.sum()))
+    state = np.random.RandomState(seed)
+    if method == 'systematic':
+        return systematic_counts(w_rel, nsample, state.random_sample())
+    # Residual resampling: deterministically take floor(nsample * w) copies of
+    # each sample, then use systematic resampling for the remainder
+    nw = w_rel * (nsample / w_rel.sum())
+    counts = np.floor(nw).astype(int)
+    nresidual = nsample - counts.sum()
+    if nresidual > 0:
+        counts += systematic_counts(
+            nw - counts, nresidual, state.random_sample())
+    return counts
+
+
+def systematic_counts(weights, nsample, rand):
+    """
+    Systematic resampling: the number of copies of each sample is the number of
+    the evenly spaced points (rand + k) / nsample with k = 0, ..., nsample - 1
+    which lie in its interval of the normalised cumulative weights.
+
+    Parameters
+    ----------
+    weights: 1d numpy array
+        Non-negative sample weights (need not be normalised).
+    nsample: int
+        Total number of samples.
+    rand: float
+        Random number in [0, 1).
+
+    Returns
+    -------
+    counts: 1d numpy array of ints
+    """
+    cum_weights = np.cumsum(weights)
+    cum_weights /= cum_weights[-1]
+    cum_counts = np.clip(np.ceil(cum_weights * nsample - rand), 0, nsample)
+    cum_counts[-1] = nsample
+    return np.diff(np.concatenate(([0], cum_counts))).astype(int)
+
+
+def resample_inds_chunks(counts, chunk_size):
+    """
+    Generator giving the indexes of equally weighted posterior samples in
+    chunks, so the samples can be processed or written without first making
+    an array containing all of them.
+
+    Parameters
+    ----------
+    counts: 1d numpy array of ints
+        Number of copies of each sample (see resample_counts).
+    chunk_size: int
+        Number of input samples covered by each chunk.
+
+    Yields
+    ------
+    inds: 1d numpy array of ints
+        Indexes of the equally weighted samples from the next chunk_size input
+        samples (in order).
+    """
+    for start in range(0, counts.shape[0], chunk_size):
+        chunk_counts = counts[start:start + chunk_size]
+        yield np.repeat(
+            np.arange(start, start + chunk_counts.shape[0]), chunk_counts)
+
+
+def check_run(run, dup_assert=False, dup_warn=False, validation='full'):
+    """
+    Check a nestcheck format run has the expected properties.
+
+    With validation='full' this is equivalent to
+    nestcheck.ns_run_utils.check_ns_run, but with checks of duplicates and
+    threads which use sorting and so scale as O(n log n) rather than
+    O(n) per thread.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run to check.
+    dup_assert: bool, optional
+        See check_duplicates.
+    dup_warn: bool, optional
+        See check_duplicates.
+    validation: str, optional
+        'full', 'sampled' or 'off'. With 'sampled' the sorting of logls is
+        checked with check_sorted(validation='sampled'), and only a random
+        subset of threads is checked (see check_run_threads). Duplicates are
+        still checked in full if dup_assert or dup_warn are True. With 'off'
+        no checks are performed.
+
+    Raises
+    ------
+    AssertionError
+        If run does not have expected properties.
+    """
+    assert validation in ['full', 'sampled', 'off'], (
+        'validation={} not in ["full", "sampled", "off"]'.format(validation))
+    if validation == 'off':
+        return
+    assert isinstance(run, dict)
+    nestcheck.ns_run_utils.check_ns_run_members(run)
+    check_sorted(run['logl'], validation=validation)
+    check_duplicates(run['logl'], dup_assert=dup_assert, dup_warn=dup_warn)
+    check_run_threads(run, validation=validation)
+
+
+def check_sorted(values, **kwargs):
+    """
+    Check an array is sorted in increasing order.
+
+    Parameters
+    ----------
+    values: 1d numpy array
+    validation: str, optional
+        'full' checks every element, 'off' performs no checks and 'sampled'
+        checks the first element of every chunk of chunk_size elements
+        (i.e. the order of the chunks) plus every element in nchunk chunks
+        selected at random.
+    chunk_size: int, optional
+    nchunk: int, optional
+
+    Raises
+    ------
+    AssertionError
+        If values is not sorted.
+    """
+    validation = kwargs.pop('validation', 'full')
+    chunk_size = kwargs.pop('chunk_size', 1000)
+    nchunk = kwargs.pop('nchunk', 10)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    if validation == 'off':
+        return
+    if validation == 'full' or values.shape[0] <= chunk_size * nchunk:
+        diff = np.diff(values)
+        assert np.all(diff >= 0), (
+            'values are not sorted: the minimum diff is {}'.format(
+                diff.min()))
+        return
+    assert validation == 'sampled', validation
+    # Check chunk boundaries (including the final element)
+    boundaries = np.append(values[::chunk_size], values[-1])
+    assert np.all(np.diff(boundaries) >= 0), (
+        'values are not sorted: chunk boundary values are not increasing')
+    # Check random chunks. A RandomState is used so numpy's global random state
+    # is not changed.
+    starts = np.random.RandomState().choice(
+        values.shape[0] // chunk_size + 1, size=nchunk,
+        replace=False) * chunk_size
+    for start in starts:
+        # Include the first element of the next chunk
+        assert np.all(np.diff(values[start:start + chunk_size + 1]) >= 0), (
+            'values are not sorted in chunk starting at index {}'.format(
+                start))
+
+
+def check_run_threads(run, validation='full', nthread_sample=100):
+    """
+    Check thread labels and thread_min_max have the expected properties (as in
+    nestcheck.ns_run_utils.check_ns_run_threads).
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run to check.
+    validation: str, optional
+        If 'sampled', only check the start and end logls of a random subset
+        of nthread_sample threads, and check the range rather than the set of
+        thread labels.
+    nthread_sample: int, optional
+
+    Raises
+    ------
+    AssertionError
+        If run does not have expected properties.
+    """
+    assert np.issubdtype(run['thread_labels'].dtype, np.integer), (
+        run['thread_labels'].dtype)
+    nthread = run['thread_min_max'].shape[0]
+    assert np.any(run['thread_min_max'][:, 0] == -np.inf), (
+        'Run should have at least one thread which starts by sampling the '
+        'whole prior')
+    if validation == 'sampled' and nthread > nthread_sample:
+        assert run['thread_labels'].min() == 0
+        assert run['thread_labels'].max() == nthread - 1
+        labels = np.random.RandomState().choice(
+            nthread, size=nthread_sample, replace=False)
+        inds = np.where(np.isin(run['thread_labels'], labels))[0]
+        first_inds, last_inds = thread_end_inds(run['thread_labels'][inds])
+        first_inds = inds[first_inds]
+        last_inds = inds[last_inds]
+        labels = np.sort(labels)
+        assert np.array_equal(run['thread_labels'][first_inds], labels), (
+            'some of threads {} have no points'.format(labels))
+    else:
+        labels = np.unique(run['thread_labels'])
+        assert np.array_equal(np.arange(nthread), labels), str(labels)
+        first_inds, last_inds = thread_end_inds(run['thread_labels'])
+    thread_min_max = run['thread_min_max'][labels, :]
+    bad = np.where(thread_min_max[:, 0] > run['logl'][first_inds])[0]
+    assert bad.shape[0] == 0, (
+        'First point in thread has logl less than thread min logl! thread '
+        'labels={}, first logls={}, thread_min_max={}'.format(
+            labels[bad], run['logl'][first_inds[bad]], thread_min_max[bad]))
+    bad = np.where(thread_min_max[:, 1] != run['logl'][last_inds])[0]
+    assert bad.shape[0] == 0, (
+        'Last point in thread logl != thread end logl! thread labels={}, '
+        'last logls={}, thread_min_max={}'.format(
+            labels[bad], run['logl'][last_inds[bad]], thread_min_max[bad]))
+
+
+def thread_end_inds(thread_labels):
+    """
+    Get the indexes of the first and last points in each thread.
+
+    Parameters
+    ----------
+    thread_labels: 1d numpy array
+
+    Returns
+    -------
+    first_inds: 1d numpy array of ints
+    last_inds: 1d numpy array of ints
+        Both are in order of increasing thread label.
+    """
+    _, first_inds = np.unique(thread_labels, return_index=True)
+    _, last_inds = np.unique(thread_labels[::-1], return_index=True)
+    return first_inds, thread_labels.shape[0] - 1 - last_inds
+
+
+def duplicate_groups(values):
+    """
+    Find groups of elements with exactly equal values (such as duplicate
+    loglikelihoods) using a single sort, so the cost is O(n log n).
+
+    Parameters
+    ----------
+    values: 1d numpy array
+
+    Returns
+    -------
+    groups: list of 1d numpy arrays of ints
+        Indexes of the elements in each group of 2 or more equal values, in
+        order of increasing value.
+    """
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+    # Positions in the sorted array where a new value starts
+    starts = np.concatenate(
+        ([0], np.where(sorted_values[1:] != sorted_values[:-1])[0] + 1,
+         [values.shape[0]]))
+    return [order[starts[i]:starts[i + 1]]
+            for i in np.where(np.diff(starts) > 1)[0]]
+
+
+def check_duplicates(logl, dup_assert=False, dup_warn=False):
+    """
+    Check for duplicate loglikelihood values, reporting the groups of
+    duplicates found.
+
+    Parameters
+    ----------
+    logl: 1d numpy array
+    dup_assert: bool, optional
+        Whether to raise an AssertionError if there are duplicate values.
+    dup_warn: bool, optional
+        Whether to give a UserWarning if there are duplicate values (only used
+        if dup_assert is False).
+    """
+    if not (dup_assert or dup_warn):
+        return
+    groups = duplicate_groups(logl)
+    if not groups:
+        return
+    msg = ('{} duplicate logl values (out of a total of {}). This may be '
+           'caused by limited numerical precision in the output files.'
+           '\nrepeated logls = {}\nindexes of each group = {}').format(
+               sum(group.shape[0] - 1 for group in groups), logl.shape[0],
+               [logl[group[0]] for group in groups],
+               [list(group) for group in groups])
+    if dup_assert:
+        raise AssertionError(msg)
+    warnings.warn(msg, UserWarning)
+
+
+def match_logl(values, targets):
+    """
+    Find the position of each value in an array of target values (with exact
+    float equality), using a sort of the targets rather than searching
+    through them for each value.
+
+    Parameters
+    ----------
+    values: 1d numpy array
+    targets: 1d numpy array
+
+    Returns
+    -------
+    inds: 1d numpy array of ints
+        Index of an element of targets equal to each value, or -1 if there is
+        no such element.
+    """
+    if targets.shape[0] == 0:
+        return np.full(values.shape, -1, dtype=int)
+    order = np.argsort(targets, kind='mergesort')
+    pos = np.minimum(np.searchsorted(targets[order], values),
+                     targets.shape[0] - 1)
+    found = targets[order[pos]] == values
+    return np.where(found, order[pos], -1)
@@ -4,6 +4,9 @@ Functions for running dyPolyChord using compiled PolyChord C++ or Fortran
 likelihoods.
 """
 import os
+import subprocess
+import sys
+import threading
 
 
 class RunCompiledPolyChord(object):
@@ -62,6 +65,26 @@ class RunCompiledPolyChord(object):
         assert os.path.isfile(self.executable_path), (
             'executable not found: ' + self.executable_path)
         assert comm is None, 'comm not used for compiled likelihoods.'
+        file_path = self.write_input_files(settings_dict)
+        # Execute command
+        command_str = self.executable_path + ' ' + file_path + '.ini'
+        if self.mpi_str is not None:
+            command_str = self.mpi_str + ' ' + command_str
+        os.system(command_str)
+
+    def write_input_files(self, settings_dict):
+        """Write the .ini file and, if required, the .cfg file for a run.
+
+        Parameters
+        ----------
+        settings_dict: dict
+            Input PolyChord settings.
+
+        Returns
+        -------
+        file_path: str
+            Equivalent to os.path.join(base_dir, file_root).
+        """
         # Write settings to ini file
         file_path = os.path.join(
             settings_dict['base_dir'], settings_dict['file_root'])
@@ -71,11 +94,7 @@ class RunCompiledPolyChord(object):
         if self.config_str is not None:
             with open(file_path + '.cfg', 'w') as cfg_file:
                 cfg_file.write(self.config_str)
-        # Execute command
-        command_str = self.executable_path + ' ' + file_path + '.ini'
-        if self.mpi_str is not None:
-            command_str = self.mpi_str + ' ' + command_str
-        os.system(command_str)
+        return file_path
 
     def ini_string(self, settings):
         """Get a PolyChord format .ini file string based on the input settings.
@@ -91,7 +110,11 @@ class RunCompiledPolyChord(object):
         string = ''
         # Add the settings
         for key, value in settings.items():
-            if key == 'nlives':
+            if key == 'grade_dims':
+                # Compiled PolyChord gets the number of parameters with each
+                # speed from the speeds in the prior blocks
+                continue
+            elif key == 'nlives':
                 if value:
                     loglikes = sorted(settings['nlives'])
                     string += 'loglikes = ' + format_setting(loglikes) + '\n'
@@ -106,6 +129,136 @@ class RunCompiledPolyChord(object):
         return string
 
 
+class RunPersistentCompiledPolyChord(RunCompiledPolyChord):
+
+    """Object for running a compiled PolyChord driver which stays running
+    between PolyChord runs, so any data files used by the likelihood only need
+    to be loaded once. This avoids starting a new executable for each run
+    (dyPolyChord performs many runs when resuming the initial run in Step 1).
+
+    The executable is started once (with no arguments) on the first call.
+    For each run, the .ini file is written as for RunCompiledPolyChord and
+    its path is sent to the executable's standard input followed by a newline.
+    The executable should then run PolyChord using the .ini file and print a
+    line containing only done_str to its standard output when it has
+    finished. It should exit when its standard input is closed. Any other
+    output is passed through to sys.stdout.
+
+    Stock PolyChord drivers exit after one run, so this needs a driver which
+    loops over the lines of its standard input. For example, a C++ driver
+    using PolyChord's C++ interface could be:
+
+    .. code-block:: cpp
+
+        #include <iostream>
+        #include <string>
+        #include "interfaces.hpp"
+        #include "CC_ini_likelihood.hpp"
+
+        int main()
+        {
+            // Load any data used by the likelihood here (once)
+            std::string ini_path;
+            while (std::getline(std::cin, ini_path))
+            {
+                run_polychord(loglikelihood, setup_loglikelihood, ini_path);
+                std::cout << "dyPolyChord run done" << std::endl;
+            }
+            return 0;
+        }
+
+    Note that when running with MPI (using mpi_str), standard input is only
+    passed to the process with rank 0, which must broadcast the .ini file
+    path to the other processes.
+
+    As all runs use the same executable, concurrent calls (for example from
+    run_dypolychord_goals with a ThreadPoolExecutor) are performed one at a
+    time. Use a separate RunPersistentCompiledPolyChord object for each
+    thread to perform runs in parallel.
+    """
+
+    def __init__(self, executable_path, prior_str, **kwargs):
+        """
+        Specify path to executable, priors and derived parameters.
+
+        Parameters
+        ----------
+        executable_path: str
+            Path to compiled driver.
+        prior_str: str
+            String specifying prior in the format required for PolyChord .ini
+            files (see get_prior_block_str for more details).
+        done_str: str, optional
+            Line printed by the executable when each run has finished.
+        kwargs: dict, optional
+            See RunCompiledPolyChord.__init__ for more information.
+        """
+        self.done_str = kwargs.pop('done_str', 'dyPolyChord run done')
+        RunCompiledPolyChord.__init__(
+            self, executable_path, prior_str, **kwargs)
+        self.process = None
+        # Stops threads interleaving requests and responses
+        self.lock = threading.Lock()
+
+    def __call__(self, settings_dict, comm=None):
+        """
+        Run PolyChord with the input settings by writing a .ini file then
+        sending its path to the executable, which is started if it is not
+        already running.
+
+        Parameters
+        ----------
+        settings_dict: dict
+            Input PolyChord settings.
+        comm: None, optional
+            Not used. Included only so __call__ has the same arguments as the
+            equivalent python function (which uses the comm argument for
+            runnign with MPI).
+        """
+        assert os.path.isfile(self.executable_path), (
+            'executable not found: ' + self.executable_path)
+        assert comm is None, 'comm not used for compiled likelihoods.'
+        file_path = self.write_input_files(settings_dict)
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                command_str = self.executable_path
+                if self.mpi_str is not None:
+                    command_str = self.mpi_str + ' ' + command_str
+                self.process = subprocess.Popen(
+                    command_str, shell=True, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, universal_newlines=True)
+            try:
+                self.process.stdin.write(file_path + '.ini\n')
+                self.process.stdin.flush()
+            except (IOError, OSError):
+                pass  # executable has exited: see error below
+            line = self.process.stdout.readline()
+            while line:
+                if line.rstrip('\n') == self.done_str:
+                    return
+                sys.stdout.write(line)
+                line = self.process.stdout.readline()
+            raise AssertionError(
+                'Executable {} exited with return code {} before finishing '
+                'run {}.'.format(self.executable_path, self.process.wait(),
+                                 file_path))
+
+    def close(self):
+        """Close the executable's standard input and wait for it to exit."""
+        with self.lock:
+            if self.process is not None:
+                self.process.stdin.close()
+                self.process.wait()
+                self.process.stdout.close()
+                self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 # Helper functions for making PolyChord prior strings
 # ---------------------------------------------------
 
@@ -230,7 +383,7 @@ def python_prior_to_str(prior, **kwargs):
 def python_block_prior_to_str(bp_obj):
     """As for python_prior_to_str, but for BlockPrior objects of the type
     defined in python_priors.py. python_prior_to_str is called seperately on
-    every block.
+    every block, using the block's speed if the BlockPrior has speeds.
 
     Parameters
     ----------
@@ -252,6 +405,7 @@ def python_block_prior_to_str(bp_obj):
     for i, prior in enumerate(bp_obj.prior_blocks):
         string += python_prior_to_str(
             prior, block=(i + 1), start_param=start_param,
-            nparam=bp_obj.block_sizes[i])
+            nparam=bp_obj.block_sizes[i],
+            speed=(1 if bp_obj.speeds is None else bp_obj.speeds[i]))
         start_param += bp_obj.block_sizes[i]
     return string
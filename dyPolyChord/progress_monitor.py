@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""
+Monitoring the progress of PolyChord runs while they are running.
+
+PolyChord periodically writes the run's dead points to [root]_dead-birth.txt
+and the number of likelihood calls to [root].stats. ProgressMonitor is a
+background thread which periodically reads any new lines in the dead-birth
+file (without re-reading the parts it has already seen) and the .stats file,
+and reports progress metrics to a callback, a text file and/or a local HTTP
+endpoint. The text file and HTTP endpoint give one "name value" pair per line,
+which can be read by most job schedulers and metrics collectors.
+
+The incremental reading of the dead-birth file is done by DeadBirthReader,
+which can also be used on its own (see surrogate.SurrogateLikelihood).
+"""
+import os
+import threading
+import time
+import numpy as np
+import dyPolyChord.read_polychord_output
+try:
+    import http.server as http_server
+except ImportError:  # Python 2
+    import BaseHTTPServer as http_server
+
+
+class ProgressMonitor(threading.Thread):
+
+    """Background thread monitoring the progress of a PolyChord run.
+
+    Can be used as a context manager, in which case the thread is started on
+    entering and stopped on exiting.
+
+    Metrics reported are:
+
+    ndead: number of dead points written so far;
+    logl: highest loglikelihood among the dead points;
+    logx: estimated log prior volume remaining, using the number of live
+        points specified by the settings;
+    schedule_frac: fraction of the nlives schedule completed (for dynamic
+        runs), measured as the fraction of its loglikelihood thresholds
+        passed - or None if there is no schedule;
+    nlike: number of likelihood calls according to the .stats file;
+    nlike_per_sec: likelihood calls per second since the previous update;
+    eta: estimated seconds remaining (from schedule_frac, or from ndead and
+        max_ndead) - or None if it cannot be estimated;
+    elapsed: seconds since the monitor started.
+    """
+
+    def __init__(self, root, **kwargs):
+        """Set up the monitor.
+
+        Parameters
+        ----------
+        root: str
+            Path of the PolyChord run's output files, excluding extensions
+            (i.e. os.path.join(base_dir, file_root)).
+        nlive: int, optional
+            Number of live points.
+        nlives: dict, optional
+            PolyChord's nlives settings (maps loglikelihood thresholds to
+            numbers of live points), used for dynamic runs.
+        max_ndead: int, optional
+            PolyChord's max_ndead setting.
+        callback: func or None, optional
+            Called with a dict of metrics after each update.
+        metrics_file: str or None, optional
+            If not None, metrics are written to this file (which is replaced
+            atomically) after each update.
+        http_port: int or None, optional
+            If not None, the latest metrics are served over HTTP on this port
+            of localhost.
+        interval: float, optional
+            Seconds between updates.
+        """
+        nlive = kwargs.pop('nlive', 100)
+        nlives = kwargs.pop('nlives', {})
+        self.max_ndead = kwargs.pop('max_ndead', -1)
+        self.callback = kwargs.pop('callback', None)
+        self.metrics_file = kwargs.pop('metrics_file', None)
+        http_port = kwargs.pop('http_port', None)
+        self.interval = kwargs.pop('interval', 10)
+        if kwargs:
+            raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.root = root
+        self.nlive = nlive
+        if nlives:
+            self.nlives_logl = np.asarray(sorted(nlives.keys()))
+            self.nlives_nlive = np.asarray(
+                [nlives[key] for key in self.nlives_logl])
+            # The schedule ends at the threshold where the number of live
+            # points falls to zero (if it does)
+            nonzero = np.where(self.nlives_nlive > 0)[0]
+            end = nonzero[-1] + 1 if nonzero.shape[0] > 0 else 0
+            self.schedule_logl = self.nlives_logl[:end + 1]
+        else:
+            self.nlives_logl = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.start_time = time.time()
+        self.nlike = None
+        self.last_nlike = None
+        self.last_time = None
+        self.reset()
+        if http_port is None:
+            self.server = None
+        else:
+            self.server = http_server.HTTPServer(
+                ('localhost', http_port), get_handler(self))
+            server_thread = threading.Thread(target=self.server.serve_forever)
+            server_thread.daemon = True
+            server_thread.start()
+
+    def __enter__(self):
+        """Start the monitor."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Stop the monitor."""
+        self.stop()
+
+    def reset(self):
+        """Reset the information read from the dead-birth file (for example
+        if PolyChord has replaced it)."""
+        self.reader = DeadBirthReader(self.root + '_dead-birth.txt')
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        """Reset the metrics calculated from the dead-birth file."""
+        self.ndead = 0
+        self.logl = -np.inf
+        self.logx = 0.
+
+    def run(self):
+        """Update the metrics every interval seconds until stopped."""
+        while not self.stop_event.wait(self.interval):
+            self.update()
+
+    def stop(self):
+        """Stop the monitor (and any HTTP server) after a final update."""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.update()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def update(self):
+        """Read any new output and report the updated metrics."""
+        self.read_dead_birth()
+        self.read_stats()
+        now = time.time()
+        metrics = {'ndead': self.ndead, 'logl': self.logl,
+                   'logx': self.logx, 'nlike': self.nlike,
+                   'elapsed': now - self.start_time,
+                   'nlike_per_sec': None, 'schedule_frac': None,
+                   'eta': None}
+        if (self.nlike is not None and self.last_nlike is not None and
+                now > self.last_time):
+            metrics['nlike_per_sec'] = ((self.nlike - self.last_nlike) /
+                                        (now - self.last_time))
+        self.last_nlike = self.nlike
+        self.last_time = now
+        if self.nlives_logl is not None:
+            metrics['schedule_frac'] = (
+                np.searchsorted(self.schedule_logl, self.logl, side='right') /
+                float(self.schedule_logl.shape[0]))
+            frac = metrics['schedule_frac']
+        elif self.max_ndead > 0:
+            frac = min(1., self.ndead / float(self.max_ndead))
+        else:
+            frac = 0
+        if frac > 0:
+            metrics['eta'] = metrics['elapsed'] * (1 - frac) / frac
+        with self.lock:
+            self.metrics = metrics
+        if self.callback is not None:
+            self.callback(metrics)
+        if self.metrics_file is not None:
+            temp_path = self.metrics_file + '.part'
+            with open(temp_path, 'w') as metrics_file:
+                metrics_file.write(self.metrics_str())
+            os.rename(temp_path, self.metrics_file)
+
+    def metrics_str(self):
+        """Get the latest metrics as "name value" lines.
+
+        Returns
+        -------
+        str
+        """
+        with self.lock:
+            metrics = dict(self.metrics)
+        return ''.join('{0} {1}\n'.format(key, metrics[key])
+                       for key in sorted(metrics.keys())
+                       if metrics[key] is not None)
+
+    def read_dead_birth(self):
+        """Read any new lines added to the dead-birth file since the last
+        update and update ndead, logl and logx."""
+        logl, replaced = self.reader.read()
+        if replaced:
+            self.reset_metrics()
+        if logl.shape[0] == 0:
+            return
+        self.ndead += logl.shape[0]
+        self.logl = max(self.logl, logl.max())
+        self.logx -= (1. / self.get_nlive(logl)).sum()
+
+    def read_stats(self):
+        """Get the number of likelihood calls from the .stats file (which
+        PolyChord rewrites each time it is updated, and is small). If there
+        are several parameter speeds the calls for each of them are
+        summed."""
+        try:
+            with open(self.root + '.stats', 'r') as stats_file:
+                lines = stats_file.readlines()
+        except (IOError, OSError):  # file not written yet
+            return
+        for line in lines:
+            if line.startswith('nlike:'):
+                nlike = dyPolyChord.read_polychord_output.sum_nlike(
+                    line.split()[1:])
+                if nlike > 0:  # False for a partly written file or nan
+                    self.nlike = nlike
+
+    def get_nlive(self, logl):
+        """Number of live points specified by the settings when points with
+        the input loglikelihoods died.
+
+        Parameters
+        ----------
+        logl: 1d numpy array
+
+        Returns
+        -------
+        nlive: 1d numpy array
+        """
+        if self.nlives_logl is None:
+            return np.full(logl.shape, self.nlive, dtype=float)
+        inds = np.searchsorted(self.nlives_logl, logl, side='right') - 1
+        nlive = np.where(inds >= 0, self.nlives_nlive[np.maximum(inds, 0)],
+                         self.nlive)
+        # Avoid dividing by zero for points after the end of the schedule
+        return np.maximum(nlive, 1).astype(float)
+
+
+class DeadBirthReader(object):
+
+    """Reads the loglikelihoods of the points added to a PolyChord dead-birth
+    file since it was last read, without re-reading the parts already seen.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path: str
+            Path of the dead-birth file.
+        """
+        self.path = path
+        self.offset = 0
+        self.inode = None
+        self.buffer = b''
+
+    def read(self):
+        """Read any complete lines added to the file since the last read.
+
+        Returns
+        -------
+        logl: 1d numpy array
+            Loglikelihoods of the new points (empty if there are none or the
+            file has not been written yet).
+        replaced: bool
+            Whether the file has been replaced or rewritten from scratch
+            since the last read, in which case logl contains the points from
+            the start of the new file.
+        """
+        replaced = False
+        try:
+            with open(self.path, 'rb') as dead_file:
+                stat = os.fstat(dead_file.fileno())
+                if stat.st_ino != self.inode or stat.st_size < self.offset:
+                    replaced = self.inode is not None
+                    self.offset = 0
+                    self.buffer = b''
+                    self.inode = stat.st_ino
+                dead_file.seek(self.offset)
+                data = dead_file.read()
+        except (IOError, OSError):  # file not written yet
+            return np.zeros(0), replaced
+        self.offset += len(data)
+        data = self.buffer + data
+        # Only process complete lines
+        end = data.rfind(b'\n') + 1
+        self.buffer = data[end:]
+        lines = data[:end].split(b'\n')[:-1]
+        if not lines:
+            return np.zeros(0), replaced
+        ncol = len(lines[0].split())
+        # Columns are parameters, logl, birth logl
+        return np.asarray(b' '.join(lines).split(), dtype=float).reshape(
+            (len(lines), ncol))[:, -2], replaced
+
+
+def get_handler(monitor):
+    """Make a request handler class serving the monitor's latest metrics.
+
+    Parameters
+    ----------
+    monitor: ProgressMonitor
+
+    Returns
+    -------
+    handler: http_server.BaseHTTPRequestHandler subclass
+    """
+    class MetricsHandler(http_server.BaseHTTPRequestHandler):
+
+        """Serves the latest metrics in response to GET requests."""
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            """Respond with the metrics."""
+            body = monitor.metrics_str().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # pylint: disable=arguments-differ
+            """Do not log requests."""
+            pass
+
+    return MetricsHandler
+
+
+def start_monitor(progress, settings_dict):
+    """Start monitoring the progress of a PolyChord run.
+
+    Parameters
+    ----------
+    progress: dict or None
+        Keyword arguments for ProgressMonitor. If None, no monitor is
+        started.
+    settings_dict: dict
+        PolyChord settings for the run.
+
+    Returns
+    -------
+    monitor: ProgressMonitor or None
+    """
+    if progress is None:
+        return None
+    monitor = ProgressMonitor(
+        os.path.join(settings_dict['base_dir'], settings_dict['file_root']),
+        nlive=settings_dict['nlive'], nlives=settings_dict.get('nlives', {}),
+        max_ndead=settings_dict.get('max_ndead', -1), **progress)
+    monitor.start()
+    return monitor
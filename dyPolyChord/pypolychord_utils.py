@@ -6,6 +6,7 @@ Note that pypolychord was called PyPolyChord before PolyChord v1.15;
 if pypolychord cannot be imported then we try importing it using its
 old name instead for backwards compatibility.
 """
+import os
 # Exception handling needed to allow readthedocs to work without
 # installing pypolychord.
 try:
@@ -19,6 +20,8 @@ except ImportError:
         import PyPolyChord.settings as pypolychord_settings
     except ImportError:
         pass
+import dyPolyChord.python_likelihoods
+import dyPolyChord.surrogate
 
 
 class RunPyPolyChord(object):
@@ -37,6 +40,14 @@ class RunPyPolyChord(object):
         ndim: int
         nderived: int, optional
         """
+        cached = dyPolyChord.python_likelihoods.find_wrapper(
+            likelihood, dyPolyChord.python_likelihoods.CachedLikelihood)
+        assert cached is None or dyPolyChord.python_likelihoods.find_wrapper(
+            cached.likelihood,
+            dyPolyChord.surrogate.SurrogateLikelihood) is None, (
+                'CachedLikelihood cannot wrap a SurrogateLikelihood as the '
+                'surrogate\'s predictions would be cached: use '
+                'SurrogateLikelihood(CachedLikelihood(likelihood)) instead.')
         self.likelihood = likelihood
         self.prior = prior
         self.ndim = ndim
@@ -55,15 +66,55 @@ class RunPyPolyChord(object):
             For MPI parallelisation.
         """
         if comm is None:
-            settings = pypolychord_settings.PolyChordSettings(
-                self.ndim, self.nderived, **settings_dict)
+            settings = self.get_settings(settings_dict)
         else:
             rank = comm.Get_rank()
             if rank == 0:
-                settings = pypolychord_settings.PolyChordSettings(
-                    self.ndim, self.nderived, **settings_dict)
+                settings = self.get_settings(settings_dict)
             else:
                 settings = None
             settings = comm.bcast(settings, root=0)
+        surrogate = dyPolyChord.python_likelihoods.find_wrapper(
+            self.likelihood, dyPolyChord.surrogate.SurrogateLikelihood)
+        if surrogate is not None:
+            # Train any surrogate on the initial run and track the contour.
+            # This uses the broadcast settings as with MPI settings_dict is
+            # None on ranks other than 0.
+            surrogate.start_run(
+                os.path.join(settings.base_dir, settings.file_root),
+                self.ndim, do_clustering=settings.do_clustering)
         pypolychord.run_polychord(self.likelihood, self.ndim, self.nderived,
                                   settings, prior=self.prior)
+        cached = dyPolyChord.python_likelihoods.find_wrapper(
+            self.likelihood, dyPolyChord.python_likelihoods.CachedLikelihood)
+        if cached is not None:
+            # Save the cache so it can be used by subsequent runs. With MPI,
+            # only the cache from rank 0 is saved to avoid processes writing
+            # to the same file.
+            if cached.cache_path is not None and (
+                    comm is None or comm.Get_rank() == 0):
+                cached.save()
+
+    def get_settings(self, settings_dict):
+        """
+        Make the pypolychord settings object for a run. If the prior has
+        parameter speeds and settings_dict does not specify grade_dims, a
+        fast-slow decomposition is used with the prior's speeds. With MPI this
+        is only called on rank 0, as settings_dict is None on other ranks.
+
+        Parameters
+        ----------
+        settings_dict: dict
+            Input PolyChord settings.
+
+        Returns
+        -------
+        settings: PolyChordSettings object
+        """
+        if 'grade_dims' not in settings_dict and getattr(
+                self.prior, 'speeds', None) is not None:
+            # Use fast-slow decomposition with the prior's parameter speeds
+            settings_dict = dict(settings_dict)
+            settings_dict['grade_dims'] = self.prior.grade_dims()
+        return pypolychord_settings.PolyChordSettings(
+            self.ndim, self.nderived, **settings_dict)
@@ -22,7 +22,9 @@ hyperparameter values. These objects can be used in the same way as functions
 due to python's "duck typing" (alternatively you can define likelihoods
 using functions).
 """
-import copy
+import collections
+import os
+import pickle
 import numpy as np
 import scipy.special
 
@@ -237,6 +239,11 @@ class GaussianMix(object):
         positions.append(np.asarray([sep, 0]))
         positions.append(np.asarray([-sep, 0]))
         self.positions = positions[:len(weights)]
+        # Precompute component offsets as a (ncomponent, 2) matrix and the
+        # log weights so all the components can be evaluated at once
+        self.offsets = np.vstack(self.positions).astype(float)
+        self.log_weights = np.log(np.asarray(weights, dtype=float))
+        self.sigma = sigma
 
     def __call__(self, theta):
         """
@@ -246,22 +253,35 @@ class GaussianMix(object):
 
         Parameters
         ----------
-        theta: float or 1d numpy array
+        theta: 1d or 2d numpy array
+            Parameters. Can also be a 2d array with shape (n, ndim) containing
+            n points, in which case the n loglikelihoods are calculated
+            together.
 
         Returns
         -------
-        logl: float
-            Loglikelihood
-        phi: list of length nderived
-            Any derived parameters.
+        logl: float or 1d numpy array
+            Loglikelihood (array of shape (n,) for 2d theta).
+        phi: list of length nderived or 2d numpy array
+            Any derived parameters (array of shape (n, nderived) for 2d
+            theta).
         """
-        thetas = []
-        for pos in self.positions:
-            thetas.append(copy.deepcopy(theta))
-            thetas[-1][:2] -= pos
-        logls = [(Gaussian(sigma=self.sigmas[i])(thetas[i])[0]
-                  + np.log(self.weights[i])) for i in range(len(self.weights))]
-        logl = scipy.special.logsumexp(logls)
+        ndim = theta.shape[-1]
+        # Only the first two parameters' offsets differ between components:
+        # the contribution of the rest is shared.
+        sq_dist = np.sum(
+            (theta[..., np.newaxis, :2] - self.offsets) ** 2, axis=-1)
+        sq_dist += np.sum(theta[..., np.newaxis, 2:] ** 2, axis=-1)
+        logls = sq_dist / (-2 * self.sigma ** 2)
+        logls += self.log_weights
+        # logsumexp over the components (written out as
+        # scipy.special.logsumexp has a large overhead for small arrays)
+        logl_max = np.max(logls, axis=-1)
+        logl = logl_max + np.log(np.sum(
+            np.exp(logls - logl_max[..., np.newaxis]), axis=-1))
+        logl -= np.log(2 * np.pi * (self.sigma ** 2)) * ndim / 2.0
+        if theta.ndim == 2:
+            return logl, np.zeros((theta.shape[0], self.nderived))
         return logl, [0.0] * self.nderived
 
 
@@ -318,9 +338,160 @@ class LogGammaMix(object):
         return logl, [0.0] * self.nderived
 
 
+class CachedLikelihood(object):
+
+    """Wrapper which caches the results of an expensive loglikelihood so that
+    points which are evaluated more than once (for example the live points
+    when PolyChord resumes a run) do not need to be recalculated.
+
+    Results are stored in a least recently used (LRU) cache keyed by the bytes
+    of theta, with at most max_size entries. The numbers of cache hits and
+    misses are stored in the nhit and nmiss attributes; run_dypolychord
+    subtracts the hits from the number of likelihood calls written to the
+    .stats file.
+    """
+
+    def __init__(self, likelihood, max_size=100000, cache_path=None):
+        """
+        Set up the cache.
+
+        Parameters
+        ----------
+        likelihood: func
+            Loglikelihood of the type defined in this module.
+        max_size: int, optional
+            Maximum number of results to store. When the cache is full, the
+            least recently used result is discarded.
+        cache_path: str or None, optional
+            If not None, the cache is loaded from this file (if it exists) and
+            can be saved to it with the save method. This allows results to be
+            reused across processes - for example by the initial and dynamic
+            runs when they are performed by separate jobs.
+        """
+        assert max_size > 0, 'max_size={}'.format(max_size)
+        self.likelihood = likelihood
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.nhit = 0
+        self.nmiss = 0
+        self.cache = collections.OrderedDict()
+        if cache_path is not None and os.path.isfile(cache_path):
+            with open(cache_path, 'rb') as cache_file:
+                self.cache = pickle.load(cache_file)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def __call__(self, theta):
+        """
+        Calculate loglikelihood(theta), as well as any derived parameters,
+        using the cached result if theta has been evaluated before.
+
+        Parameters
+        ----------
+        theta: float or 1d numpy array
+
+        Returns
+        -------
+        logl: float
+            Loglikelihood
+        phi: list of length nderived
+            Any derived parameters.
+        """
+        key = np.asarray(theta, dtype=float).tobytes()
+        try:
+            logl, phi = self.cache[key]
+        except KeyError:
+            self.nmiss += 1
+            logl, phi = self.likelihood(theta)
+            self.cache[key] = (logl, list(phi))
+            if len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+            return logl, phi
+        self.nhit += 1
+        # Mark as most recently used (OrderedDict.move_to_end is not
+        # available in Python 2)
+        self.cache[key] = self.cache.pop(key)
+        return logl, list(phi)
+
+    def save(self):
+        """Save the cache to cache_path."""
+        assert self.cache_path is not None, 'cache_path not specified.'
+        with open(self.cache_path, 'wb') as cache_file:
+            pickle.dump(self.cache, cache_file)
+
+
 # Helper functions
 # ----------------
 
+def find_wrapper(likelihood, wrapper_type):
+    """Find a likelihood wrapper of the given type (such as CachedLikelihood)
+    in a chain of wrappers, each of which stores the likelihood it wraps in
+    its likelihood attribute.
+
+    Parameters
+    ----------
+    likelihood: func
+    wrapper_type: type
+
+    Returns
+    -------
+    wrapper: wrapper_type object or None
+        None if there is no wrapper of the type.
+    """
+    while likelihood is not None:
+        if isinstance(likelihood, wrapper_type):
+            return likelihood
+        likelihood = getattr(likelihood, 'likelihood', None)
+    return None
+
+
+def get_cache_hits(run_polychord):
+    """Get the number of likelihood calls answered from the cache if
+    run_polychord uses a python_likelihoods.CachedLikelihood (which may be
+    wrapped by other likelihood wrappers such as a SurrogateLikelihood).
+
+    Parameters
+    ----------
+    run_polychord: callable
+        Callable which runs PolyChord with the desired likelihood and prior,
+        and takes a settings dictionary as its argument.
+
+    Returns
+    -------
+    nhit: int or None
+        None if run_polychord does not use a CachedLikelihood.
+    """
+    cached = find_wrapper(
+        getattr(run_polychord, 'likelihood', None),
+        CachedLikelihood)
+    return None if cached is None else cached.nhit
+
+
+def count_cache_hits(run_polychord, nhit_start, comm=None):
+    """Count the likelihood calls answered from a CachedLikelihood's cache
+    since get_cache_hits returned nhit_start.
+
+    Parameters
+    ----------
+    run_polychord: callable
+    nhit_start: int or None
+        Output of get_cache_hits.
+    comm: None or mpi4py MPI.COMM object, optional
+        If not None, the counts from all processes are summed on rank 0.
+
+    Returns
+    -------
+    nlike_cached: int
+        Zero if run_polychord does not use a CachedLikelihood.
+    """
+    if nhit_start is None:
+        return 0
+    nlike_cached = get_cache_hits(run_polychord) - nhit_start
+    if comm is not None:
+        nlike_cached = comm.reduce(nlike_cached, root=0)
+    return nlike_cached
+
+
 def log_loggamma_pdf_1d(theta, alpha=1, beta=1):
     r"""1d gamma distribution, with each component of theta independently
     having PDF:
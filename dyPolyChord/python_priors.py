@@ -37,17 +37,26 @@ Inheritance of the BasePrior class allows priors to:
    2. adaptively select the number of parameters to use.
 
 You can ignore these if you don't need them.
+
+All the priors accept an optional out argument: a numpy array into which the
+physical parameter values are written in place. This avoids allocating a new
+array on every call, which matters as priors are called for every point
+PolyChord proposes. Setting preallocate=True makes a prior reuse the same
+output array each time it is called when out is not specified. Subclasses of
+BasePrior whose cube_to_physical method does not take an out argument are
+still supported, with their output copied into out.
 """
-import copy
+import inspect
 import numpy as np
-import scipy
+import scipy.special
 
 
 class BasePrior(object):
 
     """Base class for Priors."""
 
-    def __init__(self, adaptive=False, sort=False, nfunc_min=1):
+    def __init__(self, adaptive=False, sort=False, nfunc_min=1,
+                 preallocate=False):
         """
         Set up prior object's hyperparameter values.
 
@@ -56,12 +65,22 @@ class BasePrior(object):
         adaptive: bool, optional
         sort: bool, optional
         nfunc_min: int, optional
+        preallocate: bool, optional
+            If True, __call__ writes its output into the same array every
+            time it is called without an out argument. This avoids allocating
+            memory, but the returned array is overwritten by the next call
+            so must be copied if it needs to be kept (pypolychord does this
+            already).
         """
         self.adaptive = adaptive
         self.sort = sort
         self.nfunc_min = nfunc_min
+        self.preallocate = preallocate
+        self.buffer = None
+        # Subclasses written before cube_to_physical took an out argument
+        self.cube_takes_out = takes_out_arg(self.cube_to_physical)
 
-    def cube_to_physical(self, cube):  # pylint: disable=no-self-use
+    def cube_to_physical(self, cube, out=None):  # pylint: disable=no-self-use
         """
         Map hypercube values to physical parameter values.
 
@@ -70,15 +89,20 @@ class BasePrior(object):
         cube: 1d numpy array
             Point coordinate on unit hypercube (in probabily space).
             See the PolyChord papers for more details.
+        out: 1d numpy array or None, optional
+            Array in which to write the output. May be cube itself.
 
         Returns
         -------
         theta: 1d numpy array
             Physical parameter values corresponding to hypercube.
         """
-        return cube
+        if out is None:
+            return cube
+        out[...] = cube
+        return out
 
-    def __call__(self, cube):
+    def __call__(self, cube, out=None):
         """
         Evaluate prior on hypercube coordinates.
 
@@ -87,28 +111,58 @@ class BasePrior(object):
         cube: 1d numpy array
             Point coordinate on unit hypercube (in probabily space).
             Note this variable cannot be edited else PolyChord throws an error.
+        out: 1d numpy array or None, optional
+            Array in which to write the output (must not be cube).
 
         Returns
         -------
         theta: 1d numpy array
             Physical parameter values for prior.
         """
+        if out is None and self.preallocate:
+            out = get_buffer(self, cube.shape)
         if self.adaptive:
             try:
                 theta = adaptive_transform(
-                    cube, sort=self.sort, nfunc_min=self.nfunc_min)
+                    cube, sort=self.sort, nfunc_min=self.nfunc_min, out=out)
             except ValueError:
                 if np.isnan(cube[0]):
-                    return np.full(cube.shape, np.nan)
+                    if out is None:
+                        return np.full(cube.shape, np.nan)
+                    out.fill(np.nan)
+                    return out
                 else:
                     raise
-            theta[1:] = self.cube_to_physical(theta[1:])
+            self.cube_to_physical_out(theta[1:], theta[1:])
             return theta
         else:
             if self.sort:
-                return self.cube_to_physical(forced_identifiability(cube))
+                theta = forced_identifiability(cube, out=out)
+                return self.cube_to_physical_out(theta, theta)
             else:
-                return self.cube_to_physical(cube)
+                return self.cube_to_physical_out(cube, out)
+
+    def cube_to_physical_out(self, cube, out):
+        """
+        Call cube_to_physical with an out argument, or copy its output into
+        out if it does not take one.
+
+        Parameters
+        ----------
+        cube: 1d numpy array
+        out: 1d numpy array or None
+
+        Returns
+        -------
+        theta: 1d numpy array
+        """
+        if self.cube_takes_out:
+            return self.cube_to_physical(cube, out=out)
+        theta = self.cube_to_physical(cube)
+        if out is None:
+            return theta
+        out[...] = theta
+        return out
 
 
 class Gaussian(BasePrior):
@@ -137,7 +191,7 @@ class Gaussian(BasePrior):
         self.mu = mu
         self.half = half
 
-    def cube_to_physical(self, cube):
+    def cube_to_physical(self, cube, out=None):
         """
         Map hypercube values to physical parameter values.
 
@@ -146,6 +200,8 @@ class Gaussian(BasePrior):
         cube: 1d numpy array
             Point coordinate on unit hypercube (in probabily space).
             See the PolyChord papers for more details.
+        out: 1d numpy array or None, optional
+            Array in which to write the output. May be cube itself.
 
         Returns
         -------
@@ -153,11 +209,14 @@ class Gaussian(BasePrior):
             Physical parameter values corresponding to hypercube.
         """
         if self.half:
-            theta = scipy.special.erfinv(cube)
+            theta = scipy.special.erfinv(cube, out=out)
         else:
-            theta = scipy.special.erfinv(2 * cube - 1)
+            theta = np.multiply(cube, 2, out=out)
+            theta -= 1
+            scipy.special.erfinv(theta, out=theta)
         theta *= self.sigma * np.sqrt(2)
-        return theta + self.mu
+        theta += self.mu
+        return theta
 
 
 class Uniform(BasePrior):
@@ -182,19 +241,23 @@ class Uniform(BasePrior):
         self.maximum = maximum
         self.minimum = minimum
 
-    def cube_to_physical(self, cube):
+    def cube_to_physical(self, cube, out=None):
         """
         Map hypercube values to physical parameter values.
 
         Parameters
         ----------
         cube: 1d numpy array
+        out: 1d numpy array or None, optional
+            Array in which to write the output. May be cube itself.
 
         Returns
         -------
         theta: 1d numpy array
         """
-        return self.minimum + (self.maximum - self.minimum) * cube
+        theta = np.multiply(cube, self.maximum - self.minimum, out=out)
+        theta += self.minimum
+        return theta
 
 
 class PowerUniform(BasePrior):
@@ -224,23 +287,27 @@ class PowerUniform(BasePrior):
         self.const = abs((minimum ** (1. / power)) - (maximum ** (1. / power)))
         self.const = 1 / self.const
 
-    def cube_to_physical(self, cube):
+    def cube_to_physical(self, cube, out=None):
         """
         Map hypercube values to physical parameter values.
 
         Parameters
         ----------
         cube: 1d numpy array
+        out: 1d numpy array or None, optional
+            Array in which to write the output. May be cube itself.
 
         Returns
         -------
         theta: 1d numpy array
         """
+        theta = np.divide(cube, self.const, out=out)
         if self.power > 0:
-            theta = (self.minimum ** (1. / self.power)) + (cube / self.const)
+            theta += self.minimum ** (1. / self.power)
         else:
-            theta = (self.minimum ** (1. / self.power)) - (cube / self.const)
-        return theta ** self.power
+            np.subtract(self.minimum ** (1. / self.power), theta, out=theta)
+        theta **= self.power
+        return theta
 
 
 class Exponential(BasePrior):
@@ -260,35 +327,86 @@ class Exponential(BasePrior):
         BasePrior.__init__(self, **kwargs)
         self.lambd = lambd
 
-    def cube_to_physical(self, cube):
+    def cube_to_physical(self, cube, out=None):
         """
         Map hypercube values to physical parameter values.
 
         Parameters
         ----------
         cube: 1d numpy array
+        out: 1d numpy array or None, optional
+            Array in which to write the output. May be cube itself.
 
         Returns
         -------
         theta: 1d numpy array
         """
-        return - np.log(1 - cube) / self.lambd
+        theta = np.subtract(1, cube, out=out)
+        np.log(theta, out=theta)
+        theta /= -self.lambd
+        return theta
 
 
 class BlockPrior(object):
 
     """Prior object which applies a list of priors to different blocks within
-    the parameters."""
+    the parameters.
+
+    Blocks can be given speeds so that PolyChord can use fast-slow
+    decomposition, in which parameters the likelihood depends on cheaply (fast
+    parameters) are sampled more often than those it is expensive to change
+    (slow parameters). The speeds are used for the prior blocks in .ini files
+    (see polychord_utils.python_block_prior_to_str) and to set PolyChord's
+    grade_dims setting (see pypolychord_utils.RunPyPolyChord), with the
+    fraction of time spent on each speed set by the grade_frac setting.
+    """
 
-    def __init__(self, prior_blocks, block_sizes):
-        """Store prior and size of each block."""
+    def __init__(self, prior_blocks, block_sizes, preallocate=False,
+                 speeds=None):
+        """Store prior and size of each block.
+
+        Parameters
+        ----------
+        prior_blocks: list of prior objects
+        block_sizes: list of ints
+            Number of parameters in each block.
+        preallocate: bool, optional
+            If True, __call__ writes its output into the same array every
+            time it is called without an out argument (see
+            BasePrior.__init__ for more details).
+        speeds: list of ints or None, optional
+            Speed of each block, starting from 1 for the slowest parameters.
+            PolyChord requires parameters to be ordered from slowest to
+            fastest, so each block's speed must equal the previous block's
+            speed or be one greater.
+        """
         assert len(prior_blocks) == len(block_sizes), (
             'len(prior_blocks)={}, len(block_sizes)={}, block_sizes={}'
             .format(len(prior_blocks), len(block_sizes), block_sizes))
+        if speeds is not None:
+            assert len(speeds) == len(block_sizes), (
+                'len(speeds)={}, len(block_sizes)={}'.format(
+                    len(speeds), len(block_sizes)))
+            assert speeds[0] == 1 and all(
+                speeds[i + 1] - speeds[i] in [0, 1]
+                for i in range(len(speeds) - 1)), (
+                    'speeds should start at 1 and increase in steps of 1: '
+                    '{}'.format(speeds))
         self.prior_blocks = prior_blocks
         self.block_sizes = block_sizes
-
-    def __call__(self, cube):
+        self.preallocate = preallocate
+        self.speeds = speeds
+        self.buffer = None
+        ends = np.cumsum(block_sizes)
+        self.block_slices = [slice(end - size, end) for end, size in
+                             zip(ends, block_sizes)]
+        # Priors defined as functions rather than using the classes in this
+        # module may not take an out argument
+        self.block_takes_out = [isinstance(prior, (BasePrior, BlockPrior))
+                                and takes_out_arg(prior.__call__)
+                                for prior in prior_blocks]
+
+    def __call__(self, cube, out=None):
         """
         Map hypercube values to physical parameter values.
 
@@ -297,27 +415,85 @@ class BlockPrior(object):
         hypercube: 1d numpy array
             Point coordinate on unit hypercube (in probabily space).
             See the PolyChord papers for more details.
+        out: 1d numpy array or None, optional
+            Array in which to write the output (must not be cube).
 
         Returns
         -------
         theta: 1d numpy array
             Physical parameter values corresponding to hypercube.
         """
-        theta = np.zeros(cube.shape)
-        start = 0
-        end = 0
-        for i, prior in enumerate(self.prior_blocks):
-            end += self.block_sizes[i]
-            theta[start:end] = prior(cube[start:end])
-            start += self.block_sizes[i]
+        if out is not None:
+            theta = out
+        elif self.preallocate:
+            theta = get_buffer(self, cube.shape)
+        else:
+            theta = np.empty(cube.shape)
+        for prior, block, takes_out in zip(
+                self.prior_blocks, self.block_slices, self.block_takes_out):
+            if takes_out:
+                prior(cube[block], out=theta[block])
+            else:
+                theta[block] = prior(cube[block])
         return theta
 
+    def grade_dims(self):
+        """Get the number of parameters with each speed, in the format of
+        PolyChord's grade_dims setting.
+
+        Returns
+        -------
+        grade_dims: list of ints
+        """
+        assert self.speeds is not None, 'BlockPrior has no speeds'
+        grade_dims = [0] * max(self.speeds)
+        for speed, size in zip(self.speeds, self.block_sizes):
+            grade_dims[speed - 1] += size
+        return grade_dims
+
 
 # Helper functions
 # ----------------
 
 
-def forced_identifiability(cube):
+def takes_out_arg(func):
+    """Check if a function or method accepts an out keyword argument.
+
+    Parameters
+    ----------
+    func: function or method
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        spec = inspect.getfullargspec(func)
+    except AttributeError:  # Python 2
+        spec = inspect.getargspec(func)
+    # spec[2] is the name of any **kwargs argument
+    return 'out' in spec.args or spec[2] is not None
+
+
+def get_buffer(prior, shape):
+    """Get a prior object's preallocated output array, allocating it if it
+    has not yet been made or if its shape does not match.
+
+    Parameters
+    ----------
+    prior: BasePrior or BlockPrior object
+    shape: tuple
+
+    Returns
+    -------
+    buffer: numpy array
+    """
+    if prior.buffer is None or prior.buffer.shape != shape:
+        prior.buffer = np.empty(shape)
+    return prior.buffer
+
+
+def forced_identifiability(cube, out=None):
     """Transform hypercube coordinates to enforce identifiability.
 
     For more details see: "PolyChord: next-generation nested sampling"
@@ -327,19 +503,26 @@ def forced_identifiability(cube):
     ----------
     cube: 1d numpy array
         Point coordinate on unit hypercube (in probabily space).
+    out: 1d numpy array or None, optional
+        Array in which to write the output. May be cube itself.
 
     Returns
     -------
     ordered_cube: 1d numpy array
     """
-    ordered_cube = np.zeros(cube.shape)
+    if out is None:
+        ordered_cube = np.empty(cube.shape)
+    else:
+        ordered_cube = out
+    # N.B. this loop works in place if out is cube as cube[n] is used before
+    # ordered_cube[n] is written
     ordered_cube[-1] = cube[-1] ** (1. / cube.shape[0])
     for n in range(cube.shape[0] - 2, -1, -1):
         ordered_cube[n] = cube[n] ** (1. / (n + 1)) * ordered_cube[n + 1]
     return ordered_cube
 
 
-def adaptive_transform(cube, sort=True, nfunc_min=1):
+def adaptive_transform(cube, sort=True, nfunc_min=1, out=None):
     """Tranform first parameter (nfunc) to uniform in (nfunc_min, nfunc_max)
     and, if required, perform forced identifiability transform on the next
     nfunc parameters only.
@@ -348,6 +531,10 @@ def adaptive_transform(cube, sort=True, nfunc_min=1):
     ----------
     cube: 1d numpy array
         Point coordinate on unit hypercube (in probabily space).
+    sort: bool, optional
+    nfunc_min: int, optional
+    out: 1d numpy array or None, optional
+        Array in which to write the output (must not be cube).
 
     Returns
     -------
@@ -357,12 +544,17 @@ def adaptive_transform(cube, sort=True, nfunc_min=1):
         applied.
     """
     # First get integer number of funcs
-    ad_cube = copy.deepcopy(cube)
+    if out is None:
+        ad_cube = np.copy(cube)
+    else:
+        ad_cube = out
+        ad_cube[...] = cube
     nfunc_max = cube.shape[0] - 1
     # first component is a number of funcs
     ad_cube[0] = ((nfunc_min - 0.5) + (1.0 + nfunc_max - nfunc_min) * cube[0])
     if sort:
         nfunc = int(np.round(ad_cube[0]))
         # Sort only parameters 1 to nfunc
-        ad_cube[1:1 + nfunc] = forced_identifiability(cube[1:1 + nfunc])
+        forced_identifiability(
+            cube[1:1 + nfunc], out=ad_cube[1:1 + nfunc])
     return ad_cube
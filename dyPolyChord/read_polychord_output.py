@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+Functions for loading PolyChord output files in parallel.
+
+PolyChord's [root]_dead-birth.txt files can be several GB for long runs with
+many parameters, and loading them with np.loadtxt (as in
+nestcheck.data_processing.process_polychord_run) uses a single core. Here the
+file is split into chunks on line boundaries, which are parsed in a pool of
+worker processes and copied into a single preallocated array.
+
+This module also contains read_stats_counts, a minimal parser for the
+numbers of dead points and likelihood calls in PolyChord's .stats files which
+is used when these are read many times during a run.
+"""
+import concurrent.futures
+import io
+import os
+import warnings
+import numpy as np
+import nestcheck.data_processing
+
+
+def process_polychord_run(file_root, base_dir, **kwargs):
+    """Load a PolyChord run's output into the nestcheck format, parsing the
+    dead-birth file in parallel with load_dead_birth.
+
+    Gives the same output as
+    nestcheck.data_processing.process_polychord_run(file_root, base_dir).
+
+    Parameters
+    ----------
+    file_root: str
+    base_dir: str
+    process_stats_file: bool, optional
+        Whether or not to process the .stats file.
+    kwargs: dict, optional
+        Other keyword arguments are passed to load_dead_birth.
+
+    Returns
+    -------
+    ns_run: dict
+        Nested sampling run in nestcheck format.
+    """
+    process_stats_file = kwargs.pop('process_stats_file', True)
+    samples = load_dead_birth(
+        os.path.join(base_dir, file_root) + '_dead-birth.txt', **kwargs)
+    ns_run = nestcheck.data_processing.process_samples_array(samples)
+    ns_run['output'] = {'base_dir': base_dir, 'file_root': file_root}
+    if process_stats_file:
+        try:
+            ns_run['output'] = (
+                nestcheck.data_processing.process_polychord_stats(
+                    file_root, base_dir))
+        except (OSError, IOError, ValueError, IndexError, NameError,
+                TypeError) as err:
+            warnings.warn(
+                ('process_polychord_stats raised {} processing {}.stats file. '
+                 ' I am proceeding without the .stats file.').format(
+                     type(err).__name__, os.path.join(base_dir, file_root)),
+                UserWarning)
+    return ns_run
+
+
+def load_dead_birth(path, **kwargs):
+    """Load a text file of numbers with the same number of columns on each
+    line (such as a PolyChord dead-birth file) into a 2d array.
+
+    The file is split into chunks of about chunk_size bytes on line boundaries
+    and each chunk is parsed by one of the workers.
+
+    Parameters
+    ----------
+    path: str
+    nproc: int or None, optional
+        Number of worker processes. None uses one per CPU. Ignored if executor
+        is not None.
+    executor: concurrent.futures.Executor or None, optional
+        Executor for parsing the chunks. If None, a ProcessPoolExecutor with
+        nproc workers is used (or no pool if there is only one chunk or
+        nproc=1).
+    chunk_size: int, optional
+        Approximate number of bytes in each chunk.
+
+    Returns
+    -------
+    samples: 2d numpy array
+    """
+    nproc = kwargs.pop('nproc', None)
+    executor = kwargs.pop('executor', None)
+    chunk_size = kwargs.pop('chunk_size', 2 ** 26)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    bounds = chunk_bounds(path, chunk_size)
+    with open(path, 'rb') as infile:
+        ncol = len(infile.readline().split())
+    if executor is None and (len(bounds) == 1 or nproc == 1):
+        parts = [parse_chunk(path, start, end, ncol) for start, end in bounds]
+    elif executor is None:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=nproc) as pool:
+            parts = list(pool.map(
+                parse_chunk, *zip(*[(path, start, end, ncol)
+                                    for start, end in bounds])))
+    else:
+        parts = list(executor.map(
+            parse_chunk, *zip(*[(path, start, end, ncol)
+                                for start, end in bounds])))
+    samples = np.empty((sum(part.shape[0] for part in parts), ncol))
+    row = 0
+    for i, part in enumerate(parts):
+        samples[row:row + part.shape[0], :] = part
+        row += part.shape[0]
+        parts[i] = None  # free memory as we go
+    return samples
+
+
+def chunk_bounds(path, chunk_size):
+    """Split a text file into chunks of about chunk_size bytes, each ending at
+    the end of a line.
+
+    Parameters
+    ----------
+    path: str
+    chunk_size: int
+
+    Returns
+    -------
+    bounds: list of tuples
+        Start and end byte offsets of each chunk.
+    """
+    size = os.path.getsize(path)
+    bounds = []
+    start = 0
+    with open(path, 'rb') as infile:
+        while start < size:
+            infile.seek(min(start + chunk_size, size))
+            infile.readline()  # move to the end of the line
+            end = min(infile.tell(), size)
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def parse_chunk(path, start, end, ncol):
+    """Parse the numbers in bytes start to end of a text file.
+
+    Parameters
+    ----------
+    path: str
+    start: int
+    end: int
+    ncol: int
+        Number of numbers on each line.
+
+    Returns
+    -------
+    array: 2d numpy array
+    """
+    with open(path, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+    # Use np.loadtxt (as nestcheck does) so numbers are parsed identically
+    array = np.loadtxt(io.BytesIO(data), ndmin=2)
+    assert array.shape[1] == ncol, (
+        'Expected {0} numbers on each line in bytes {1} to {2} of {3}, but '
+        'found {4}'.format(ncol, start, end, path, array.shape[1]))
+    return array
+
+
+def sum_nlike(words):
+    """Get the total number of likelihood calls from the numbers following
+    nlike: in a PolyChord .stats file, of which there is one for each
+    parameter speed.
+
+    Parameters
+    ----------
+    words: list of strs
+
+    Returns
+    -------
+    nlike: int or float
+        np.nan if PolyChord wrote asterisks because a number had too many
+        digits.
+    """
+    try:
+        return sum(int(word) for word in words)
+    except ValueError:
+        return np.nan
+
+
+def read_stats_counts(file_root, base_dir):
+    """Read only the numbers of dead points and likelihood calls from a
+    PolyChord .stats file.
+
+    This is much cheaper than
+    nestcheck.data_processing.process_polychord_stats, which parses the whole
+    file.
+
+    Parameters
+    ----------
+    file_root: str
+    base_dir: str
+
+    Returns
+    -------
+    ndead: int
+    nlike: int or float
+        Number of likelihood calls. If there are several parameter speeds,
+        PolyChord writes the number of calls for each of them and their total
+        is returned. This is np.nan if PolyChord wrote asterisks because the
+        number had too many digits.
+    """
+    ndead = None
+    with open(os.path.join(base_dir, file_root) + '.stats', 'r') as stats:
+        for line in stats:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == 'ndead:':
+                ndead = int(words[1])
+            elif words[0] == 'nlike:':
+                nlike = sum_nlike(words[1:])
+                # nlike is written after ndead, so there is no need to read
+                # the rest of the file
+                assert ndead is not None, (
+                    'ndead not found before nlike in ' + stats.name)
+                return ndead, nlike
+    raise ValueError('ndead and nlike not found in ' + stats.name)
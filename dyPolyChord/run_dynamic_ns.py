@@ -3,19 +3,24 @@
 Contains main function for running dynamic nested sampling.
 """
 from __future__ import division  # Enforce float division in python2
+import concurrent.futures
 import copy
 import os
 import traceback
 import sys
 import shutil
+import tempfile
 import warnings
-import numpy as np
 import scipy.signal
-import nestcheck.data_processing
 import nestcheck.io_utils
-import nestcheck.write_polychord_output
-import dyPolyChord.nlive_allocation
+import dyPolyChord.checkpoint
+import dyPolyChord.init_run_cache
+import dyPolyChord.initial_run
 import dyPolyChord.output_processing
+import dyPolyChord.progress_monitor
+import dyPolyChord.python_likelihoods
+import dyPolyChord.storage
+import dyPolyChord.write_polychord_output
 # pylint: disable=bare-except
 
 
@@ -102,14 +107,130 @@ def run_dypolychord(run_polychord, dynamic_goal, settings_dict_in, **kwargs):
         Smoothing to apply to the nlive allocation (if any).
     stats_means_errs: bool, optional
         Whether to include estimates of logZ and parameter mean values and
-        their uncertainties in the .stats file. This is passed to nestcheck's
-        write_run_output; see its documentation for more details.
+        their uncertainties in the .stats file. This is passed to
+        write_polychord_output.write_run_output; see its documentation for
+        more details.
     clean: bool, optional
         Clean the additional output files made by dyPolyChord, leaving only
         output files for the combined run in PolyChord format.
         When debugging this can be set to False to allow inspection of
         intermediate output.
+    resume: bool, optional
+        Resume a previous call of run_dypolychord with the same file_root
+        which did not finish (for example because the job was killed).
+        Steps recorded as finished in the [base_dir]/[file_root]_checkpoint.pkl
+        manifest are skipped. When True, PolyChord also writes .resume files
+        during the dynamic run (Step 3) so that it can be resumed part way
+        through rather than being restarted. The manifest is only saved
+        when resume=True, so only calls made with resume=True can be
+        resumed; when resume=False any manifest or dynamic run .resume file
+        left by a previous call is removed. See checkpoint.load_checkpoint for
+        more details.
+    executor: concurrent.futures.Executor or None, optional
+        If not None, Step 4 is submitted to the executor rather than being
+        performed before the function returns, and the future is returned.
+        See multiple_runs.run_dypolychord_batch.
+    progress: dict or None, optional
+        If not None, the progress of the PolyChord runs in Steps 1 and 3 is
+        monitored using a progress_monitor.ProgressMonitor background thread.
+        The dict contains keyword arguments for ProgressMonitor (for example
+        callback, metrics_file, http_port and interval); see its documentation
+        for more details.
+    init_cache: dict or None, optional
+        If not None, completed initial runs (Step 1) are saved in a persistent
+        cache and Step 1 is skipped if a matching run is found. The dict must
+        contain 'cache_dir' (the cache directory) and 'name' (a string
+        identifying the likelihood and prior, which must be different for
+        runs with different likelihoods or priors), and can contain
+        'max_size' (the maximum size of the cache in bytes, above which the
+        least recently used runs are removed). Runs are matched using a hash
+        of all the settings affecting Step 1; see init_run_cache for more
+        details. Only seeded runs (seed >= 0) are cached. Initial runs
+        performed with init_run_polychord are only cached if the dict also
+        contains 'init_name' (a string identifying init_run_polychord), and
+        never match runs performed with run_polychord.
+    scratch_dir: str or None, optional
+        If not None, all files are written to a new temporary directory in
+        scratch_dir (for example node-local storage such as /tmp or /dev/shm)
+        and only the final output files are copied to base_dir. See
+        run_in_scratch_dir for more details.
+    validation: str, optional
+        How thoroughly to check the initial run, the nlive allocation and the
+        combined run: 'full' (all checks), 'sampled' (checks of logl sorting
+        and threads on random subsets of the samples, for large runs) or 'off'
+        (no checks). See output_processing.check_run and
+        nlive_allocation.allocate for more details.
+    compact: bool or str, optional
+        If True, the combined run processed in Step 4 stores thread labels and
+        nlive as int32, and if 'float32' it also stores theta as float32
+        (roughly halving the memory used for runs with many parameters). See
+        output_processing.compact_run for more details. If compact is not
+        False, the numbers of dead points and likelihood calls at each of the
+        initial run's resumes are also stored as an array rather than a dict
+        (see initial_run.run_and_save_resumes).
+    parallel_load: dict or None, optional
+        If not None, the output files are loaded in Step 4 by parsing them in
+        parallel with read_polychord_output.process_polychord_run, and the
+        dict contains its keyword arguments (for example nproc). This is
+        useful for runs with very large output files.
+    init_run_polychord: callable or None, optional
+        If not None, used instead of run_polychord for the initial run (Step
+        1). For example this could use a cheaper approximate or emulated
+        likelihood.
+    init_settings: dict or None, optional
+        PolyChord settings which override settings_dict_in for the initial
+        run only (for example a lower num_repeats).
+
+        If init_run_polychord or init_settings are specified, the initial run
+        is treated as low fidelity: it is only used to calculate the
+        allocation of live points, and is not included in the final output.
+        Instead the dynamic run starts by sampling the whole prior, and its
+        number of live points is the calculated allocation plus the ninit
+        live points which would otherwise have been provided by the initial
+        run. The initial run is then done without saving resume files, and
+        its likelihood calls are not included in the nlike output.
+    cost_aware: bool, optional
+        If True, the allocation of live points in Step 2 accounts for how the
+        number of likelihood calls PolyChord needs per sample varies with
+        likelihood, which is estimated from the numbers of dead points and
+        likelihood calls when each of the initial run's resume files was
+        saved. The allocation then maximises accuracy per likelihood call
+        rather than per sample. See nlive_allocation.dyn_nlive_array for
+        more details.
+    nlike_tot: int or None, optional
+        Budget of likelihood calls (including the initial run's) used to
+        normalise the allocation when cost_aware=True. If None, the budget is
+        the expected number of calls for the total number of samples
+        determined by max_ndead or nlive_const at the initial run's mean cost
+        per sample.
+    write_threads: int, optional
+        If greater than 1, the output files are written and the intermediate
+        files removed in Step 4 using a pool of this many threads, so that
+        writing and compressing the files overlaps with formatting them. See
+        write_polychord_output.write_run_output for more details. Output files
+        are always written to temporary files which are renamed once they
+        are complete.
+    fsync: bool, optional
+        Whether to fsync the output files written in Step 4 so they are on
+        disk when it finishes.
+    storage: storage.Storage or None, optional
+        If not None, the final output files are put in this storage backend
+        (for example a storage.DirectoryObjectStore) after Step 4. All the
+        intermediate files are still written to the local file system. If
+        scratch_dir is not None the final output files are only put in
+        storage (not base_dir), and otherwise they are also kept in base_dir.
+
+    Returns
+    -------
+    future: concurrent.futures.Future or None
+        Future for Step 4 if an executor was given and Step 4 is performed
+        by this process (i.e. MPI rank 0). Otherwise None.
     """
+    scratch_dir = kwargs.pop('scratch_dir', None)
+    if scratch_dir is not None:
+        return run_in_scratch_dir(
+            run_polychord, dynamic_goal, settings_dict_in, scratch_dir,
+            **kwargs)
     try:
         nlive_const = kwargs.pop('nlive_const', settings_dict_in['nlive'])
     except KeyError:
@@ -121,204 +242,392 @@ def run_dypolychord(run_polychord, dynamic_goal, settings_dict_in, **kwargs):
         x, 1 + (2 * ninit), 3, mode='nearest'))
     smoothing_filter = kwargs.pop('smoothing_filter', default_smoothing)
     comm = kwargs.pop('comm', None)
-    stats_means_errs = kwargs.pop('stats_means_errs', True)
-    clean = kwargs.pop('clean', True)
+    resume = kwargs.pop('resume', False)
+    progress = kwargs.pop('progress', None)
+    init_cache = kwargs.pop('init_cache', None)
+    validation = kwargs.pop('validation', 'full')
+    compact = kwargs.pop('compact', False)
+    init_run_polychord = kwargs.pop('init_run_polychord', None)
+    init_settings = kwargs.pop('init_settings', None)
+    cost_aware = kwargs.pop('cost_aware', False)
+    nlike_tot = kwargs.pop('nlike_tot', None)
+    output_kwargs = {'dynamic_goal': dynamic_goal, 'comm': comm,
+                     'validation': validation, 'compact': compact}
+    for key, default in [('stats_means_errs', True), ('clean', True),
+                         ('executor', None), ('parallel_load', None),
+                         ('write_threads', 1), ('fsync', False),
+                         ('storage', None)]:
+        output_kwargs[key] = kwargs.pop(key, default)
     if kwargs:
         raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    # Only merge the initial run into the final output if it uses the same
+    # likelihood and settings as the dynamic run
+    merge_init = init_run_polychord is None and not init_settings
+    init_cache, init_name = dyPolyChord.init_run_cache.check_init_cache(
+        init_cache, init_run_polychord)
+    if init_run_polychord is None:
+        init_run_polychord = run_polychord
     # Step 1: do initial run
     # ----------------------
     # set up rank if running with MPI
-    if comm is not None:
-        rank = comm.Get_rank()
-    else:
-        rank = 0
-    settings_dict = None  # define for rank != 0
+    rank = 0 if comm is None else comm.Get_rank()
+    nhit_start = dyPolyChord.python_likelihoods.get_cache_hits(run_polychord)
+    settings_dict = root_name = checkpoint = None  # define for rank != 0
     if rank == 0:
-        settings_dict_in, output_settings = check_settings(
-            settings_dict_in)
-        if (settings_dict_in['seed'] >= 0 and comm is not None and
-                comm.Get_size() > 1):
-            warnings.warn((
-                'N.B. seeded results will not be reproducable when running '
-                'dyPolyChord with multiple MPI processes. You have seed={} '
-                'and {} MPI processes.').format(
-                    settings_dict_in['seed'], comm.Get_size()), UserWarning)
-        # Make a copy of settings dic so we dont edit settings
-        settings_dict = copy.deepcopy(settings_dict_in)
-        settings_dict['file_root'] = settings_dict['file_root'] + '_init'
-        settings_dict['nlive'] = ninit
-    if dynamic_goal == 0:
-        # We definitely won't need to resume midway through in this case, so
-        # just run PolyChod normally
-        run_polychord(settings_dict, comm=comm)
-        if rank == 0:
-            final_seed = settings_dict['seed']
-            if settings_dict['seed'] >= 0:
-                final_seed += seed_increment
-            step_ndead = None
-            resume_outputs = None
-    else:
-        step_ndead, resume_outputs, final_seed = run_and_save_resumes(
-            run_polychord, settings_dict, init_step, seed_increment, comm=comm)
+        settings_dict_in, output_settings = check_settings(settings_dict_in)
+        root_name = os.path.join(settings_dict_in['base_dir'],
+                                 settings_dict_in['file_root'])
+        checkpoint = dyPolyChord.checkpoint.start_checkpoint(
+            root_name, resume, dynamic_goal=dynamic_goal, ninit=ninit,
+            init_step=init_step, init_seed=settings_dict_in['seed'])
+        settings_dict = dyPolyChord.initial_run.init_run_settings(
+            settings_dict_in, init_settings, ninit)
+    step_ndead, resume_outputs, final_seed = (
+        dyPolyChord.initial_run.run_initial(
+            init_run_polychord, settings_dict, checkpoint,
+            root_name=root_name, init_step=init_step,
+            seed_increment=seed_increment,
+            save_resumes=dynamic_goal != 0 and merge_init, resume=resume,
+            init_cache=init_cache, progress=progress, comm=comm,
+            cache_key_kwargs={'merge_init': merge_init,
+                              'init_name': init_name},
+            compact_outputs=bool(compact)))
     # Step 2: calculate an allocation of live points
     # ----------------------------------------------
     if rank == 0:
-        try:
-            # Get settings for dynamic run based on initial run
-            settings_dict = process_initial_run(
-                settings_dict_in, nlive_const=nlive_const,
-                smoothing_filter=smoothing_filter,
-                step_ndead=step_ndead, resume_outputs=resume_outputs,
-                ninit=ninit, dynamic_goal=dynamic_goal,
-                final_seed=final_seed)
-        except:  # pragma: no cover
-            if comm is None or comm.Get_size() == 1:
-                raise
-            else:
-                # print error info
-                traceback.print_exc(file=sys.stdout)
-                print('Error in process with rank == 0: forcing MPI abort.')
-                sys.stdout.flush()  # Make sure message prints before abort
-                comm.Abort(1)
+        settings_dict = dyn_run_settings(
+            settings_dict_in, checkpoint, resume=resume, comm=comm,
+            nlive_const=nlive_const, smoothing_filter=smoothing_filter,
+            step_ndead=step_ndead, resume_outputs=resume_outputs,
+            ninit=ninit, dynamic_goal=dynamic_goal, final_seed=final_seed,
+            validation=validation, merge_init=merge_init,
+            cost_aware=cost_aware, nlike_tot=nlike_tot)
     # Step 3: do dynamic run
     # ----------------------
-    run_polychord(settings_dict, comm=comm)
+    if not merge_init:
+        # Only count cache hits from the dynamic run
+        nhit_start = dyPolyChord.python_likelihoods.get_cache_hits(
+            run_polychord)
+    run_dynamic(run_polychord, settings_dict, checkpoint,
+                root_name=root_name, resume=resume, progress=progress,
+                comm=comm)
     # Step 4: process output and tidy
     # -------------------------------
+    output_kwargs['nlike_cached'] = (
+        dyPolyChord.python_likelihoods.count_cache_hits(
+            run_polychord, nhit_start, comm=comm))
+    if rank != 0:
+        return None
+    return process_and_store_output(
+        settings_dict_in, output_settings,
+        checkpoint if resume else None,
+        process=4 not in checkpoint['steps_done'],
+        **output_kwargs)
+
+
+def dyn_run_settings(settings_dict_in, checkpoint, **kwargs):
+    """Calculate the allocation of live points and the PolyChord settings
+    for the dynamic run (Step 2 of run_dypolychord), unless the checkpoint
+    manifest shows this was done by a previous call.
+
+    Parameters
+    ----------
+    settings_dict_in: dict
+        PolyChord settings, as returned by check_settings.
+    checkpoint: dict
+        Checkpoint manifest (see checkpoint.load_checkpoint). Edited in
+        place.
+    resume: bool
+        If True, the manifest is saved and PolyChord writes .resume files
+        during the dynamic run (which is resumed from any .resume file left
+        by a previous call).
+    comm: None or mpi4py MPI.COMM object, optional
+    kwargs: dict
+        Passed to initial_run.process_initial_run.
+
+    Returns
+    -------
+    settings_dict: dict
+        PolyChord settings for the dynamic run.
+    """
+    resume = kwargs.pop('resume')
+    comm = kwargs.pop('comm', None)
+    root_name = os.path.join(settings_dict_in['base_dir'],
+                             settings_dict_in['file_root'])
+    try:
+        if 2 in checkpoint['steps_done']:
+            settings_dict = checkpoint['dyn_settings']
+        else:
+            # Get settings for dynamic run based on initial run
+            settings_dict = dyPolyChord.initial_run.process_initial_run(
+                settings_dict_in, **kwargs)
+            if resume:
+                # Allow PolyChord to resume the dynamic run part way
+                # through if it is interrupted
+                settings_dict['write_resume'] = True
+            checkpoint['dyn_settings'] = settings_dict
+            dyPolyChord.checkpoint.save_checkpoint(
+                checkpoint, root_name, 2, write=resume)
+        if resume and 3 not in checkpoint['steps_done'] and os.path.isfile(
+                root_name + '_dyn.resume'):
+            settings_dict['read_resume'] = True
+    except:  # pragma: no cover
+        if comm is None or comm.Get_size() == 1:
+            raise
+        else:
+            # print error info
+            traceback.print_exc(file=sys.stdout)
+            print('Error in process with rank == 0: forcing MPI abort.')
+            sys.stdout.flush()  # Make sure message prints before abort
+            comm.Abort(1)
+    return settings_dict
+
+
+def run_dynamic(run_polychord, settings_dict, checkpoint, **kwargs):
+    """Do the dynamic run (Step 3 of run_dypolychord), unless the
+    checkpoint manifest shows it was finished by a previous call.
+
+    Parameters
+    ----------
+    run_polychord: callable
+    settings_dict: dict or None
+        PolyChord settings for the dynamic run (None on MPI ranks other than
+        0).
+    checkpoint: dict or None
+        Checkpoint manifest (None on MPI ranks other than 0). Edited in
+        place.
+    root_name: str or None
+        File root. Equivalent to os.path.join(base_dir, file_root).
+    resume: bool, optional
+        Whether to save the manifest.
+    progress: dict or None, optional
+        See progress_monitor.start_monitor.
+    comm: None or mpi4py MPI.COMM object, optional
+    """
+    root_name = kwargs.pop('root_name')
+    resume = kwargs.pop('resume', False)
+    progress = kwargs.pop('progress', None)
+    comm = kwargs.pop('comm', None)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    rank = 0 if comm is None else comm.Get_rank()
+    steps_done = checkpoint['steps_done'] if rank == 0 else []
+    if resume and comm is not None:
+        steps_done = comm.bcast(steps_done, root=0)
+    if 3 in steps_done:
+        return
+    monitor = dyPolyChord.progress_monitor.start_monitor(
+        progress, settings_dict) if rank == 0 else None
+    try:
+        run_polychord(settings_dict, comm=comm)
+    finally:
+        if monitor is not None:
+            monitor.stop()
     if rank == 0:
-        try:
-            # Combine initial and dynamic runs
-            run = dyPolyChord.output_processing.process_dypolychord_run(
-                settings_dict_in['file_root'], settings_dict_in['base_dir'],
-                dynamic_goal=dynamic_goal)
-            # Save combined output in PolyChord format
-            nestcheck.write_polychord_output.write_run_output(
-                run, stats_means_errs=stats_means_errs, **output_settings)
-            if clean:
-                # Remove temporary files
-                root_name = os.path.join(settings_dict_in['base_dir'],
-                                         settings_dict_in['file_root'])
-                clean_extra_output(root_name)
-        except:  # pragma: no cover
-            if comm is None or comm.Get_size() == 1:
-                raise
-            else:
-                # print error info
-                traceback.print_exc(file=sys.stdout)
-                print('Error in process with rank == 0: forcing MPI abort.')
-                sys.stdout.flush()  # Make sure message prints before abort
-                comm.Abort(1)
-
-
-def process_initial_run(settings_dict_in, **kwargs):
-    """Loads the initial exploratory run and analyses it to create the settings
-    for the second, dynamic run.
+        dyPolyChord.checkpoint.save_checkpoint(
+            checkpoint, root_name, 3, write=resume)
+
+
+def process_and_store_output(settings_dict_in, output_settings, checkpoint,
+                             **kwargs):
+    """Process the output (Step 4 of run_dypolychord) using
+    process_and_save_output and put the final output files in storage.
 
     Parameters
     ----------
     settings_dict_in: dict
-        Initial PolyChord settings (see check_settings for information on
-        allowed and default settings).
+        PolyChord settings, as returned by check_settings.
+    output_settings: dict
+        Settings for writing output files, as returned by check_settings.
+    checkpoint: dict or None
+        Checkpoint manifest (see process_and_save_output).
+    process: bool, optional
+        Whether to process the output. This is False if Step 4 was finished
+        by a previous call, in which case the files are only stored.
+    executor: concurrent.futures.Executor or None, optional
+        If not None, the output is processed and stored using the executor
+        and the future is returned.
+    storage: storage.Storage or None, optional
+        If not None, the output files are put in this storage backend (see
+        storage.store_output_files).
+    kwargs: dict
+        Passed to process_and_save_output.
+
+    Returns
+    -------
+    future: concurrent.futures.Future or None
+    """
+    process = kwargs.pop('process', True)
+    executor = kwargs.pop('executor', None)
+    storage = kwargs.pop('storage', None)
+    future = None
+    if process and executor is None:
+        process_and_save_output(
+            settings_dict_in, output_settings, checkpoint, **kwargs)
+    elif process:
+        future = executor.submit(
+            process_and_save_output, settings_dict_in, output_settings,
+            checkpoint, **kwargs)
+    if storage is None:
+        return future
+    store_args = (settings_dict_in['base_dir'], settings_dict_in['file_root'],
+                  storage)
+    if future is None:
+        dyPolyChord.storage.store_output_files(
+            *store_args, final_only=kwargs.get('clean', True))
+        return None
+    return executor.submit(
+        dyPolyChord.storage.store_output_files, *store_args,
+        final_only=kwargs.get('clean', True), wait_for=future)
+
+
+def run_in_scratch_dir(run_polychord, dynamic_goal, settings_dict_in,
+                       scratch_dir, **kwargs):
+    """Run run_dypolychord writing all files to a new temporary directory
+    within scratch_dir, then copy the final output files to base_dir (or put
+    them in the storage backend given by the storage keyword argument).
+
+    This is useful when base_dir is on a slow shared file system, as all the
+    intermediate files written during the calculation stay in the (faster)
+    scratch directory. Files are copied in parallel, and each copy is checked
+    against the original using its size and SHA-256 hash before being renamed
+    into place. The temporary directory is removed whether or not the
+    calculation succeeds.
+
+    If run_dypolychord is given an executor, copying the output files is also
+    performed using the executor after Step 4 has finished.
+
+    Parameters
+    ----------
+    run_polychord: callable
     dynamic_goal: float or int
-        Number in (0, 1) which determines how to allocate computational effort
-        between parameter estimation and evidence calculation. See the dynamic
-        nested sampling paper for more details.
-    nlive_const: int
-        Used to calculate total number of samples if max_ndead not specified in
-        settings. The total number of samples used is the estimated number that
-        would be taken by a nested sampling run with a constant number of live
-        points nlive_const.
-    ninit: int
-        Number of live points to use for the initial exporatory run (Step 1).
-    smoothing_filter: func
-        Smoothing to apply to the nlive allocation (if any).
-    step_ndead: list of ints
-        Numbers of dead points at which resume files are saved.
-    resume_outputs: dict
-        Dictionary containing run output (contents of .stats file) at each
-        resume. Keys are elements of step_ndead.
-    final_seed: int
-        Random seed at the end of the initial run.
+    settings_dict_in: dict
+    scratch_dir: str
+        Directory in which to make the temporary directory.
+    kwargs: dict, optional
+        Passed to run_dypolychord, apart from storage which is passed to
+        storage.copy_output_files. Note that resume=True is not allowed as the
+        temporary directory is not kept when the calculation fails.
+
+    Returns
+    -------
+    future: concurrent.futures.Future or None
+        See run_dypolychord.
+    """
+    assert not kwargs.get('resume', False), (
+        'resume=True cannot be used with scratch_dir.')
+    comm = kwargs.get('comm', None)
+    if comm is not None and comm.Get_rank() != 0:
+        # Only rank 0 writes files
+        return run_dypolychord(
+            run_polychord, dynamic_goal, settings_dict_in, **kwargs)
+    settings_dict = copy.deepcopy(settings_dict_in)
+    base_dir = settings_dict.get('base_dir', 'chains')
+    file_root = settings_dict.get('file_root', 'temp')
+    storage = kwargs.pop('storage', None)
+    if storage is None and not os.path.exists(base_dir):
+        os.makedirs(base_dir)
+    settings_dict['base_dir'] = tempfile.mkdtemp(
+        prefix=file_root + '_', dir=scratch_dir)
+    copy_kwargs = {'final_only': kwargs.get('clean', True),
+                   'storage': storage}
+    try:
+        future = run_dypolychord(
+            run_polychord, dynamic_goal, settings_dict, **kwargs)
+    except:
+        shutil.rmtree(settings_dict['base_dir'], ignore_errors=True)
+        raise
+    if future is None:
+        dyPolyChord.storage.copy_output_files(
+            settings_dict['base_dir'], base_dir, file_root, **copy_kwargs)
+        return None
+    return kwargs['executor'].submit(
+        dyPolyChord.storage.copy_output_files, settings_dict['base_dir'],
+        base_dir, file_root, wait_for=future, **copy_kwargs)
+
+
+def process_and_save_output(settings_dict_in, output_settings, checkpoint,
+                            **kwargs):
+    """Combine the initial and dynamic runs, write the output files in
+    PolyChord format and remove intermediate files (Step 4 of
+    run_dypolychord).
+
+    Parameters
+    ----------
+    settings_dict_in: dict
+        PolyChord settings, as returned by check_settings.
+    output_settings: dict
+        Settings for writing output files, as returned by check_settings.
+    checkpoint: dict or None
+        Checkpoint manifest (see checkpoint.load_checkpoint). If None, no
+        manifest is saved.
+    dynamic_goal: float or int
+    nlike_cached: int, optional
+        Number of likelihood calls answered from a cache.
+    stats_means_errs: bool, optional
+    clean: bool, optional
+    comm: None or mpi4py MPI.COMM object, optional
+    validation: str, optional
+    compact: bool or str, optional
+    parallel_load: dict or None, optional
+    write_threads: int, optional
+    fsync: bool, optional
     """
     dynamic_goal = kwargs.pop('dynamic_goal')
-    nlive_const = kwargs.pop('nlive_const')
-    ninit = kwargs.pop('ninit')
-    smoothing_filter = kwargs.pop('smoothing_filter')
-    step_ndead = kwargs.pop('step_ndead')
-    resume_outputs = kwargs.pop('resume_outputs')
-    final_seed = kwargs.pop('final_seed')
+    nlike_cached = kwargs.pop('nlike_cached', 0)
+    stats_means_errs = kwargs.pop('stats_means_errs', True)
+    clean = kwargs.pop('clean', True)
+    comm = kwargs.pop('comm', None)
+    validation = kwargs.pop('validation', 'full')
+    compact = kwargs.pop('compact', False)
+    parallel_load = kwargs.pop('parallel_load', None)
+    write_threads = kwargs.pop('write_threads', 1)
+    fsync = kwargs.pop('fsync', False)
     if kwargs:
         raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
-    init_run = nestcheck.data_processing.process_polychord_run(
-        settings_dict_in['file_root'] + '_init',
-        settings_dict_in['base_dir'])
-    # Calculate max number of samples
-    if settings_dict_in['max_ndead'] > 0:
-        samp_tot = settings_dict_in['max_ndead']
-        assert (settings_dict_in['max_ndead']
-                > init_run['logl'].shape[0]), (
-                    'all points used in init run - '
-                    'none left for dynamic')
-    else:
-        samp_tot = init_run['logl'].shape[0] * (nlive_const / ninit)
-        assert nlive_const > ninit
-    dyn_info = dyPolyChord.nlive_allocation.allocate(
-        init_run, samp_tot, dynamic_goal,
-        smoothing_filter=smoothing_filter)
     root_name = os.path.join(settings_dict_in['base_dir'],
                              settings_dict_in['file_root'])
-    if dyn_info['peak_start_ind'] != 0:
-        # subtract 1 as ndead=1 corresponds to point 0
-        resume_steps = np.asarray(step_ndead) - 1
-        # Work out which resume file to load. This is the first resume file
-        # before dyn_info['peak_start_ind']. If there are no such files then we
-        # do not reload and instead start the second dynamic run by samling
-        # from the entire prior.
-        indexes_before_peak = np.where(
-            resume_steps < dyn_info['peak_start_ind'])[0]
-        if indexes_before_peak.shape[0] > 0:
-            resume_ndead = step_ndead[indexes_before_peak[-1]]
-            # copy resume step to dynamic file root
-            shutil.copyfile(
-                root_name + '_init_' + str(resume_ndead) + '.resume',
-                root_name + '_dyn.resume')
-            # Save resume info
-            dyn_info['resume_ndead'] = resume_ndead
-            try:
-                dyn_info['resume_nlike'] = (
-                    resume_outputs[resume_ndead]['nlike'])
-            except KeyError:
-                pass  # protect from error reading nlike from .stats file
-    nestcheck.io_utils.pickle_save(
-        dyn_info, root_name + '_dyn_info', overwrite_existing=True)
-    if dynamic_goal != 0:
-        # Remove all the temporary resume files. Use set to avoid
-        # duplicates as these cause OSErrors.
-        for snd in set(step_ndead):
-            os.remove(root_name + '_init_' + str(snd) + '.resume')
-    settings_dict = copy.deepcopy(settings_dict_in)
-    settings_dict['seed'] = final_seed
-    if settings_dict['seed'] >= 0:
-        assert settings_dict_in['seed'] >= 0, (
-            'if input seed was <0 it should not have been edited')
-    if dyn_info['peak_start_ind'] != 0:
-        settings_dict['nlive'] = ninit
-    else:
-        settings_dict['nlive'] = dyn_info['nlives_dict'][
-            min(dyn_info['nlives_dict'].keys())]
-    settings_dict['nlives'] = dyn_info['nlives_dict']
-    # To write .ini files correctly, read_resume must be type bool not
-    # np.bool
-    settings_dict['read_resume'] = (
-        bool(dyn_info['peak_start_ind'] != 0))
-    settings_dict['file_root'] = settings_dict_in['file_root'] + '_dyn'
-    return settings_dict
+    pool = (concurrent.futures.ThreadPoolExecutor(max_workers=write_threads)
+            if write_threads > 1 else None)
+    try:
+        # Combine initial and dynamic runs
+        run = dyPolyChord.output_processing.process_dypolychord_run(
+            settings_dict_in['file_root'], settings_dict_in['base_dir'],
+            dynamic_goal=dynamic_goal, nlike_cached=nlike_cached,
+            validation=validation, compact=compact,
+            parallel_load=parallel_load)
+        # Save combined output in PolyChord format
+        # Use seeded systematic resampling for the equally weighted samples
+        # so they are reproducible when PolyChord's seed is set
+        seed = settings_dict_in.get('seed', -1)
+        dyPolyChord.write_polychord_output.write_run_output(
+            run, stats_means_errs=stats_means_errs,
+            equals_method='systematic',
+            equals_seed=seed if seed >= 0 else None, executor=pool,
+            fsync=fsync, **output_settings)
+        if checkpoint is not None:
+            dyPolyChord.checkpoint.save_checkpoint(checkpoint, root_name, 4)
+        if clean:
+            # Remove temporary files
+            clean_extra_output(root_name, executor=pool)
+    except:  # pragma: no cover
+        if comm is None or comm.Get_size() == 1:
+            raise
+        else:
+            # print error info
+            traceback.print_exc(file=sys.stdout)
+            print('Error in process with rank == 0: forcing MPI abort.')
+            sys.stdout.flush()  # Make sure message prints before abort
+            comm.Abort(1)
+    finally:
+        if pool is not None:
+            pool.shutdown()
 
 
 # Helper functions
 # ----------------
 
-def clean_extra_output(root_name):
+def clean_extra_output(root_name, executor=None):
     """Clean the additional output files made by dyPolyChord, leaving only
     output files for the combined run in PolyChord format.
 
@@ -326,19 +635,22 @@ def clean_extra_output(root_name):
     ----------
     root_name: str
         File root. Equivalent to os.path.join(base_dir, file_root).
+    executor: concurrent.futures.Executor or None, optional
+        If not None, the files are removed concurrently using the executor.
     """
-    os.remove(root_name + '_dyn_info.pkl')
+    paths = [root_name + '_dyn_info.pkl']
+    optional_paths = [root_name + '_checkpoint.pkl']
     for extra in ['init', 'dyn']:
-        os.remove(root_name + '_{0}.stats'.format(extra))
-        os.remove(root_name + '_{0}_dead-birth.txt'.format(extra))
-        os.remove(root_name + '_{0}_dead.txt'.format(extra))
+        paths += [root_name + '_{0}.stats'.format(extra),
+                  root_name + '_{0}_dead-birth.txt'.format(extra),
+                  root_name + '_{0}_dead.txt'.format(extra)]
         # tidy up remaining .resume files (if the function has reach this
         # point, both the initial and dynamic runs have finished so we
         # shouldn't need to resume)
-        try:
-            os.remove(root_name + '_{0}.resume'.format(extra))
-        except OSError:
-            pass
+        optional_paths.append(root_name + '_{0}.resume'.format(extra))
+    mapper = map if executor is None else executor.map
+    list(mapper(os.remove, paths))
+    list(mapper(dyPolyChord.checkpoint.remove_if_exists, optional_paths))
 
 
 def check_settings(settings_dict_in):
@@ -346,6 +658,11 @@ def check_settings(settings_dict_in):
     Checks the input dictionary of PolyChord settings. Issues warnings where
     these are not appropriate, and adds default values.
 
+    PolyChord's fast-slow decomposition settings grade_dims and grade_frac
+    can be used; grade_frac can also be a dict with separate values for the
+    initial and dynamic runs (see phase_settings). When using a
+    python_priors.BlockPrior with speeds, grade_dims is set automatically.
+
     Parameters
     ----------
     settings_dict_in: dict
@@ -392,108 +709,24 @@ def check_settings(settings_dict_in):
                 'so I am proceeding with this. You tried to specify {0}={2}.'
                 .format(key, value, settings_dict_in[key])), UserWarning)
         settings_dict[key] = value
+    # Check fast-slow decomposition settings. grade_frac can be a dict with
+    # separate values for the initial and dynamic runs (see phase_settings).
+    if isinstance(settings_dict.get('grade_frac'), dict):
+        assert set(settings_dict['grade_frac'].keys()) == {'init', 'dyn'}, (
+            'grade_frac dict should have keys "init" and "dyn": {}'.format(
+                settings_dict['grade_frac']))
+        grade_fracs = list(settings_dict['grade_frac'].values())
+    else:
+        grade_fracs = [settings_dict.get('grade_frac')]
+    if 'grade_dims' in settings_dict:
+        for grade_frac in grade_fracs:
+            assert grade_frac is None or (
+                len(grade_frac) == len(settings_dict['grade_dims'])), (
+                    'grade_frac={} and grade_dims={} have different '
+                    'lengths'.format(grade_frac, settings_dict['grade_dims']))
     # Extract output settings (not needed until later)
     output_settings = {}
     for key in ['posteriors', 'equals']:
         output_settings[key] = settings_dict[key]
         settings_dict[key] = False
     return settings_dict, output_settings
-
-
-def run_and_save_resumes(run_polychord, settings_dict_in, init_step,
-                         seed_increment, comm=None):
-    """
-    Run PolyChord pausing after every init_step dead points to save a resume
-    file.
-
-    Parameters
-    ----------
-    run_polychord: callable
-        Callable which runs PolyChord with the desired likelihood and prior,
-        and takes a settings dictionary as its argument.
-    settings_dict: dict
-        PolyChord settings to use (see check_settings for information on
-        allowed and default settings).
-    ninit_step: int, optional
-        Number of samples taken between saving .resume files in Step 1.
-    seed_increment: int, optional
-        If seeding is used (PolyChord seed setting >= 0), this increment is
-        added to PolyChord's random seed each time it is run to avoid
-        repeated points.
-        When running in parallel using MPI, PolyChord hashes the seed with the
-        MPI rank using IEOR. Hence you need seed_increment to be > number of
-        processors to ensure no two processes use the same seed.
-        When running repeated results you need to increment the seed used for
-        each run by some number >> seed_increment.
-    comm: None or mpi4py MPI.COMM object, optional
-        For MPI parallelisation.
-
-    Returns
-    -------
-    step_ndead: list of ints
-        Numbers of dead points at which resume files are saved.
-    resume_outputs: dict
-        Dictionary containing run output (contents of .stats file) at each
-        resume. Keys are elements of step_ndead.
-    final_seed: int
-        Random seed. This is incremented after each run so it can be used
-        when resuming without generating correlated points.
-    """
-    settings_dict = copy.deepcopy(settings_dict_in)
-    # set up rank if running with MPI
-    if comm is not None:
-        # Define variables for rank != 0
-        step_ndead = None
-        resume_outputs = None
-        final_seed = None
-        # Get rank
-        rank = comm.Get_rank()
-    else:
-        rank = 0
-    if rank == 0:
-        root_name = os.path.join(settings_dict['base_dir'],
-                                 settings_dict['file_root'])
-        try:
-            os.remove(root_name + '.resume')
-        except OSError:
-            pass
-        settings_dict['write_resume'] = True
-        settings_dict['read_resume'] = True
-        step_ndead = []
-        resume_outputs = {}
-    add_points = True
-    while add_points:
-        if rank == 0:
-            settings_dict['max_ndead'] = (len(step_ndead) + 1) * init_step
-        run_polychord(settings_dict, comm=comm)
-        if rank == 0:
-            try:
-                if settings_dict['seed'] >= 0:
-                    settings_dict['seed'] += seed_increment
-                run_output = nestcheck.data_processing.process_polychord_stats(
-                    settings_dict['file_root'], settings_dict['base_dir'])
-                # Store run outputs for getting number of likelihood calls
-                # while accounding for resuming a run.
-                resume_outputs[run_output['ndead']] = run_output
-                step_ndead.append(run_output['ndead'] - settings_dict['nlive'])
-                if len(step_ndead) >= 2 and step_ndead[-1] == step_ndead[-2]:
-                    add_points = False
-                # store resume file in new file path
-                shutil.copyfile(
-                    root_name + '.resume',
-                    root_name + '_' + str(step_ndead[-1]) + '.resume')
-            except:  # pragma: no cover
-                if comm is None or comm.Get_size() == 1:
-                    raise
-                else:
-                    # print error info
-                    traceback.print_exc(file=sys.stdout)
-                    print('Error in process with rank == 0: '
-                          'forcing MPI abort.')
-                    sys.stdout.flush()  # Make sure message prints before abort
-                    comm.Abort(1)
-        if comm is not None:
-            add_points = comm.bcast(add_points, root=0)
-    if rank == 0:
-        final_seed = settings_dict['seed']
-    return step_ndead, resume_outputs, final_seed
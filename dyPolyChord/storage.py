@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+"""
+Storage backends for dyPolyChord's final output files.
+
+PolyChord and dyPolyChord write all their intermediate files (resume files,
+the initial and dynamic runs' output and so on) to the local file system.
+run_dypolychord can then put the final output files in PolyChord format into
+a storage backend, for example to archive them directly to an object store.
+
+Three backends are included:
+
+    * LocalStorage: a directory on the local (or a shared) file system;
+    * MemoryStorage: a dictionary in memory (for testing and for using the
+      output without writing it to disk);
+    * DirectoryObjectStore: a stand-in for an object store which keeps each
+      object as a directory of parts. Files are uploaded in parts of fixed
+      size on a thread pool (like multipart uploads), and an object only
+      becomes visible once all its parts have been uploaded and checked.
+
+Other backends (for example for a cloud object store) can be added by
+subclassing Storage and implementing its put, get, read, exists, remove and
+names methods.
+
+store_output_files and copy_output_files put a run's output files in a
+backend.
+"""
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+
+class Storage(object):
+
+    """Base class for storage backends. Objects are identified by names,
+    which are the file names of the output files (not including base_dir)."""
+
+    def __init__(self, nthread=4):
+        """
+        Parameters
+        ----------
+        nthread: int, optional
+            Number of files (or parts of files) to transfer at once.
+        """
+        self.nthread = nthread
+
+    def put(self, local_path, name):
+        """Store a local file.
+
+        Parameters
+        ----------
+        local_path: str
+        name: str
+        """
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """Store several local files, transferring up to nthread at once.
+
+        Parameters
+        ----------
+        items: list of tuples
+            (local_path, name) for each file.
+        """
+        if self.nthread <= 1:
+            for local_path, name in items:
+                self.put(local_path, name)
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.nthread) as executor:
+            for fut in [executor.submit(self.put, local_path, name)
+                        for local_path, name in items]:
+                fut.result()
+
+    def get(self, name, local_path):
+        """Copy a stored object to a local file.
+
+        Parameters
+        ----------
+        name: str
+        local_path: str
+        """
+        raise NotImplementedError
+
+    def read(self, name):
+        """Get the contents of a stored object.
+
+        Parameters
+        ----------
+        name: str
+
+        Returns
+        -------
+        bytes
+        """
+        raise NotImplementedError
+
+    def exists(self, name):
+        """Check if an object is stored.
+
+        Parameters
+        ----------
+        name: str
+
+        Returns
+        -------
+        bool
+        """
+        raise NotImplementedError
+
+    def remove(self, name):
+        """Remove a stored object.
+
+        Parameters
+        ----------
+        name: str
+        """
+        raise NotImplementedError
+
+    def names(self):
+        """Get the names of the stored objects.
+
+        Returns
+        -------
+        list of strs
+            Sorted names.
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+
+    """Storage in a directory on the file system. Each file is copied to a
+    temporary file and checked against the original using its size and
+    SHA-256 hash before being renamed into place."""
+
+    def __init__(self, base_dir, nthread=4):
+        """
+        Parameters
+        ----------
+        base_dir: str
+            Directory (made if it does not exist).
+        nthread: int, optional
+        """
+        Storage.__init__(self, nthread=nthread)
+        self.base_dir = base_dir
+        if not os.path.exists(base_dir):
+            os.makedirs(base_dir)
+
+    def put(self, local_path, name):
+        """Copy a local file into base_dir (see checked_copy)."""
+        checked_copy(local_path, os.path.join(self.base_dir, name))
+
+    def get(self, name, local_path):
+        """Copy a file from base_dir."""
+        shutil.copyfile(os.path.join(self.base_dir, name), local_path)
+
+    def read(self, name):
+        """Read a file from base_dir."""
+        with open(os.path.join(self.base_dir, name), 'rb') as infile:
+            return infile.read()
+
+    def exists(self, name):
+        """Check if a file is in base_dir."""
+        return os.path.isfile(os.path.join(self.base_dir, name))
+
+    def remove(self, name):
+        """Remove a file from base_dir."""
+        os.remove(os.path.join(self.base_dir, name))
+
+    def names(self):
+        """Get the names of the files in base_dir (excluding incomplete
+        copies)."""
+        return sorted(
+            name for name in os.listdir(self.base_dir)
+            if os.path.isfile(os.path.join(self.base_dir, name))
+            and not name.endswith('.part'))
+
+
+class MemoryStorage(Storage):
+
+    """Storage of file contents in a dictionary in memory."""
+
+    def __init__(self, nthread=1):
+        """
+        Parameters
+        ----------
+        nthread: int, optional
+        """
+        Storage.__init__(self, nthread=nthread)
+        self.objects = {}
+
+    def put(self, local_path, name):
+        """Read a local file into memory."""
+        with open(local_path, 'rb') as infile:
+            self.objects[name] = infile.read()
+
+    def get(self, name, local_path):
+        """Write an object to a local file."""
+        with open(local_path, 'wb') as outfile:
+            outfile.write(self.objects[name])
+
+    def read(self, name):
+        """Get an object's contents."""
+        return self.objects[name]
+
+    def exists(self, name):
+        """Check if an object is stored."""
+        return name in self.objects
+
+    def remove(self, name):
+        """Remove an object."""
+        del self.objects[name]
+
+    def names(self):
+        """Get the names of the objects."""
+        return sorted(self.objects.keys())
+
+
+class DirectoryObjectStore(Storage):
+
+    """Stand-in for an object store, with each object kept in a directory.
+
+    Files are uploaded in parts of part_size bytes, which are transferred in
+    parallel using a pool of nthread threads (with put_many, the parts of all
+    the files share one pool). Each object's directory contains its parts
+    and a manifest.json file listing the parts' sizes and SHA-256 hashes.
+    Parts are uploaded to a temporary directory, which is renamed to the
+    object's directory only after the manifest has been written, so
+    incomplete uploads are never visible. Downloads check each part against
+    the manifest.
+    """
+
+    def __init__(self, root, part_size=2 ** 23, nthread=4):
+        """
+        Parameters
+        ----------
+        root: str
+            Directory containing the objects (made if it does not exist).
+        part_size: int, optional
+            Number of bytes in each part.
+        nthread: int, optional
+        """
+        Storage.__init__(self, nthread=nthread)
+        self.root = root
+        self.part_size = part_size
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def put(self, local_path, name):
+        """Upload a local file in parts."""
+        self.put_many([(local_path, name)])
+
+    def put_many(self, items):
+        """Upload several local files, with all their parts transferred on
+        one thread pool."""
+        uploads = []
+        upload_dirs = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(self.nthread, 1)) as executor:
+            try:
+                for local_path, name in items:
+                    upload_dir = os.path.join(
+                        self.root, '.upload-{}'.format(uuid.uuid4().hex))
+                    os.makedirs(upload_dir)
+                    upload_dirs.append(upload_dir)
+                    size = os.path.getsize(local_path)
+                    starts = list(range(0, size, self.part_size)) or [0]
+                    uploads.append((name, upload_dir, size, [executor.submit(
+                        upload_part, local_path, start, self.part_size,
+                        os.path.join(upload_dir, part_name(i)))
+                        for i, start in enumerate(starts)]))
+                parts = [[fut.result() for fut in futures]
+                         for _, _, _, futures in uploads]
+                # Complete the uploads once all their parts have succeeded
+                for (name, upload_dir, size, _), name_parts in zip(
+                        uploads, parts):
+                    with open(os.path.join(upload_dir, 'manifest.json'),
+                              'w') as mfile:
+                        json.dump({'size': size, 'parts': name_parts}, mfile)
+                    object_dir = os.path.join(self.root, name)
+                    if os.path.isdir(object_dir):
+                        shutil.rmtree(object_dir)
+                    os.rename(upload_dir, object_dir)
+            except:
+                # Wait for any part uploads still running, then remove all
+                # the uploads which have not been completed
+                concurrent.futures.wait(
+                    [fut for _, _, _, futures in uploads for fut in futures])
+                for upload_dir in upload_dirs:
+                    shutil.rmtree(upload_dir, ignore_errors=True)
+                raise
+
+    def get(self, name, local_path):
+        """Download an object, transferring its parts in parallel."""
+        manifest = self.manifest(name)
+        with open(local_path + '.part', 'wb') as outfile:
+            outfile.truncate(manifest['size'])
+        starts = [0]
+        for part in manifest['parts'][:-1]:
+            starts.append(starts[-1] + part['size'])
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(self.nthread, 1)) as executor:
+            futures = [executor.submit(
+                download_part, os.path.join(self.root, name, part_name(i)),
+                part, local_path + '.part', start)
+                       for i, (part, start) in enumerate(
+                           zip(manifest['parts'], starts))]
+            try:
+                for fut in futures:
+                    fut.result()
+            except:
+                os.remove(local_path + '.part')
+                raise
+        os.rename(local_path + '.part', local_path)
+
+    def read(self, name):
+        """Get an object's contents, checking each part."""
+        data = []
+        for i, part in enumerate(self.manifest(name)['parts']):
+            with open(os.path.join(self.root, name, part_name(i)),
+                      'rb') as infile:
+                data.append(check_part(infile.read(), part))
+        return b''.join(data)
+
+    def manifest(self, name):
+        """Load an object's manifest.
+
+        Parameters
+        ----------
+        name: str
+
+        Returns
+        -------
+        dict
+        """
+        with open(os.path.join(self.root, name, 'manifest.json'),
+                  'r') as mfile:
+            return json.load(mfile)
+
+    def exists(self, name):
+        """Check if an object has been completely uploaded."""
+        return os.path.isfile(os.path.join(self.root, name, 'manifest.json'))
+
+    def remove(self, name):
+        """Remove an object."""
+        shutil.rmtree(os.path.join(self.root, name))
+
+    def names(self):
+        """Get the names of the completely uploaded objects."""
+        return sorted(name for name in os.listdir(self.root)
+                      if self.exists(name))
+
+
+def store_output_files(work_dir, file_root, storage, final_only=True,
+                       wait_for=None):
+    """Put output files in a storage backend. The files in work_dir are not
+    removed.
+
+    Parameters
+    ----------
+    work_dir: str
+        Directory containing the output files.
+    file_root: str
+    storage: storage.Storage
+    final_only: bool, optional
+        Only store the final output files in PolyChord format. If False, all
+        files in work_dir are stored.
+    wait_for: concurrent.futures.Future or None, optional
+        If not None, wait for this future's result before storing the files.
+    """
+    if wait_for is not None:
+        wait_for.result()
+    if final_only:
+        names = [file_root + ext for ext in
+                 ['.stats', '.txt', '_equal_weights.txt', '_dead.txt',
+                  '_dead-birth.txt']]
+        names = [name for name in names if
+                 os.path.isfile(os.path.join(work_dir, name))]
+    else:
+        names = [name for name in os.listdir(work_dir) if
+                 os.path.isfile(os.path.join(work_dir, name))]
+    storage.put_many([(os.path.join(work_dir, name), name)
+                      for name in names])
+
+
+def copy_output_files(work_dir, base_dir, file_root, **kwargs):
+    """Copy output files from a temporary directory to base_dir (or put them
+    in a storage backend), check the copies and remove the temporary
+    directory (including on failure).
+
+    Parameters
+    ----------
+    work_dir: str
+        Temporary directory.
+    base_dir: str
+        Directory to copy output to. Ignored if storage is not None.
+    file_root: str
+    final_only: bool, optional
+        Only copy the final output files in PolyChord format. If False, all
+        files in work_dir are copied.
+    wait_for: concurrent.futures.Future or None, optional
+        If not None, wait for this future's result before copying.
+    nthread: int, optional
+        Number of files to copy at once.
+    storage: storage.Storage or None, optional
+        Storage backend to put the files in. If None, a
+        storage.LocalStorage for base_dir is used, which checks each copy
+        against the original using its size and SHA-256 hash before it is
+        renamed into place.
+    """
+    final_only = kwargs.pop('final_only', True)
+    wait_for = kwargs.pop('wait_for', None)
+    nthread = kwargs.pop('nthread', 4)
+    storage = kwargs.pop('storage', None)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    try:
+        if storage is None:
+            storage = LocalStorage(base_dir, nthread=nthread)
+        store_output_files(work_dir, file_root, storage,
+                           final_only=final_only, wait_for=wait_for)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def part_name(index):
+    """Get the file name of a part of an object in a DirectoryObjectStore."""
+    return 'part-{0:05d}'.format(index)
+
+
+def upload_part(local_path, start, part_size, part_path):
+    """Copy part of a file to a part file.
+
+    Parameters
+    ----------
+    local_path: str
+    start: int
+        Byte offset of the part.
+    part_size: int
+    part_path: str
+
+    Returns
+    -------
+    part: dict
+        The size and SHA-256 hash of the part.
+    """
+    with open(local_path, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(part_size)
+    with open(part_path, 'wb') as outfile:
+        outfile.write(data)
+    return {'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()}
+
+
+def download_part(part_path, part, local_path, start):
+    """Check a part file and copy it into part of a local file.
+
+    Parameters
+    ----------
+    part_path: str
+    part: dict
+        The size and SHA-256 hash of the part (from the object's manifest).
+    local_path: str
+    start: int
+        Byte offset of the part in the local file.
+    """
+    with open(part_path, 'rb') as infile:
+        data = check_part(infile.read(), part)
+    with open(local_path, 'r+b') as outfile:
+        outfile.seek(start)
+        outfile.write(data)
+
+
+def check_part(data, part):
+    """Check a part's contents match its size and hash in the manifest.
+
+    Parameters
+    ----------
+    data: bytes
+    part: dict
+
+    Returns
+    -------
+    data: bytes
+    """
+    if (len(data) != part['size'] or
+            hashlib.sha256(data).hexdigest() != part['sha256']):
+        raise IOError('Part of object is corrupted: expected {}'.format(part))
+    return data
+
+
+def checked_copy(src, dst):
+    """Copy src to a temporary file next to dst, check the copy has the same
+    size and SHA-256 hash as src and then rename it to dst.
+
+    Parameters
+    ----------
+    src: str
+    dst: str
+    """
+    shutil.copyfile(src, dst + '.part')
+    if (os.path.getsize(src) != os.path.getsize(dst + '.part') or
+            file_hash(src) != file_hash(dst + '.part')):
+        os.remove(dst + '.part')
+        raise IOError('Copy of {} to {} is corrupted.'.format(src, dst))
+    os.rename(dst + '.part', dst)
+
+
+def file_hash(path, block_size=2 ** 20):
+    """Get the SHA-256 hash of a file's contents.
+
+    Parameters
+    ----------
+    path: str
+    block_size: int, optional
+        Number of bytes to read at a time.
+
+    Returns
+    -------
+    str
+        Hex digest.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        block = infile.read(block_size)
+        while block:
+            sha.update(block)
+            block = infile.read(block_size)
+    return sha.hexdigest()
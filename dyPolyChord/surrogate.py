@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+"""
+Surrogate models of the loglikelihood, trained on the initial exploratory
+run's samples, which allow expensive python likelihoods to skip evaluations
+in the dynamic run (Step 3 of run_dypolychord).
+
+PolyChord's slice sampling only needs to know whether each proposed point
+lies inside the current likelihood contour. Without clustering, the contour is
+always at least as high as the loglikelihood of the most recent dead point,
+which is read from the run's dead-birth file as it is written. If a surrogate
+model places a point below this bound by more than its error margin, the point
+must be outside the contour, and the surrogate's (low) prediction can be
+returned instead of evaluating the full likelihood.
+
+With clustering, PolyChord keeps a separate contour for each cluster, and dead
+points in a high likelihood cluster can be above the contour of another
+cluster. The bound is then not valid, so the surrogate is only used in runs
+with PolyChord's do_clustering setting set to False.
+
+A fraction of the points which would be skipped are evaluated anyway to check
+the surrogate. If one of these points turns out to be above the bound, the
+margin is doubled, and if this happens too often the surrogate is switched
+off for the rest of the run.
+
+To use a surrogate, wrap the likelihood with SurrogateLikelihood and pass it
+to pypolychord_utils.RunPyPolyChord as usual. It can be combined with
+python_likelihoods.CachedLikelihood by wrapping the cached likelihood (i.e.
+SurrogateLikelihood(CachedLikelihood(likelihood))), so the surrogate's
+predictions are never cached.
+"""
+import os
+import warnings
+import numpy as np
+import dyPolyChord.progress_monitor
+
+
+class RBFSurrogate(object):
+
+    """Radial basis function regression model of the loglikelihood.
+
+    Uses a cubic radial basis function with a linear polynomial term, fitted
+    to standardised parameter values. The error margin is set from the
+    residuals on a validation set of samples which are not used to fit the
+    model.
+    """
+
+    def __init__(self, **kwargs):
+        """Set up the model.
+
+        Parameters
+        ----------
+        max_train: int, optional
+            Maximum number of samples used to fit the model (a random subset is
+            used if there are more). The cost of each prediction is
+            proportional to this.
+        validation_frac: float, optional
+            Fraction of the samples used to estimate the error margin.
+        margin_quantile: float, optional
+            Quantile of the absolute validation residuals used for the margin.
+        margin_factor: float, optional
+            The margin is this factor times the quantile of the residuals.
+        smoothing: float, optional
+            Regularisation added to the diagonal of the interpolation matrix.
+        seed: int or None, optional
+            Seed for selecting the training and validation samples.
+        """
+        self.max_train = kwargs.pop('max_train', 2000)
+        self.validation_frac = kwargs.pop('validation_frac', 0.2)
+        self.margin_quantile = kwargs.pop('margin_quantile', 0.99)
+        self.margin_factor = kwargs.pop('margin_factor', 2.0)
+        self.smoothing = kwargs.pop('smoothing', 1e-8)
+        seed = kwargs.pop('seed', None)
+        if kwargs:
+            raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+        self.random_state = np.random.RandomState(seed)
+        self.margin = None
+        self.centers = None
+        self.weights = None
+        self.coefs = None
+        self.mean = None
+        self.std = None
+
+    @property
+    def fitted(self):
+        """Whether the model has been fitted."""
+        return self.centers is not None
+
+    def fit(self, theta, logl):
+        """Fit the model and set its margin.
+
+        Parameters
+        ----------
+        theta: 2d numpy array
+            Parameter values of samples (one row per sample).
+        logl: 1d numpy array
+            Loglikelihoods of the samples.
+        """
+        finite = np.isfinite(logl)
+        theta = theta[finite]
+        logl = logl[finite]
+        inds = self.random_state.permutation(logl.shape[0])
+        nval = int(self.validation_frac * inds.shape[0])
+        assert nval > 0 and inds.shape[0] - nval > theta.shape[1] + 1, (
+            'too few samples ({}) to fit surrogate'.format(logl.shape[0]))
+        train = inds[nval:nval + self.max_train]
+        val = inds[:nval]
+        self.mean = theta.mean(axis=0)
+        self.std = theta.std(axis=0)
+        self.std[self.std == 0] = 1
+        self.fit_inds(theta[train], logl[train])
+        residuals = np.abs(self.predict(theta[val]) - logl[val])
+        self.margin = self.margin_factor * np.percentile(
+            residuals, 100 * self.margin_quantile)
+        # Refit using all the samples (up to max_train)
+        self.fit_inds(theta[inds[:self.max_train]],
+                      logl[inds[:self.max_train]])
+
+    def fit_inds(self, theta, logl):
+        """Solve for the RBF weights and polynomial coefficients.
+
+        Parameters
+        ----------
+        theta: 2d numpy array
+        logl: 1d numpy array
+        """
+        x = (theta - self.mean) / self.std
+        npoint, ndim = x.shape
+        poly = np.hstack([np.ones((npoint, 1)), x])
+        mat = np.zeros((npoint + ndim + 1, npoint + ndim + 1))
+        mat[:npoint, :npoint] = self.kernel(x, x)
+        mat[:npoint, :npoint] += self.smoothing * np.eye(npoint)
+        mat[:npoint, npoint:] = poly
+        mat[npoint:, :npoint] = poly.T
+        rhs = np.concatenate([logl, np.zeros(ndim + 1)])
+        try:
+            sol = np.linalg.solve(mat, rhs)
+        except np.linalg.LinAlgError:
+            sol = np.linalg.lstsq(mat, rhs, rcond=None)[0]
+        self.centers = x
+        self.weights = sol[:npoint]
+        self.coefs = sol[npoint:]
+
+    @staticmethod
+    def kernel(x1, x2):
+        """Cubic radial basis function of the distances between each row of x1
+        and each row of x2."""
+        sq_dist = ((x1 ** 2).sum(axis=1)[:, None] + (x2 ** 2).sum(axis=1)
+                   - 2 * np.dot(x1, x2.T))
+        return np.sqrt(np.maximum(sq_dist, 0)) ** 3
+
+    def predict(self, theta):
+        """Predict loglikelihoods.
+
+        Parameters
+        ----------
+        theta: 1d or 2d numpy array
+            Parameter values of one point, or one row per point.
+
+        Returns
+        -------
+        logl: float or 1d numpy array
+        """
+        x = (np.atleast_2d(theta) - self.mean) / self.std
+        logl = (np.dot(self.kernel(x, self.centers), self.weights)
+                + self.coefs[0] + np.dot(x, self.coefs[1:]))
+        return logl[0] if np.ndim(theta) == 1 else logl
+
+
+class SurrogateLikelihood(object):
+
+    """Wrapper which skips evaluating a loglikelihood for proposed points
+    which a surrogate model places confidently below the current likelihood
+    contour (see the module docstring for details).
+
+    The surrogate is trained on the initial run's samples when
+    pypolychord_utils.RunPyPolyChord starts the dynamic run (the run whose
+    file_root ends with '_dyn'); before this every point is evaluated. It is
+    only used if the run's do_clustering setting is False. The
+    numbers of calls, skipped evaluations and accuracy checks are stored in
+    the ncall, nskip, ncheck and nmiss attributes (see also skip_frac).
+    Note that skipped points are still counted as likelihood calls by
+    PolyChord in the nlike output.
+    """
+
+    def __init__(self, likelihood, surrogate=None, **kwargs):
+        """
+        Set up the wrapper.
+
+        Parameters
+        ----------
+        likelihood: func
+            Loglikelihood of the type defined in python_likelihoods.
+        surrogate: object or None, optional
+            Model with fit(theta, logl) and predict(theta) methods, a fitted
+            attribute and a margin attribute (set by fit). Defaults to
+            RBFSurrogate().
+        check_every: int, optional
+            One in every check_every points which would be skipped is
+            evaluated to check the surrogate.
+        update_every: int, optional
+            Number of calls between reading new dead points.
+        max_miss_frac: float, optional
+            The surrogate is switched off if more than this fraction of its
+            checks (after at least min_checks) find points which should not
+            have been skipped.
+        min_checks: int, optional
+        """
+        self.check_every = kwargs.pop('check_every', 20)
+        self.update_every = kwargs.pop('update_every', 100)
+        self.max_miss_frac = kwargs.pop('max_miss_frac', 0.05)
+        self.min_checks = kwargs.pop('min_checks', 10)
+        if kwargs:
+            raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+        self.likelihood = likelihood
+        self.surrogate = RBFSurrogate() if surrogate is None else surrogate
+        self.active = False
+        self.reader = None
+        self.contour = -np.inf  # highest dead point loglikelihood read
+        self.nderived = None
+        self.ncall = 0
+        self.nskip = 0
+        self.ncandidate = 0
+        self.ncheck = 0
+        self.nmiss = 0
+
+    @property
+    def skip_frac(self):
+        """Fraction of calls for which the full likelihood was not
+        evaluated."""
+        return self.nskip / float(max(self.ncall, 1))
+
+    def start_run(self, root, ndim, do_clustering=True):
+        """Prepare for a PolyChord run, training the surrogate on the initial
+        run's samples at the start of the dynamic run.
+
+        Parameters
+        ----------
+        root: str
+            Path of the run's output files (base_dir and file_root).
+        ndim: int
+            Number of parameters.
+        do_clustering: bool, optional
+            PolyChord's do_clustering setting for the run. The surrogate is
+            not used with clustering (see the module docstring).
+        """
+        if root.endswith('_dyn') and not self.surrogate.fitted:
+            init_path = root[:-len('_dyn')] + '_init_dead-birth.txt'
+            if os.path.isfile(init_path):
+                samples = np.loadtxt(init_path, ndmin=2)
+                self.surrogate.fit(samples[:, :ndim], samples[:, -2])
+        self.active = self.surrogate.fitted and not do_clustering
+        if self.surrogate.fitted and do_clustering and root.endswith('_dyn'):
+            warnings.warn((
+                'Surrogate likelihood not used for {0} as its likelihood '
+                'bound is not valid with clustering: set do_clustering=False '
+                'to use it.').format(root), UserWarning)
+        self.reader = dyPolyChord.progress_monitor.DeadBirthReader(
+            root + '_dead-birth.txt')
+        self.contour = -np.inf
+
+    def __call__(self, theta):
+        """
+        Calculate loglikelihood(theta), as well as any derived parameters,
+        or return the surrogate's prediction if it is confidently below the
+        current contour.
+
+        Parameters
+        ----------
+        theta: float or 1d numpy array
+
+        Returns
+        -------
+        logl: float
+            Loglikelihood
+        phi: list of length nderived
+            Any derived parameters.
+        """
+        self.ncall += 1
+        if (self.reader is not None and
+                (self.ncall - 1) % self.update_every == 0):
+            self.update_contour()
+        if (self.active and self.nderived is not None and
+                self.contour > -np.inf):
+            pred = self.surrogate.predict(np.asarray(theta, dtype=float))
+            if pred + self.surrogate.margin < self.contour:
+                self.ncandidate += 1
+                if self.ncandidate % self.check_every != 0:
+                    self.nskip += 1
+                    return float(pred), [0.0] * self.nderived
+                return self.check(theta)
+        logl, phi = self.likelihood(theta)
+        self.nderived = len(phi)
+        return logl, phi
+
+    def update_contour(self):
+        """Update the bound on the likelihood contour from any new points in
+        the run's dead-birth file."""
+        logl, replaced = self.reader.read()
+        if replaced:
+            self.contour = -np.inf
+        if logl.shape[0] > 0:
+            self.contour = max(self.contour, logl.max())
+
+    def check(self, theta):
+        """Evaluate the likelihood at a point the surrogate would have skipped,
+        increasing the margin if the point is above the contour bound and
+        switching the surrogate off if this happens too often.
+
+        Parameters
+        ----------
+        theta: float or 1d numpy array
+
+        Returns
+        -------
+        logl: float
+        phi: list
+        """
+        logl, phi = self.likelihood(theta)
+        self.ncheck += 1
+        if logl >= self.contour:
+            self.nmiss += 1
+            self.surrogate.margin *= 2
+            if (self.ncheck >= self.min_checks and
+                    self.nmiss > self.max_miss_frac * self.ncheck):
+                self.active = False
+                warnings.warn((
+                    'Surrogate likelihood switched off as {0} of {1} checks '
+                    'found points above the contour which would have been '
+                    'skipped.').format(self.nmiss, self.ncheck), UserWarning)
+        return logl, phi
@@ -0,0 +1,493 @@
+#!/usr/bin/env python
+"""
+Functions for writing PolyChord-format output files for a combined
+dyPolyChord run.
+
+These produce the same files as
+nestcheck.write_polychord_output.write_run_output, but write rows in
+fixed-size chunks rather than first building arrays containing the whole
+output in memory. This keeps peak memory use low for runs with many samples
+and parameters. Files can optionally be compressed with gzip, or with zstd if
+the zstandard package is installed.
+
+Each file is written to a temporary '.part' file which is renamed into place
+once it is complete, so an interrupted run never leaves partly written
+output files. Writing (and compressing) the files can be done concurrently
+on a thread pool while the next rows are formatted.
+"""
+import concurrent.futures
+import functools
+import gzip
+import os
+import numpy as np
+import nestcheck.error_analysis
+import nestcheck.estimators
+import nestcheck.ns_run_utils
+import nestcheck.write_polychord_output
+import dyPolyChord.output_processing
+# Exception handling as zstandard is only needed for zstd compression
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def write_run_output(run, **kwargs):
+    """Writes PolyChord output files corresponding to the input nested
+    sampling run. The file root is
+
+    .. code-block:: python
+
+        root = os.path.join(run['output']['base_dir'],
+                            run['output']['file_root'])
+
+    See nestcheck.write_polychord_output.write_run_output for a list of the
+    files produced.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run in nestcheck format (see
+        http://nestcheck.readthedocs.io/en/latest/api.html for more
+        information).
+    write_dead: bool, optional
+        Whether or not to write [root]_dead.txt and [root]_dead-birth.txt.
+    write_stats: bool, optional
+        Whether or not to write [root].stats.
+    posteriors: bool, optional
+        Whether or not to write [root].txt.
+    equals: bool, optional
+        Whether or not to write [root]_equal_weights.txt.
+    equals_method: None, 'systematic' or 'residual', optional
+        How to select the equally weighted posterior samples. If None, each
+        sample is included with probability equal to its weight divided by the
+        maximum weight using numpy's global random state (as in nestcheck).
+        Otherwise a fixed number of samples is drawn using
+        output_processing.resample_counts.
+    equals_seed: int or None, optional
+        Seed for output_processing.resample_counts.
+    nequals: int or None, optional
+        Number of equally weighted samples for
+        output_processing.resample_counts (None uses its default).
+    stats_means_errs: bool, optional
+        Whether or not to calculate mean values of logZ and each parameter,
+        and their uncertainties.
+    fmt: str, optional
+        Formatting for numbers. Default value is set to make output files
+        look like the ones produced by PolyChord.
+    n_simulate: int, optional
+        Number of bootstrap replications to use when estimating uncertainty on
+        evidence and parameter means.
+    chunk_size: int, optional
+        Number of samples to format and write at a time.
+    compression: None, 'gzip' or 'zstd', optional
+        Compression for the .txt output files (the .stats file is not
+        compressed). The file extension '.gz' or '.zst' is added to their
+        names.
+    logw: 1d numpy array or None, optional
+        Log posterior weights to use for the posterior and equally weighted
+        samples. If None they are calculated from the run's nlive_array (for
+        example this can be set to weights from
+        output_processing.reweight_run).
+    executor: concurrent.futures.Executor or None, optional
+        If not None, each chunk of rows is written to the files by submitting
+        tasks to the executor (normally a ThreadPoolExecutor) while the next
+        chunk is formatted. Writes to each file stay in order, with at most
+        one chunk per file waiting to be written. Completed files are also
+        synced and renamed on the executor.
+    atomic: bool, optional
+        Whether to write each file to a temporary path ending in '.part' and
+        rename it to its final path once it is complete.
+    fsync: bool, optional
+        Whether to call fsync on each file once it is complete (and on the
+        output directory after renaming files), so the output is on disk
+        when the function returns.
+    """
+    write_dead = kwargs.pop('write_dead', True)
+    write_stats = kwargs.pop('write_stats', True)
+    posteriors = kwargs.pop('posteriors', False)
+    equals = kwargs.pop('equals', False)
+    equals_method = kwargs.pop('equals_method', None)
+    equals_seed = kwargs.pop('equals_seed', None)
+    nequals = kwargs.pop('nequals', None)
+    stats_means_errs = kwargs.pop('stats_means_errs', True)
+    fmt = kwargs.pop('fmt', '% .14E')
+    n_simulate = kwargs.pop('n_simulate', 100)
+    chunk_size = kwargs.pop('chunk_size', 10000)
+    compression = kwargs.pop('compression', None)
+    logw = kwargs.pop('logw', None)
+    executor = kwargs.pop('executor', None)
+    atomic = kwargs.pop('atomic', True)
+    fsync = kwargs.pop('fsync', False)
+    if kwargs:
+        raise TypeError('Unexpected **kwargs: {0}'.format(kwargs))
+    for key in ['file_root', 'base_dir']:
+        assert key in run['output'], key + ' not in run["output"]'
+    root = os.path.join(run['output']['base_dir'], run['output']['file_root'])
+    compressed_path(root, compression)  # check compression is available
+    paths = []
+    if write_dead:
+        paths += [root + '_dead-birth.txt', root + '_dead.txt']
+        birth_logl = get_birth_logl(run)
+    if posteriors:
+        paths.append(root + '.txt')
+    if equals or posteriors:
+        if logw is None:
+            logw = nestcheck.ns_run_utils.get_logw(run)
+        w_rel = np.exp(logw - logw.max())
+    if equals:
+        paths.append(root + '_equal_weights.txt')
+        if equals_method is not None:
+            equals_inds = dyPolyChord.output_processing.resample_inds_chunks(
+                dyPolyChord.output_processing.resample_counts(
+                    logw, nsample=nequals, method=equals_method,
+                    seed=equals_seed),
+                chunk_size)
+    run['output']['nposterior'] = run['logl'].shape[0] if posteriors else 0
+    run['output']['nequals'] = 0
+    suffix = '.part' if atomic else ''
+    files = [open_output_file(path, compression=compression, suffix=suffix)
+             for path in paths]
+    pending = [None] * len(files)  # each file's write in progress
+    try:
+        # Write all the files in a single pass through the samples so each
+        # number is only formatted once, even if it appears in several files.
+        for start in range(0, run['logl'].shape[0], chunk_size):
+            chunk = slice(start, start + chunk_size)
+            theta_str = format_rows(run['theta'][chunk], fmt)
+            out_rows = []
+            if write_dead:
+                dead_rows = join_rows(
+                    theta_str, format_rows(run['logl'][chunk], fmt))
+                out_rows += [join_rows(
+                    dead_rows, format_rows(birth_logl[chunk], fmt)),
+                             dead_rows]
+            if equals or posteriors:
+                post_rows = join_rows(
+                    format_rows(-2 * run['logl'][chunk], fmt), theta_str)
+            if posteriors:
+                out_rows.append(join_rows(
+                    format_rows(w_rel[chunk], fmt), post_rows))
+            if equals:
+                if equals_method is None:
+                    # Same use of the numpy random state as nestcheck
+                    w_chunk = w_rel[chunk]
+                    inds = np.where(
+                        w_chunk > np.random.random(w_chunk.shape[0]))[0]
+                else:
+                    inds = next(equals_inds) - start
+                out_rows.append([post_rows[i] for i in inds])
+                run['output']['nequals'] += inds.shape[0]
+            write_rows(files, out_rows, pending, executor)
+        for fut in pending:
+            if fut is not None:
+                fut.result()
+    except:
+        remove_output(files, pending, [compressed_path(path, compression) +
+                                       suffix for path in paths])
+        raise
+    for outfile in files:
+        outfile.close()
+    final_paths = [compressed_path(path, compression) for path in paths]
+    mapper = map if executor is None else executor.map
+    list(mapper(functools.partial(finish_file, suffix=suffix, fsync=fsync),
+                final_paths))
+    if write_stats:
+        run['output']['ndead'] = run['logl'].shape[0]
+        if stats_means_errs:
+            add_means_errs(run, n_simulate)
+        write_stats_file(run['output'], suffix=suffix, fsync=fsync)
+    if fsync:
+        fsync_dir(os.path.dirname(root))
+
+
+def add_means_errs(run, n_simulate):
+    """Adds estimates of logZ and the mean of each parameter, and their
+    bootstrap uncertainties, to run['output'] for the .stats file.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run in nestcheck format.
+    n_simulate: int
+        Number of bootstrap replications to use when estimating
+        uncertainties.
+    """
+    estimators = [nestcheck.estimators.logz]
+    for i in range(run['theta'].shape[1]):
+        estimators.append(functools.partial(
+            nestcheck.estimators.param_mean, param_ind=i))
+    values = nestcheck.ns_run_utils.run_estimators(run, estimators)
+    stds = nestcheck.error_analysis.run_std_bootstrap(
+        run, estimators, n_simulate=n_simulate)
+    run['output']['logZ'] = values[0]
+    run['output']['logZerr'] = stds[0]
+    run['output']['param_means'] = list(values[1:])
+    run['output']['param_mean_errs'] = list(stds[1:])
+
+
+def write_stats_file(output, suffix='', fsync=False):
+    """Writes the [root].stats file, first to a temporary path ending in
+    suffix and then renaming it into place.
+
+    Parameters
+    ----------
+    output: dict
+        Run output including file_root and base_dir (see
+        nestcheck.write_polychord_output.write_stats_file).
+    suffix: str, optional
+        Suffix for the temporary path (no rename if '').
+    fsync: bool, optional
+        Whether to fsync the completed file.
+    """
+    root = os.path.join(output['base_dir'], output['file_root'])
+    stats_output = dict(output)
+    stats_output['file_root'] += suffix
+    nestcheck.write_polychord_output.write_stats_file(stats_output)
+    if suffix:
+        os.rename(root + suffix + '.stats', root + '.stats')
+    if fsync:
+        fsync_path(root + '.stats')
+
+
+def write_rows(files, out_rows, pending, executor):
+    """Writes a chunk of rows to each output file, submitting the writes to
+    the executor if there is one (waiting for the file's previous write to
+    finish first).
+
+    Parameters
+    ----------
+    files: list of file objects
+    out_rows: list of lists of strs
+        Rows for each file.
+    pending: list
+        Each file's write in progress (a future or None). Updated in place.
+    executor: concurrent.futures.Executor or None
+    """
+    for i, rows in enumerate(out_rows):
+        if not rows:
+            continue
+        data = ('\n'.join(rows) + '\n').encode('latin1')
+        if executor is None:
+            files[i].write(data)
+        else:
+            if pending[i] is not None:
+                pending[i].result()
+            pending[i] = executor.submit(files[i].write, data)
+
+
+def remove_output(files, pending, part_paths):
+    """Closes and removes incomplete output files after an error.
+
+    Parameters
+    ----------
+    files: list of file objects
+    pending: list
+        Each file's write in progress (a future or None).
+    part_paths: list of strs
+        Paths the files are being written to.
+    """
+    concurrent.futures.wait([fut for fut in pending if fut is not None])
+    for outfile in files:
+        outfile.close()
+    for path in part_paths:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def write_reweighted_output(run, reweighted, **kwargs):
+    """Write posterior and equally weighted posterior files for a run
+    reweighted with output_processing.reweight_run.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run in nestcheck format, containing run['output'] with
+        'file_root' and 'base_dir'.
+    reweighted: dict
+        Output of output_processing.reweight_run.
+    file_root: str, optional
+        File root for the reweighted output. Defaults to the run's file root
+        followed by '_reweighted'.
+    kwargs: dict, optional
+        Other keyword arguments are passed to write_run_output (for example
+        equals, equals_method and compression).
+    """
+    file_root = kwargs.pop(
+        'file_root', run['output']['file_root'] + '_reweighted')
+    kwargs['posteriors'] = kwargs.get('posteriors', True)
+    kwargs['equals'] = kwargs.get('equals', True)
+    new_run = {'logl': reweighted['logl'], 'theta': run['theta'],
+               'output': {'file_root': file_root,
+                          'base_dir': run['output']['base_dir']}}
+    write_run_output(new_run, logw=reweighted['logw'], write_dead=False,
+                     write_stats=False, **kwargs)
+
+
+def format_rows(array, fmt):
+    """Format each row of an array as a string of numbers separated by spaces,
+    as in text files written with np.savetxt(path, array, fmt=fmt).
+
+    Formatting all the rows with a single string formatting operation is much
+    faster than formatting each row separately (as np.savetxt does).
+
+    Parameters
+    ----------
+    array: 1d or 2d numpy array
+        1d arrays are treated as a single column.
+    fmt: str
+        Format for each number.
+
+    Returns
+    -------
+    rows: list of strs
+    """
+    array = array.reshape((array.shape[0], -1))
+    row_fmt = ' '.join([fmt] * array.shape[1])
+    return (('\n'.join([row_fmt] * array.shape[0]))
+            % tuple(array.ravel())).split('\n')
+
+
+def join_rows(*args):
+    """Join lists of formatted rows side by side.
+
+    Parameters
+    ----------
+    args: lists of strs
+        Each list has the same length.
+
+    Returns
+    -------
+    rows: list of strs
+    """
+    return [' '.join(parts) for parts in zip(*args)]
+
+
+def get_birth_logl(run):
+    """Get the loglikelihood of the contour within which each point was
+    sampled, which is the final column of PolyChord's dead-birth files.
+    Points sampled from the whole prior have birth logl -1e30.
+
+    Equivalent to
+    nestcheck.write_polychord_output.run_dead_birth_array(run)[:, -1]
+    without making the array of all the run's samples.
+
+    Parameters
+    ----------
+    run: dict
+        Nested sampling run in nestcheck format.
+
+    Returns
+    -------
+    birth_logl: 1d numpy array
+    """
+    # Sorting by thread with a stable sort keeps each thread's points in
+    # order of increasing logl
+    order = np.argsort(run['thread_labels'], kind='mergesort')
+    labels = run['thread_labels'][order]
+    thread_start = np.ones(order.shape[0], dtype=bool)
+    thread_start[1:] = labels[1:] != labels[:-1]
+    birth_logl = np.empty(order.shape[0])
+    birth_logl[order[1:]] = run['logl'][order[:-1]]
+    start_logl = run['thread_min_max'][labels[thread_start], 0]
+    start_logl[start_logl == -np.inf] = -1e30
+    birth_logl[order[thread_start]] = start_logl
+    return birth_logl
+
+
+def open_output_file(path, compression=None, suffix=''):
+    """Open a file for writing bytes, with optional compression.
+
+    Parameters
+    ----------
+    path: str
+        File path (excluding any compression extension).
+    compression: None, 'gzip' or 'zstd', optional
+    suffix: str, optional
+        Added to the path after any compression extension (for example
+        '.part' for temporary files).
+
+    Returns
+    -------
+    File object.
+    """
+    file_path = compressed_path(path, compression) + suffix
+    if compression is None:
+        return open(file_path, 'wb')
+    elif compression == 'gzip':
+        return gzip.open(file_path, 'wb')
+    else:
+        return zstandard.ZstdCompressor().stream_writer(
+            open(file_path, 'wb'))
+
+
+def compressed_path(path, compression):
+    """Add the file extension for the compression (if any) to a path.
+
+    Parameters
+    ----------
+    path: str
+    compression: None, 'gzip' or 'zstd'
+
+    Returns
+    -------
+    str
+    """
+    extensions = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+    if compression not in extensions:
+        raise ValueError(
+            'compression={} not in [None, "gzip", "zstd"]'.format(
+                compression))
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError(
+            'compression="zstd" requires the zstandard package, which could '
+            'not be imported.')
+    return path + extensions[compression]
+
+
+def finish_file(path, suffix='', fsync=False):
+    """Rename a completed temporary file to its final path, optionally
+    calling fsync first.
+
+    Parameters
+    ----------
+    path: str
+        Final path.
+    suffix: str, optional
+        The temporary file's path is path + suffix. If this is empty the file
+        is not renamed.
+    fsync: bool, optional
+    """
+    if fsync:
+        fsync_path(path + suffix)
+    if suffix:
+        # Atomic on POSIX systems
+        os.rename(path + suffix, path)
+
+
+def fsync_path(path):
+    """Flush a file's contents to disk.
+
+    Parameters
+    ----------
+    path: str
+    """
+    fdesc = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fdesc)
+    finally:
+        os.close(fdesc)
+
+
+def fsync_dir(path):
+    """Flush a directory's entries (for example renamed files) to disk. Not
+    possible on all systems (e.g. Windows), in which case nothing is done.
+
+    Parameters
+    ----------
+    path: str
+    """
+    try:
+        fsync_path(path or '.')
+    except OSError:
+        pass
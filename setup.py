@@ -67,6 +67,7 @@ setuptools.setup(name='dyPolyChord',
                                           'sphinx-rtd-theme',
                                           'nbsphinx>=0.3.3'],
                                  'MPI': ['mpi4py'],
+                                 'zstd': ['zstandard'],
                                  ':python_version == "2.7"': ['futures',
                                                               'pytz',
                                                               'python-dateutil']},
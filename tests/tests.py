@@ -10,9 +10,12 @@ Note that pypolychord was called PyPolyChord before PolyChord v1.15;
 if pypolychord cannot be imported then we try importing PyPolyChord
 instead for backwards compatibility with the old module name.
 """
+import concurrent.futures
 import os
 import copy
+import gzip
 import shutil
+import sys
 import unittest
 import functools
 import warnings
@@ -23,11 +26,23 @@ import nestcheck.estimators as e
 import nestcheck.dummy_data
 import nestcheck.write_polychord_output
 import nestcheck.data_processing
+import nestcheck.io_utils
+try:
+    from urllib.request import urlopen
+except ImportError:  # Python 2
+    from urllib2 import urlopen
 import dyPolyChord.python_likelihoods as likelihoods
 import dyPolyChord.python_priors as priors
+import dyPolyChord.initial_run
+import dyPolyChord.multiple_runs
 import dyPolyChord.output_processing
 import dyPolyChord.polychord_utils
+import dyPolyChord.progress_monitor
+import dyPolyChord.read_polychord_output
 import dyPolyChord.run_dynamic_ns
+import dyPolyChord.storage
+import dyPolyChord.surrogate
+import dyPolyChord.write_polychord_output
 import dyPolyChord
 try:
     # pylint: disable=unused-import,ungrouped-imports
@@ -269,6 +284,352 @@ class TestRunDynamicNS(unittest.TestCase):
         p1_mean = (np.sum(posteriors[:, 2] * posteriors[:, 0])
                    / np.sum(posteriors[:, 0]))
         self.assertAlmostEqual(p1_mean, 0.614126384660822, places=12)
+        # Check compact runs give the same results (up to float32 precision),
+        # also writing the output on a thread pool
+        dyPolyChord.run_dypolychord(
+            self.run_func, dynamic_goal, self.settings,
+            init_step=self.ninit, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            compact='float32', parallel_load={'nproc': 1, 'chunk_size': 100},
+            write_threads=2, fsync=True)
+        posteriors = np.loadtxt(os.path.join(
+            self.settings['base_dir'], self.settings['file_root'] + '.txt'))
+        p1_mean = (np.sum(posteriors[:, 2] * posteriors[:, 0])
+                   / np.sum(posteriors[:, 0]))
+        self.assertAlmostEqual(p1_mean, 0.614126384660822, places=6)
+
+    def test_run_dypolychord_batch(self):
+        """Check performing several runs with the output processing done in
+        the background. This uses dummy PolyChord-format data."""
+        dynamic_goal = 1
+        settings_list = []
+        for file_root in ['test_run1', 'test_run2', 'test_run3']:
+            settings_list.append(copy.deepcopy(self.settings))
+            settings_list[-1]['file_root'] = file_root
+        self.assertRaises(
+            AssertionError, dyPolyChord.multiple_runs.run_dypolychord_batch,
+            self.run_func, dynamic_goal, [self.settings, self.settings])
+        dyPolyChord.multiple_runs.run_dypolychord_batch(
+            self.run_func, dynamic_goal, settings_list,
+            init_step=self.ninit, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False)
+        for settings in settings_list:
+            root = os.path.join(settings['base_dir'], settings['file_root'])
+            posteriors = np.loadtxt(root + '.txt')
+            p1_mean = (np.sum(posteriors[:, 2] * posteriors[:, 0])
+                       / np.sum(posteriors[:, 0]))
+            self.assertAlmostEqual(p1_mean, 0.614126384660822, places=12)
+            self.assertFalse(os.path.isfile(root + '_dyn_info.pkl'))
+
+    def test_progress(self):
+        """Check progress monitoring during Steps 1 and 3. This uses dummy
+        PolyChord-format data."""
+        metrics_list = []
+        metrics_file = os.path.join(TEST_CACHE_DIR, 'metrics.txt')
+        dyPolyChord.run_dypolychord(
+            self.run_func, 1, self.settings, init_step=self.ninit,
+            ninit=self.ninit, nlive_const=self.nlive_const,
+            stats_means_errs=False,
+            progress={'callback': metrics_list.append,
+                      'metrics_file': metrics_file, 'interval': 100})
+        # One final update each for Steps 1 and 3
+        self.assertEqual(len(metrics_list), 2)
+        self.assertEqual(metrics_list[0]['ndead'], 12)
+        self.assertIsNone(metrics_list[0]['schedule_frac'])
+        self.assertEqual(metrics_list[1]['schedule_frac'], 1)
+        self.assertTrue(os.path.isfile(metrics_file))
+
+    def test_run_dypolychord_goals(self):
+        """Check runs with different dynamic goals sharing an initial run.
+        This uses dummy PolyChord-format data."""
+        for executor in [None, concurrent.futures.ThreadPoolExecutor(2)]:
+            file_roots = dyPolyChord.multiple_runs.run_dypolychord_goals(
+                self.run_func, [0, 1], self.settings, init_step=self.ninit,
+                ninit=self.ninit, nlive_const=self.nlive_const,
+                stats_means_errs=False, executor=executor)
+            self.assertEqual(file_roots,
+                             {0: 'test_run_dg0', 1: 'test_run_dg1'})
+            self.assertEqual(sorted(os.listdir(TEST_CACHE_DIR)), sorted(
+                [root + ext for root in file_roots.values() for ext in
+                 ['.stats', '.txt', '_dead.txt', '_dead-birth.txt',
+                  '_equal_weights.txt']]))
+            posteriors = np.loadtxt(os.path.join(
+                TEST_CACHE_DIR, file_roots[1] + '.txt'))
+            p1_mean = (np.sum(posteriors[:, 2] * posteriors[:, 0])
+                       / np.sum(posteriors[:, 0]))
+            self.assertAlmostEqual(p1_mean, 0.614126384660822, places=12)
+        self.assertRaises(
+            AssertionError, dyPolyChord.multiple_runs.run_dypolychord_goals,
+            self.run_func, [1, 1], self.settings)
+        self.assertRaises(
+            TypeError, dyPolyChord.multiple_runs.run_dypolychord_goals,
+            self.run_func, [0, 1], self.settings, unexpected=1)
+
+    def test_run_dypolychord_goals_cache_hits(self):
+        """Check likelihood calls answered from a CachedLikelihood's cache
+        are not counted in each goal's nlike. This uses dummy PolyChord-format
+        data, with every run given 3 cache hits."""
+        run_func = self.run_func
+        calls = []
+
+        class HitRunner(object):
+
+            """Dummy runner using a CachedLikelihood."""
+
+            likelihood = likelihoods.CachedLikelihood(likelihoods.Gaussian())
+
+            def __call__(self, settings, comm=None):
+                calls.append(settings['file_root'])
+                self.likelihood.nhit += 3
+                run_func(settings, comm=comm)
+
+        kwargs = {'init_step': self.ninit, 'ninit': self.ninit,
+                  'nlive_const': self.nlive_const, 'stats_means_errs': False}
+        file_roots = dyPolyChord.multiple_runs.run_dypolychord_goals(
+            self.run_func, [0, 1], self.settings, **kwargs)
+        expected = {goal: dyPolyChord.read_polychord_output.read_stats_counts(
+            root, TEST_CACHE_DIR)[1] for goal, root in file_roots.items()}
+        for executor in [None, concurrent.futures.ThreadPoolExecutor(1)]:
+            del calls[:]
+            dyPolyChord.multiple_runs.run_dypolychord_goals(
+                HitRunner(), [0, 1], self.settings, executor=executor,
+                **kwargs)
+            ninit_calls = calls.count('test_run_init')
+            for goal, root in file_roots.items():
+                self.assertEqual(
+                    dyPolyChord.read_polychord_output.read_stats_counts(
+                        root, TEST_CACHE_DIR)[1],
+                    expected[goal] - 3 * (ninit_calls + 1))
+
+    def test_low_fidelity_init(self):
+        """Check using a separate runner and settings for the initial run,
+        which are not included in the final output. This uses dummy
+        PolyChord-format data."""
+        calls = []
+
+        def init_run_func(settings, comm=None):
+            """Record settings and run the dummy likelihood."""
+            calls.append(copy.deepcopy(settings))
+            self.run_func(settings, comm=comm)
+
+        def run_func(settings, comm=None):
+            """Record settings and run the dummy likelihood."""
+            calls.append(copy.deepcopy(settings))
+            self.run_func(settings, comm=comm)
+
+        dyPolyChord.run_dypolychord(
+            run_func, 1, self.settings, init_step=self.ninit,
+            ninit=self.ninit, nlive_const=self.nlive_const,
+            stats_means_errs=False, clean=False,
+            init_run_polychord=init_run_func,
+            init_settings={'num_repeats': 1})
+        # The initial run is done once without resume files, and the dynamic
+        # run samples the whole prior with ninit extra live points
+        self.assertEqual([call['file_root'] for call in calls],
+                         ['test_run_init', 'test_run_dyn'])
+        self.assertEqual(calls[0]['num_repeats'], 1)
+        self.assertEqual(calls[1]['num_repeats'], 20)
+        self.assertFalse(calls[1]['read_resume'])
+        self.assertEqual(min(calls[1]['nlives'].values()), self.ninit)
+        # The output only contains the dynamic run's samples
+        root = os.path.join(TEST_CACHE_DIR, 'test_run')
+        numpy.testing.assert_array_equal(
+            np.loadtxt(root + '_dead-birth.txt'),
+            np.loadtxt(root + '_dyn_dead-birth.txt'))
+        self.assertRaises(
+            AssertionError, dyPolyChord.run_dypolychord, run_func, 1,
+            self.settings, init_settings={'nlive': 10})
+
+    def test_scratch_dir(self):
+        """Check running in a scratch directory and copying only the final
+        output to base_dir. This uses dummy PolyChord-format data."""
+        dynamic_goal = 1
+        scratch_dir = os.path.join(TEST_CACHE_DIR, 'scratch')
+        os.makedirs(scratch_dir)
+        dyPolyChord.run_dypolychord(
+            self.run_func, dynamic_goal, self.settings,
+            init_step=self.ninit, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            scratch_dir=scratch_dir)
+        self.assertEqual(os.listdir(scratch_dir), [])
+        self.assertEqual(
+            sorted(os.listdir(self.settings['base_dir'])),
+            sorted(['scratch'] + [self.settings['file_root'] + ext for ext in
+                                  ['.stats', '.txt', '_equal_weights.txt',
+                                   '_dead.txt', '_dead-birth.txt']]))
+        # Check the scratch directory is removed after an error
+        self.assertRaises(
+            AssertionError, dyPolyChord.run_dypolychord,
+            self.run_func, dynamic_goal, self.settings,
+            init_step=self.ninit, ninit=self.ninit, nlive_const=self.ninit,
+            scratch_dir=scratch_dir)
+        self.assertEqual(os.listdir(scratch_dir), [])
+
+    def test_storage(self):
+        """Check putting the final output files in storage backends, with and
+        without a scratch directory. This uses dummy PolyChord-format
+        data."""
+        dynamic_goal = 1
+        scratch_dir = os.path.join(TEST_CACHE_DIR, 'scratch')
+        os.makedirs(scratch_dir)
+        names = [self.settings['file_root'] + ext for ext in
+                 ['.stats', '.txt', '_equal_weights.txt', '_dead.txt',
+                  '_dead-birth.txt']]
+        store = dyPolyChord.storage.DirectoryObjectStore(
+            os.path.join(TEST_CACHE_DIR, 'store'), part_size=1000, nthread=3)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            future = dyPolyChord.run_dypolychord(
+                self.run_func, dynamic_goal, self.settings,
+                init_step=self.ninit, ninit=self.ninit,
+                nlive_const=self.nlive_const, stats_means_errs=False,
+                scratch_dir=scratch_dir, storage=store, executor=pool)
+            future.result()
+        self.assertEqual(os.listdir(scratch_dir), [])
+        self.assertEqual(sorted(os.listdir(self.settings['base_dir'])),
+                         ['scratch', 'store'])
+        self.assertEqual(store.names(), sorted(names))
+        memory = dyPolyChord.storage.MemoryStorage()
+        dyPolyChord.run_dypolychord(
+            self.run_func, dynamic_goal, self.settings,
+            init_step=self.ninit, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            storage=memory)
+        self.assertEqual(memory.names(), sorted(names))
+        for name in names:
+            with open(os.path.join(self.settings['base_dir'], name),
+                      'rb') as infile:
+                data = infile.read()
+            self.assertEqual(memory.read(name), data)
+            self.assertEqual(store.read(name), data)
+
+    def test_resume(self):
+        """Check run_dypolychord skips the steps recorded as finished in the
+        checkpoint manifest when resume=True. This uses dummy PolyChord-format
+        data."""
+        dynamic_goal = 1
+        dyPolyChord.run_dypolychord(
+            self.run_func, dynamic_goal, self.settings,
+            init_step=self.ninit, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            clean=False, resume=True)
+        root = os.path.join(self.settings['base_dir'],
+                            self.settings['file_root'])
+        checkpoint = nestcheck.io_utils.pickle_load(root + '_checkpoint')
+        self.assertEqual(checkpoint['steps_done'], [1, 2, 3, 4])
+        self.assertTrue(checkpoint['dyn_settings']['write_resume'])
+        # Mimic the job being killed during Step 3
+        checkpoint['steps_done'] = [1, 2]
+        nestcheck.io_utils.pickle_save(checkpoint, root + '_checkpoint')
+        # Resuming with different settings should fail
+        self.assertRaises(
+            AssertionError, dyPolyChord.run_dypolychord,
+            self.run_func, dynamic_goal, self.settings,
+            init_step=self.ninit * 2, ninit=self.ninit,
+            nlive_const=self.nlive_const, resume=True)
+        file_roots = []
+
+        def run_func(settings, comm=None):
+            """Record which runs are performed."""
+            file_roots.append(settings['file_root'])
+            self.assertTrue(settings['read_resume'])
+            self.run_func(settings, comm=comm)
+
+        dyPolyChord.run_dypolychord(
+            run_func, dynamic_goal, self.settings,
+            init_step=self.ninit, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            resume=True)
+        self.assertEqual(file_roots, [self.settings['file_root'] + '_dyn'])
+        self.assertFalse(os.path.isfile(root + '_checkpoint.pkl'))
+
+    def test_no_resume_stale_files(self):
+        """Check run_dypolychord with resume=False ignores and removes files
+        left by a previous call which did not finish. This uses dummy
+        PolyChord-format data."""
+        root = os.path.join(self.settings['base_dir'],
+                            self.settings['file_root'])
+        with open(root + '_dyn.resume', 'w') as stale:
+            stale.write('stale')
+        nestcheck.io_utils.pickle_save(
+            {'steps_done': [1, 2]}, root + '_checkpoint')
+
+        def run_func(settings, comm=None):
+            """Check the dynamic run does not read the stale resume
+            file."""
+            if settings['file_root'].endswith('_dyn'):
+                self.assertFalse(settings.get('read_resume', False))
+            self.run_func(settings, comm=comm)
+
+        dyPolyChord.run_dypolychord(
+            run_func, 0, self.settings, init_step=self.ninit,
+            ninit=self.ninit, nlive_const=self.nlive_const,
+            stats_means_errs=False, clean=False, resume=False)
+        self.assertFalse(os.path.isfile(root + '_dyn.resume'))
+        self.assertFalse(os.path.isfile(root + '_checkpoint.pkl'))
+
+    def test_init_cache(self):
+        """Check initial runs are reused from the cache. This uses dummy
+        PolyChord-format data."""
+        cache_dir = os.path.join(TEST_CACHE_DIR, 'init_cache')
+        init_cache = {'cache_dir': cache_dir, 'name': 'dummy'}
+        file_roots = []
+
+        def run_func(settings, comm=None):
+            """Record which runs are performed."""
+            file_roots.append(settings['file_root'])
+            self.run_func(settings, comm=comm)
+
+        for _ in range(2):
+            dyPolyChord.run_dypolychord(
+                run_func, 1, self.settings, init_step=self.ninit,
+                ninit=self.ninit, nlive_const=self.nlive_const,
+                stats_means_errs=False, init_cache=init_cache)
+            posteriors = np.loadtxt(os.path.join(
+                TEST_CACHE_DIR, self.settings['file_root'] + '.txt'))
+            p1_mean = (np.sum(posteriors[:, 2] * posteriors[:, 0])
+                       / np.sum(posteriors[:, 0]))
+            self.assertAlmostEqual(p1_mean, 0.614126384660822, places=12)
+        # Only the dynamic run is performed the second time
+        self.assertEqual(file_roots.count('test_run_dyn'), 2)
+        self.assertEqual(len(file_roots), file_roots.index('test_run_dyn') + 2)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        # Different settings give a different entry, and the least recently
+        # used entry is evicted when the cache is too big
+        key = os.listdir(cache_dir)[0]
+        dyPolyChord.run_dypolychord(
+            run_func, 0, self.settings, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            init_cache=dict(init_cache, max_size=1))
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertNotEqual(os.listdir(cache_dir)[0], key)
+        # Unseeded runs are not cached
+        shutil.rmtree(cache_dir)
+        dyPolyChord.run_dypolychord(
+            run_func, 0, dict(self.settings, seed=-1), ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            init_cache=init_cache)
+        self.assertFalse(os.path.isdir(cache_dir))
+        # Low fidelity initial runs do not match full runs
+        dyPolyChord.run_dypolychord(
+            run_func, 0, self.settings, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            init_cache=init_cache)
+        del file_roots[:]
+        dyPolyChord.run_dypolychord(
+            run_func, 0, self.settings, ninit=self.ninit,
+            nlive_const=self.nlive_const, stats_means_errs=False,
+            init_run_polychord=run_func,
+            init_cache=dict(init_cache, init_name='emulator'))
+        self.assertEqual(file_roots, ['test_run_init', 'test_run_dyn'])
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        with warnings.catch_warnings(record=True) as war:
+            warnings.simplefilter('always')
+            dyPolyChord.run_dypolychord(
+                run_func, 0, self.settings, ninit=self.ninit,
+                nlive_const=self.nlive_const, stats_means_errs=False,
+                init_run_polychord=run_func, init_cache=init_cache)
+        self.assertTrue(any('init_name' in str(w.message) for w in war))
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
 
     def test_comm(self):
         """Test run_dyPolyChord's comm argument, which is used for running
@@ -295,6 +656,16 @@ class TestRunDynamicNS(unittest.TestCase):
             warnings.simplefilter("always")
             dyPolyChord.run_dynamic_ns.check_settings(settings)
             self.assertEqual(len(war), 1)
+        # grade_frac can be set separately for the initial and dynamic runs
+        settings, _ = dyPolyChord.run_dynamic_ns.check_settings(
+            {'grade_dims': [2, 1],
+             'grade_frac': {'init': [0.5, 0.5], 'dyn': [0.9, 0.1]}})
+        for phase, expected in [('init', [0.5, 0.5]), ('dyn', [0.9, 0.1])]:
+            self.assertEqual(dyPolyChord.initial_run.phase_settings(
+                settings, phase)['grade_frac'], expected)
+        self.assertRaises(
+            AssertionError, dyPolyChord.run_dynamic_ns.check_settings,
+            {'grade_dims': [2, 1], 'grade_frac': [1]})
 
 
 class TestNliveAllocation(unittest.TestCase):
@@ -314,6 +685,16 @@ class TestNliveAllocation(unittest.TestCase):
         numpy.testing.assert_array_equal(
             dyn_info['init_nlive_allocation'],
             dyn_info['init_nlive_allocation_unsmoothed'])
+        # Check the validation level does not change the allocation
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            dyn_info_off = dyPolyChord.nlive_allocation.allocate(
+                run, 40, dynamic_goal, smoothing_filter=None,
+                validation='off')
+        self.assertEqual(dyn_info['nlives_dict'], dyn_info_off['nlives_dict'])
+        self.assertRaises(
+            AssertionError, dyPolyChord.nlive_allocation.allocate,
+            run, 40, dynamic_goal, validation='partial')
         # Check no points remaining error
         self.assertRaises(
             AssertionError, dyPolyChord.nlive_allocation.allocate,
@@ -334,6 +715,45 @@ class TestNliveAllocation(unittest.TestCase):
             dyn_info['init_nlive_allocation'],
             dyn_info['init_nlive_allocation_unsmoothed'])
 
+    def test_cost_aware_allocation(self):
+        """Check estimating the cost of samples from checkpoints and using it
+        to allocate live points."""
+        # Checkpoint at ndead=4 is repeated (as when the run has finished)
+        cost = dyPolyChord.nlive_allocation.get_sample_cost(
+            6, [2, 4, 4], [20, 60, 60])
+        numpy.testing.assert_array_equal(cost, [10, 10, 20, 20, 20, 20])
+        # Unknown numbers of likelihood calls are skipped
+        cost = dyPolyChord.nlive_allocation.get_sample_cost(
+            4, [2, 3, 4], [20, np.nan, 30])
+        numpy.testing.assert_array_equal(cost, [10, 10, 10, 10])
+        with warnings.catch_warnings(record=True) as war:
+            warnings.simplefilter('always')
+            cost = dyPolyChord.nlive_allocation.get_sample_cost(
+                6, [2], [np.nan])
+        self.assertEqual(len(war), 1)
+        numpy.testing.assert_array_equal(cost, np.ones(6))
+        run = nestcheck.dummy_data.get_dummy_run(1, 20, ndim=2, seed=0)
+        run['nlive_array'] = np.full(20, 2.)
+        for dynamic_goal in [0, 1]:
+            nlives = dyPolyChord.nlive_allocation.dyn_nlive_array(
+                run, 200, dynamic_goal)
+            # A constant cost per sample gives the same allocation for the
+            # equivalent budget of likelihood calls
+            numpy.testing.assert_array_equal(
+                nlives, dyPolyChord.nlive_allocation.dyn_nlive_array(
+                    run, 200 * 5, dynamic_goal,
+                    sample_cost=np.full(20, 5.)))
+            # Expensive samples get fewer live points
+            cost = np.ones(20)
+            cost[:5] = 100.
+            nlives_cost = dyPolyChord.nlive_allocation.dyn_nlive_array(
+                run, 200 * 50, dynamic_goal, sample_cost=cost)
+            self.assertLess(nlives_cost[:5].sum() / nlives_cost.sum(),
+                            nlives[:5].sum() / nlives.sum())
+            if dynamic_goal == 0:
+                # The allocation is still non-increasing
+                self.assertTrue(np.all(np.diff(nlives_cost) <= 0))
+
     def test_sample_importance(self):
         """Check sample importance provides expected results."""
         run = nestcheck.dummy_data.get_dummy_thread(
@@ -373,6 +793,34 @@ class TestOutputProcessing(unittest.TestCase):
             TypeError, dyPolyChord.output_processing.process_dypolychord_run,
             'file_root', 'base_dir', dynamic_goal=1, unexpected=1)
 
+    def test_process_dypolychord_run_fast_slow_nlike(self):
+        """Check runs with one nlike per parameter speed (as with fast-slow
+        sampling) are processed with the total number of likelihood
+        calls."""
+        try:
+            os.makedirs(TEST_CACHE_DIR)
+        except OSError:
+            pass
+        try:
+            for extra, nlike in [('_init', [100, 200]), ('_dyn', [30, 40])]:
+                run = nestcheck.dummy_data.get_dummy_run(
+                    2, 10, ndim=2, seed=len(extra))
+                run['output'] = {'file_root': 'fast_slow' + extra,
+                                 'base_dir': TEST_CACHE_DIR, 'nlike': nlike}
+                nestcheck.write_polychord_output.write_run_output(
+                    run, stats_means_errs=False)
+            for merge_init, expected in [(True, 360), (False, 60)]:
+                nestcheck.io_utils.pickle_save(
+                    {'merge_init': merge_init},
+                    os.path.join(TEST_CACHE_DIR, 'fast_slow_dyn_info'),
+                    overwrite_existing=True)
+                run = dyPolyChord.output_processing.process_dypolychord_run(
+                    'fast_slow', TEST_CACHE_DIR, dynamic_goal=1,
+                    nlike_cached=10)
+                self.assertEqual(run['output']['nlike'], expected)
+        finally:
+            shutil.rmtree(TEST_CACHE_DIR)
+
     def test_combine_resumed_dyn_run(self):
         """Test combining resumed dynamic and initial runs and removing
         duplicate points using dummy ns runs.
@@ -406,6 +854,530 @@ class TestOutputProcessing(unittest.TestCase):
         numpy.testing.assert_array_equal(
             comb['nlive_array'], np.asarray([2., 2., 3., 3., 2., 2., 1.]))
 
+    def test_compact_run(self):
+        """Check compact runs keep their dtypes when combined."""
+        run = nestcheck.dummy_data.get_dummy_dynamic_run(
+            10, seed=0, nthread_init=2, nthread_dyn=3)
+        comp = dyPolyChord.output_processing.compact_run(
+            copy.deepcopy(run), float32_theta=True)
+        dyPolyChord.output_processing.check_run(comp)
+        parts = []
+        for labels in [[0, 1], [2, 3, 4]]:
+            mask = np.isin(comp['thread_labels'], labels)
+            parts.append({'logl': comp['logl'][mask],
+                          'thread_labels': comp['thread_labels'][mask],
+                          'nlive_array': comp['nlive_array'][mask],
+                          'theta': comp['theta'][mask, :],
+                          'thread_min_max': comp['thread_min_max'][labels]})
+        comb = dyPolyChord.output_processing.combine_run_threads(parts)
+        self.assertEqual(comb['thread_labels'].dtype, np.int32)
+        self.assertEqual(comb['nlive_array'].dtype, np.int32)
+        self.assertEqual(comb['theta'].dtype, np.float32)
+        self.assertEqual(comb['logl'].dtype, np.float64)
+        for key in ['logl', 'thread_labels', 'nlive_array']:
+            numpy.testing.assert_array_equal(comb[key], run[key])
+        numpy.testing.assert_allclose(comb['theta'], run['theta'], rtol=1e-6)
+
+    def test_resample_counts(self):
+        """Check systematic and residual resampling."""
+        logw = np.log(np.random.random(100))
+        w_norm = np.exp(logw) / np.exp(logw).sum()
+        for method in ['systematic', 'residual']:
+            counts = dyPolyChord.output_processing.resample_counts(
+                logw, nsample=1000, method=method, seed=1)
+            self.assertEqual(counts.sum(), 1000)
+            self.assertTrue(np.all(counts >= 0))
+            numpy.testing.assert_array_equal(
+                counts, dyPolyChord.output_processing.resample_counts(
+                    logw, nsample=1000, method=method, seed=1))
+            self.assertTrue(np.all(np.abs(counts - 1000 * w_norm) < 2))
+        self.assertTrue(np.all(counts >= np.floor(1000 * w_norm)))
+        # Default number of samples
+        self.assertEqual(
+            dyPolyChord.output_processing.resample_counts(logw).sum(),
+            int(np.round(np.exp(logw - logw.max()).sum())))
+        # Check chunks
+        inds = list(dyPolyChord.output_processing.resample_inds_chunks(
+            counts, 30))
+        self.assertEqual(len(inds), 4)
+        numpy.testing.assert_array_equal(
+            np.concatenate(inds), np.repeat(np.arange(100), counts))
+        self.assertRaises(
+            AssertionError, dyPolyChord.output_processing.resample_counts,
+            logw, method='unexpected')
+        self.assertRaises(
+            TypeError, dyPolyChord.output_processing.resample_counts,
+            logw, unexpected=1)
+
+    def test_duplicate_groups(self):
+        """Check finding and matching duplicate logl values."""
+        logl = np.asarray([3., 1., 2., 1., 3., 0., 1.])
+        groups = dyPolyChord.output_processing.duplicate_groups(logl)
+        self.assertEqual([list(group) for group in groups],
+                         [[1, 3, 6], [0, 4]])
+        self.assertEqual(
+            dyPolyChord.output_processing.duplicate_groups(np.arange(3.)), [])
+        numpy.testing.assert_array_equal(
+            dyPolyChord.output_processing.match_logl(
+                np.asarray([2., 5., 0.]), logl), np.asarray([2, -1, 5]))
+        numpy.testing.assert_array_equal(
+            dyPolyChord.output_processing.match_logl(
+                np.asarray([2.]), np.asarray([])), np.asarray([-1]))
+        self.assertRaises(
+            AssertionError, dyPolyChord.output_processing.check_duplicates,
+            logl, dup_assert=True)
+        with warnings.catch_warnings(record=True) as war:
+            warnings.simplefilter('always')
+            dyPolyChord.output_processing.check_duplicates(
+                logl, dup_warn=True)
+            dyPolyChord.output_processing.check_duplicates(
+                np.arange(3.), dup_warn=True)
+            self.assertEqual(len(war), 1)
+
+    def test_check_run_validation(self):
+        """Check the validation levels of check_run and check_sorted."""
+        run = nestcheck.dummy_data.get_dummy_run(200, 10, seed=0)
+        for validation in ['full', 'sampled', 'off']:
+            dyPolyChord.output_processing.check_run(
+                run, validation=validation)
+        self.assertRaises(
+            AssertionError, dyPolyChord.output_processing.check_run,
+            run, validation='partial')
+        # A thread whose end logl does not match thread_min_max
+        bad_run = copy.deepcopy(run)
+        bad_run['thread_min_max'][:, 1] += 1
+        for validation in ['full', 'sampled']:
+            self.assertRaises(
+                AssertionError, dyPolyChord.output_processing.check_run,
+                bad_run, validation=validation)
+        dyPolyChord.output_processing.check_run(bad_run, validation='off')
+        # Unsorted chunk boundaries are found by sampled validation
+        values = np.arange(100000.)
+        values[50000:] -= 1e6
+        for validation in ['full', 'sampled']:
+            self.assertRaises(
+                AssertionError, dyPolyChord.output_processing.check_sorted,
+                values, validation=validation)
+        dyPolyChord.output_processing.check_sorted(
+            np.arange(100000.), validation='sampled')
+        self.assertRaises(
+            TypeError, dyPolyChord.output_processing.check_sorted,
+            values, unexpected=1)
+
+    def test_combine_run_threads(self):
+        """Check combining threads and checking runs gives the same results
+        as nestcheck."""
+        run = nestcheck.dummy_data.get_dummy_dynamic_run(
+            10, seed=0, nthread_init=2, nthread_dyn=3)
+        # Move one thread's starting logl so no point has that logl
+        ind = np.where(run['thread_min_max'][:, 0] != -np.inf)[0][0]
+        run['thread_min_max'][ind, 0] -= 1e-9
+        threads = nestcheck.ns_run_utils.get_run_threads(run)
+        expected = nestcheck.ns_run_utils.combine_threads(threads)
+        # Split the run's samples into two parts by thread label
+        parts = []
+        for mask in [run['thread_labels'] < 2, run['thread_labels'] >= 2]:
+            parts.append({key: run[key][mask] for key in
+                          ['logl', 'theta', 'thread_labels']})
+            parts[-1]['thread_min_max'] = run['thread_min_max'][
+                np.unique(run['thread_labels'][mask]), :]
+        comb = dyPolyChord.output_processing.combine_run_threads(parts)
+        for key in ['logl', 'nlive_array', 'theta', 'thread_labels',
+                    'thread_min_max']:
+            numpy.testing.assert_array_equal(comb[key], expected[key])
+        dyPolyChord.output_processing.check_run(comb)
+        comb['thread_min_max'][0, 1] += 1
+        self.assertRaises(
+            AssertionError, dyPolyChord.output_processing.check_run, comb)
+
+    def test_reweight_run(self):
+        """Check importance reweighting a run."""
+        run = nestcheck.dummy_data.get_dummy_run(2, 10, ndim=2, seed=0)
+        reweighted = dyPolyChord.output_processing.reweight_run(
+            run, delta_logprior=lambda theta: np.full(theta.shape[0], 2.),
+            batch_size=3)
+        self.assertAlmostEqual(reweighted['logz'], e.logz(run) + 2)
+        self.assertAlmostEqual(reweighted['ess_ratio'], 1)
+        numpy.testing.assert_array_equal(reweighted['logl'], run['logl'])
+        # Check the effect of a likelihood term on the parameter means
+        reweighted = dyPolyChord.output_processing.reweight_run(
+            run, delta_logl=lambda theta: theta[:, 0])
+        numpy.testing.assert_allclose(
+            reweighted['logl'], run['logl'] + run['theta'][:, 0])
+        w_rel = np.exp(reweighted['logw'] - reweighted['logw'].max())
+        self.assertAlmostEqual(
+            np.sum(w_rel * run['theta'][:, 0]) / np.sum(w_rel),
+            np.sum(nestcheck.ns_run_utils.get_w_rel(run)
+                   * np.exp(run['theta'][:, 0]) * run['theta'][:, 0]) /
+            np.sum(nestcheck.ns_run_utils.get_w_rel(run)
+                   * np.exp(run['theta'][:, 0])))
+        # Check the warning when the effective sample size becomes small
+        with warnings.catch_warnings(record=True) as war:
+            warnings.simplefilter('always')
+            dyPolyChord.output_processing.reweight_run(
+                run, delta_logl=lambda theta: 1000 * theta[:, 0],
+                min_ess_ratio=0.5)
+            self.assertEqual(len(war), 1)
+        self.assertRaises(
+            TypeError, dyPolyChord.output_processing.reweight_run,
+            run, unexpected=1)
+        # Check writing the reweighted posterior
+        if os.path.exists(TEST_CACHE_DIR):
+            shutil.rmtree(TEST_CACHE_DIR)
+        os.makedirs(TEST_CACHE_DIR)
+        try:
+            run['output'] = {'base_dir': TEST_CACHE_DIR, 'file_root': 'run'}
+            dyPolyChord.write_polychord_output.write_reweighted_output(
+                run, reweighted, equals_method='systematic', nequals=10)
+            posteriors = np.loadtxt(os.path.join(
+                TEST_CACHE_DIR, 'run_reweighted.txt'))
+            numpy.testing.assert_allclose(posteriors[:, 0], w_rel, rtol=1e-14)
+            numpy.testing.assert_allclose(
+                posteriors[:, 1], -2 * reweighted['logl'], rtol=1e-14)
+            self.assertEqual(np.loadtxt(os.path.join(
+                TEST_CACHE_DIR, 'run_reweighted_equal_weights.txt')).shape,
+                             (10, 3))
+        finally:
+            shutil.rmtree(TEST_CACHE_DIR)
+
+
+class TestWritePolyChordOutput(unittest.TestCase):
+
+    """Tests for the write_polychord_output.py module."""
+
+    def setUp(self):
+        """Make a temporary directory for saving test files."""
+        if os.path.exists(TEST_CACHE_DIR):
+            shutil.rmtree(TEST_CACHE_DIR)
+        os.makedirs(TEST_CACHE_DIR)
+        # Dynamic run includes threads which do not start by sampling the
+        # whole prior
+        self.run = nestcheck.dummy_data.get_dummy_dynamic_run(
+            10, seed=1, ndim=3, nthread_init=2, nthread_dyn=3)
+
+    def tearDown(self):
+        """Remove any caches saved by the tests."""
+        try:
+            shutil.rmtree(TEST_CACHE_DIR)
+        except OSError:
+            pass
+
+    def test_write_run_output(self):
+        """Check the output files match those written by nestcheck."""
+        files = {}
+        for i, module in enumerate([nestcheck.write_polychord_output,
+                                    dyPolyChord.write_polychord_output]):
+            run = copy.deepcopy(self.run)
+            run['output'] = {'base_dir': TEST_CACHE_DIR,
+                             'file_root': 'run{}'.format(i)}
+            np.random.seed(0)
+            module.write_run_output(run, posteriors=True, equals=True,
+                                    n_simulate=2)
+            root = os.path.join(TEST_CACHE_DIR, 'run{}'.format(i))
+            for ext in ['.txt', '_equal_weights.txt', '_dead.txt',
+                        '_dead-birth.txt']:
+                with open(root + ext, 'rb') as txt_file:
+                    files[(i, ext)] = txt_file.read()
+            files[(i, 'nequals')] = run['output']['nequals']
+        for key in ['.txt', '_equal_weights.txt', '_dead.txt',
+                    '_dead-birth.txt', 'nequals']:
+            self.assertEqual(files[(0, key)], files[(1, key)], key)
+
+    def test_write_run_output_compression(self):
+        """Check compressed output files written in several chunks."""
+        self.run['output'] = {'base_dir': TEST_CACHE_DIR, 'file_root': 'temp'}
+        dyPolyChord.write_polychord_output.write_run_output(
+            self.run, chunk_size=7, compression='gzip', write_stats=False)
+        root = os.path.join(TEST_CACHE_DIR, 'temp')
+        with gzip.open(root + '_dead.txt.gz', 'rb') as gz_file:
+            dead = np.loadtxt(gz_file)
+        numpy.testing.assert_allclose(
+            dead, np.hstack([self.run['theta'], self.run['logl'][:, None]]),
+            rtol=1e-14)
+        # Check systematic resampling for the equal weights file
+        self.run['output']['file_root'] = 'temp_equals'
+        dyPolyChord.write_polychord_output.write_run_output(
+            self.run, chunk_size=7, equals=True, equals_method='systematic',
+            nequals=50, write_stats=False)
+        self.assertEqual(self.run['output']['nequals'], 50)
+        equals = np.loadtxt(root + '_equals_equal_weights.txt')
+        self.assertEqual(equals.shape, (50, self.run['theta'].shape[1] + 1))
+        self.assertRaises(
+            ValueError, dyPolyChord.write_polychord_output.write_run_output,
+            self.run, compression='unexpected')
+        # Check a clear error is given for zstd without zstandard
+        zstandard = dyPolyChord.write_polychord_output.zstandard
+        dyPolyChord.write_polychord_output.zstandard = None
+        try:
+            self.assertRaises(
+                ImportError,
+                dyPolyChord.write_polychord_output.write_run_output,
+                self.run, compression='zstd')
+        finally:
+            dyPolyChord.write_polychord_output.zstandard = zstandard
+        self.assertRaises(
+            TypeError, dyPolyChord.write_polychord_output.write_run_output,
+            self.run, unexpected=1)
+
+    def test_write_run_output_threads(self):
+        """Check writing files on a thread pool gives the same output, and
+        that no partly written files are left if writing fails."""
+        kwargs = {'posteriors': True, 'equals': True, 'chunk_size': 7,
+                  'equals_method': 'systematic', 'equals_seed': 1,
+                  'n_simulate': 2, 'compression': 'gzip'}
+        outputs = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+            for i, extra_kwargs in enumerate(
+                    [{}, {'executor': pool, 'fsync': True}]):
+                self.run['output'] = {'base_dir': TEST_CACHE_DIR,
+                                      'file_root': 'run{}'.format(i)}
+                np.random.seed(0)
+                dyPolyChord.write_polychord_output.write_run_output(
+                    self.run, **dict(kwargs, **extra_kwargs))
+                root = os.path.join(TEST_CACHE_DIR, 'run{}'.format(i))
+                output = {}
+                for ext in ['.txt', '_equal_weights.txt', '_dead.txt',
+                            '_dead-birth.txt']:
+                    with gzip.open(root + ext + '.gz', 'rb') as gz_file:
+                        output[ext] = gz_file.read()
+                output['stats'] = nestcheck.data_processing.\
+                    process_polychord_stats('run{}'.format(i), TEST_CACHE_DIR)
+                del output['stats']['file_root']
+                outputs.append(output)
+            self.assertEqual(outputs[0], outputs[1])
+            self.assertFalse([name for name in os.listdir(TEST_CACHE_DIR)
+                              if name.endswith('.part')])
+            # Make formatting fail after some rows have been written
+            self.run['output']['file_root'] = 'fail'
+            self.run['theta'] = self.run['theta'].astype(object)
+            self.run['theta'][-1, 0] = 'not a number'
+            self.assertRaises(
+                TypeError, dyPolyChord.write_polychord_output.write_run_output,
+                self.run, executor=pool, chunk_size=7, write_stats=False)
+        self.assertFalse([name for name in os.listdir(TEST_CACHE_DIR)
+                          if name.startswith('fail')])
+
+
+class TestReadPolyChordOutput(unittest.TestCase):
+
+    """Tests for the read_polychord_output.py module."""
+
+    def setUp(self):
+        """Make a temporary directory and write dummy PolyChord output."""
+        if os.path.exists(TEST_CACHE_DIR):
+            shutil.rmtree(TEST_CACHE_DIR)
+        os.makedirs(TEST_CACHE_DIR)
+        run = nestcheck.dummy_data.get_dummy_dynamic_run(
+            10, seed=1, ndim=3, nthread_init=2, nthread_dyn=3)
+        run['output'] = {'base_dir': TEST_CACHE_DIR, 'file_root': 'temp'}
+        nestcheck.write_polychord_output.write_run_output(run, n_simulate=2)
+
+    def tearDown(self):
+        """Remove any caches saved by the tests."""
+        try:
+            shutil.rmtree(TEST_CACHE_DIR)
+        except OSError:
+            pass
+
+    def test_process_polychord_run(self):
+        """Check loading in chunks matches nestcheck."""
+        expected = nestcheck.data_processing.process_polychord_run(
+            'temp', TEST_CACHE_DIR)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+            for kwargs in [{'nproc': 1}, {'executor': pool},
+                           {'nproc': 2, 'chunk_size': 100}]:
+                run = dyPolyChord.read_polychord_output.process_polychord_run(
+                    'temp', TEST_CACHE_DIR, **kwargs)
+                for key in ['logl', 'nlive_array', 'theta', 'thread_labels',
+                            'thread_min_max']:
+                    numpy.testing.assert_array_equal(run[key], expected[key])
+                self.assertEqual(run['output'], expected['output'])
+        self.assertRaises(
+            TypeError, dyPolyChord.read_polychord_output.load_dead_birth,
+            os.path.join(TEST_CACHE_DIR, 'temp_dead-birth.txt'), unexpected=1)
+
+    def test_read_stats_counts(self):
+        """Check reading ndead and nlike matches nestcheck, and using the
+        counts in compact resume outputs."""
+        for nlike, expected in [(1234, 1234), ([100, 200], 300)]:
+            output = {'file_root': 'stats', 'base_dir': TEST_CACHE_DIR,
+                      'ndead': 57, 'nlike': nlike, 'logZs': [0.0, 0.1],
+                      'logZerrs': [0.1, 0.1]}
+            nestcheck.write_polychord_output.write_stats_file(output)
+            stats = nestcheck.data_processing.process_polychord_stats(
+                'stats', TEST_CACHE_DIR)
+            self.assertEqual(stats['nlike'], nlike)
+            self.assertEqual(
+                dyPolyChord.read_polychord_output.read_stats_counts(
+                    'stats', TEST_CACHE_DIR), (57, expected))
+        resume_outputs = {20: {'ndead': 20, 'nlike': 200},
+                          10: {'ndead': 10, 'nlike': 90}}
+        for counts in [
+                dyPolyChord.initial_run.get_resume_counts(resume_outputs),
+                dyPolyChord.initial_run.get_resume_counts(np.column_stack(
+                    dyPolyChord.initial_run.get_resume_counts(
+                        resume_outputs)))]:
+            numpy.testing.assert_array_equal(counts[0], [10, 20])
+            numpy.testing.assert_array_equal(counts[1], [90, 200])
+
+
+class TestStorage(unittest.TestCase):
+
+    """Tests for the storage.py module."""
+
+    def setUp(self):
+        """Make a directory and some files to store."""
+        if os.path.exists(TEST_CACHE_DIR):
+            shutil.rmtree(TEST_CACHE_DIR)
+        os.makedirs(TEST_CACHE_DIR)
+        state = np.random.RandomState(0)
+        self.contents = {'empty': b'', 'small': b'abc',
+                         'large': state.bytes(2500)}
+        for name, data in self.contents.items():
+            with open(os.path.join(TEST_CACHE_DIR, name), 'wb') as outfile:
+                outfile.write(data)
+
+    def tearDown(self):
+        """Remove any caches saved by the tests."""
+        try:
+            shutil.rmtree(TEST_CACHE_DIR)
+        except OSError:
+            pass
+
+    def test_round_trip(self):
+        """Check putting, getting and removing files with each backend."""
+        for storage in [
+                dyPolyChord.storage.LocalStorage(
+                    os.path.join(TEST_CACHE_DIR, 'local'), nthread=2),
+                dyPolyChord.storage.MemoryStorage(),
+                dyPolyChord.storage.DirectoryObjectStore(
+                    os.path.join(TEST_CACHE_DIR, 'store'), part_size=1000,
+                    nthread=2)]:
+            storage.put_many([(os.path.join(TEST_CACHE_DIR, name), name)
+                              for name in self.contents])
+            self.assertEqual(storage.names(), sorted(self.contents))
+            for name, data in self.contents.items():
+                self.assertTrue(storage.exists(name))
+                self.assertEqual(storage.read(name), data)
+                path = os.path.join(TEST_CACHE_DIR, 'copy')
+                storage.get(name, path)
+                with open(path, 'rb') as infile:
+                    self.assertEqual(infile.read(), data)
+            # Overwrite an object
+            storage.put(os.path.join(TEST_CACHE_DIR, 'small'), 'large')
+            self.assertEqual(storage.read('large'), b'abc')
+            storage.remove('large')
+            self.assertFalse(storage.exists('large'))
+            self.assertEqual(storage.names(), ['empty', 'small'])
+
+    def test_object_store_parts(self):
+        """Check the object store's multipart uploads and the detection of
+        corrupted parts."""
+        store = dyPolyChord.storage.DirectoryObjectStore(
+            os.path.join(TEST_CACHE_DIR, 'store'), part_size=1000)
+        store.put(os.path.join(TEST_CACHE_DIR, 'large'), 'large')
+        self.assertEqual([part['size'] for part in
+                          store.manifest('large')['parts']], [1000, 1000, 500])
+        # Incomplete uploads are not visible
+        os.makedirs(os.path.join(store.root, 'incomplete'))
+        self.assertEqual(store.names(), ['large'])
+        with open(os.path.join(store.root, 'large',
+                               dyPolyChord.storage.part_name(1)),
+                  'r+b') as part:
+            part.write(b'x')
+        self.assertRaises(IOError, store.read, 'large')
+        path = os.path.join(TEST_CACHE_DIR, 'copy')
+        self.assertRaises(IOError, store.get, 'large', path)
+        self.assertFalse(os.path.exists(path + '.part'))
+        # Failed uploads are removed, including when a later file is missing
+        self.assertRaises(OSError, store.put_many, [
+            (os.path.join(TEST_CACHE_DIR, 'small'), 'small'),
+            (os.path.join(TEST_CACHE_DIR, 'missing'), 'missing')])
+        self.assertEqual(sorted(os.listdir(store.root)),
+                         ['incomplete', 'large'])
+        self.assertRaises(
+            NotImplementedError, dyPolyChord.storage.Storage().names)
+
+
+class TestProgressMonitor(unittest.TestCase):
+
+    """Tests for the progress_monitor.py module."""
+
+    def setUp(self):
+        """Make a temporary directory for saving test files."""
+        if os.path.exists(TEST_CACHE_DIR):
+            shutil.rmtree(TEST_CACHE_DIR)
+        os.makedirs(TEST_CACHE_DIR)
+        self.root = os.path.join(TEST_CACHE_DIR, 'temp')
+
+    def tearDown(self):
+        """Remove any caches saved by the tests."""
+        try:
+            shutil.rmtree(TEST_CACHE_DIR)
+        except OSError:
+            pass
+
+    def test_progress_monitor(self):
+        """Check metrics from dead-birth and .stats files as they grow."""
+        dead = np.zeros((10, 4))
+        dead[:, 2] = np.arange(10)
+        metrics_file = self.root + '_metrics.txt'
+        monitor = dyPolyChord.progress_monitor.ProgressMonitor(
+            self.root, nlive=5, max_ndead=20, metrics_file=metrics_file,
+            http_port=0)
+        monitor.update()
+        self.assertEqual(monitor.metrics['ndead'], 0)
+        # Write 6 complete lines and part of the seventh
+        lines = ''.join(['{0} {1} {2} {3}\n'.format(*row) for row in dead])
+        end = sum(len(line) + 1 for line in lines.split('\n')[:6]) + 3
+        with open(self.root + '_dead-birth.txt', 'w') as dead_file:
+            dead_file.write(lines[:end])
+        with open(self.root + '.stats', 'w') as stats_file:
+            stats_file.write('nlike:               100\n')
+        monitor.update()
+        self.assertEqual(monitor.metrics['ndead'], 6)
+        self.assertEqual(monitor.metrics['logl'], 5)
+        self.assertAlmostEqual(monitor.metrics['logx'], -6 / 5.)
+        self.assertEqual(monitor.metrics['nlike'], 100)
+        self.assertAlmostEqual(monitor.metrics['eta'],
+                               monitor.metrics['elapsed'] * 14 / 6.)
+        with open(self.root + '_dead-birth.txt', 'a') as dead_file:
+            dead_file.write(lines[end:])
+        with open(self.root + '.stats', 'w') as stats_file:
+            # With fast-slow sampling there is one count for each speed
+            stats_file.write('nlike:               150        50\n')
+        monitor.update()
+        self.assertEqual(monitor.metrics['ndead'], 10)
+        self.assertEqual(monitor.metrics['logl'], 9)
+        self.assertEqual(monitor.metrics['nlike'], 200)
+        self.assertGreater(monitor.metrics['nlike_per_sec'], 0)
+        with open(metrics_file, 'r') as metrics_file_obj:
+            self.assertIn('ndead 10\n', metrics_file_obj.read())
+        port = monitor.server.server_address[1]
+        response = urlopen('http://localhost:{}'.format(port)).read()
+        self.assertIn(b'ndead 10\n', response)
+        # Check a rewritten file is read again from the start
+        with open(self.root + '_dead-birth.txt', 'w') as dead_file:
+            dead_file.write(lines.split('\n')[0] + '\n')
+        monitor.update()
+        self.assertEqual(monitor.metrics['ndead'], 1)
+        monitor.stop()
+        self.assertRaises(
+            TypeError, dyPolyChord.progress_monitor.ProgressMonitor,
+            self.root, unexpected=1)
+
+    def test_nlives_schedule(self):
+        """Check the number of live points and schedule completed are found
+        from an nlives dict."""
+        monitor = dyPolyChord.progress_monitor.ProgressMonitor(
+            self.root, nlive=5, nlives={-1e100: 5, 1.: 10, 3.: 0, 4.: 0})
+        numpy.testing.assert_array_equal(
+            monitor.get_nlive(np.asarray([0., 2., 3.5, 5.])),
+            np.asarray([5., 10., 1., 1.]))
+        monitor.logl = 2.
+        monitor.update()
+        self.assertAlmostEqual(monitor.metrics['schedule_frac'], 2 / 3.)
+
 
 class TestPolyChordUtils(unittest.TestCase):
 
@@ -495,6 +1467,32 @@ class TestPolyChordUtils(unittest.TestCase):
                 prior_obj, nparam=nparam), prior_str)
 
 
+    def test_block_prior_speeds(self):
+        """Check BlockPrior speeds are used for fast-slow decomposition."""
+        prior_obj = dyPolyChord.python_priors.Uniform(-1, 1)
+        block_obj = dyPolyChord.python_priors.BlockPrior(
+            [prior_obj, prior_obj, prior_obj], [2, 1, 3], speeds=[1, 1, 2])
+        self.assertEqual(block_obj.grade_dims(), [3, 3])
+        expected = ''
+        for i, (start, nparam, speed) in enumerate(
+                [(1, 2, 1), (3, 1, 1), (4, 3, 2)]):
+            expected += dyPolyChord.polychord_utils.get_prior_block_str(
+                'uniform', [-1, 1], nparam, start_param=start, block=i + 1,
+                speed=speed)
+        self.assertEqual(
+            dyPolyChord.polychord_utils.python_block_prior_to_str(block_obj),
+            expected)
+        self.assertRaises(
+            AssertionError, dyPolyChord.python_priors.BlockPrior,
+            [prior_obj, prior_obj], [2, 1], speeds=[2, 1])
+        # grade_dims is given by the prior block speeds in ini files
+        run_obj = dyPolyChord.polychord_utils.RunCompiledPolyChord(
+            ':', expected)
+        lines = run_obj.ini_string(
+            {'grade_frac': [0.8, 0.2], 'grade_dims': [3, 3]}).splitlines()
+        self.assertEqual(lines[0], 'grade_frac = 0.8 0.2')
+        self.assertFalse(any(line.startswith('grade_dims') for line in lines))
+
     def test_get_prior_block_unexpected_kwargs(self):
         """Check appropriate error is raised when an unexpected keyword
         argument is given."""
@@ -540,6 +1538,61 @@ class TestPolyChordUtils(unittest.TestCase):
                           'mpi_str', 'config_str'})
         func({'base_dir': TEST_CACHE_DIR, 'file_root': 'temp'})
 
+    def test_persistent_compiled_run_func(self):
+        """
+        Check running a compiled PolyChord driver which stays running between
+        runs.
+
+        In place of an executable we use a python script which records its
+        process ID and the .ini file paths it is sent.
+        """
+        executable_path = os.path.join(TEST_CACHE_DIR, 'dummy_driver')
+        with open(executable_path, 'w') as ex_file:
+            ex_file.write('\n'.join([
+                '#!' + sys.executable,
+                'import os, sys, time',
+                'for line in sys.stdin:',
+                '    time.sleep(0.01)',
+                '    with open(line.strip() + ".out", "w") as out_file:',
+                '        out_file.write(str(os.getpid()))',
+                '    print("feedback")',
+                '    print("dyPolyChord run done")',
+                '    sys.stdout.flush()']))
+        os.chmod(executable_path, 0o755)
+        with dyPolyChord.polychord_utils.RunPersistentCompiledPolyChord(
+                executable_path, 'prior\n') as func:
+            for root in ['temp1', 'temp2']:
+                func({'base_dir': TEST_CACHE_DIR, 'file_root': root})
+            self.assertIsNone(func.process.poll())
+
+            def run_and_check(root):
+                """Check the run has finished when the call returns."""
+                func({'base_dir': TEST_CACHE_DIR, 'file_root': root})
+                return os.path.isfile(
+                    os.path.join(TEST_CACHE_DIR, root + '.ini.out'))
+
+            # Concurrent calls are performed one at a time
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=4) as pool:
+                self.assertTrue(all(pool.map(
+                    run_and_check, ['conc{}'.format(i) for i in range(8)])))
+        self.assertIsNone(func.process)
+        pids = []
+        for root in ['temp1', 'temp2']:
+            path = os.path.join(TEST_CACHE_DIR, root + '.ini')
+            self.assertTrue(os.path.isfile(path))
+            with open(path + '.out') as out_file:
+                pids.append(out_file.read())
+        self.assertEqual(pids[0], pids[1])
+        # Check error if the executable exits without finishing the run
+        with open(executable_path, 'w') as ex_file:
+            ex_file.write('#!/bin/sh\nexit 1\n')
+        func = dyPolyChord.polychord_utils.RunPersistentCompiledPolyChord(
+            executable_path, 'prior\n')
+        self.assertRaises(
+            AssertionError, func,
+            {'base_dir': TEST_CACHE_DIR, 'file_root': 'temp3'})
+
 
 @unittest.skipIf(not PYPOLYCHORD_AVAIL, 'pypolychord not installed.')
 class TestPyPolyChordUtils(unittest.TestCase):
@@ -551,6 +1604,22 @@ class TestPyPolyChordUtils(unittest.TestCase):
     compiled likelihoods.
     """
 
+    def test_nested_likelihood_wrappers(self):
+        """Check cache hits are counted for a CachedLikelihood wrapped by a
+        SurrogateLikelihood, and that the surrogate cannot be wrapped by the
+        cache."""
+        func = dyPolyChord.surrogate.SurrogateLikelihood(
+            likelihoods.CachedLikelihood(likelihoods.Gaussian()))
+        run_func = dyPolyChord.pypolychord_utils.RunPyPolyChord(
+            func, priors.Uniform(), 2)
+        for _ in range(3):
+            func(np.zeros(2))
+        self.assertEqual(likelihoods.get_cache_hits(
+            run_func), 2)
+        self.assertRaises(
+            AssertionError, dyPolyChord.pypolychord_utils.RunPyPolyChord,
+            likelihoods.CachedLikelihood(func), priors.Uniform(), 2)
+
     def test_python_run_func(self):
         """Check functions for running PolyChord via the pypolychord wrapper
         (as opposed to with a compiled likelihood) in the form needed for
@@ -579,6 +1648,68 @@ class TestPyPolyChordUtils(unittest.TestCase):
             AssertionError, run_func, {}, comm=DummyMPIComm(1))
 
 
+class TestPyPolyChordUtilsStubbed(unittest.TestCase):
+
+    """
+    Tests for the pypolychord_utils.py module which use a stub in place of
+    pypolychord, so they run even if pypolychord is not installed.
+    """
+
+    def setUp(self):
+        """Replace pypolychord in pypolychord_utils with a stub."""
+        import dyPolyChord.pypolychord_utils as pypolychord_utils
+        self.module = pypolychord_utils
+        self.saved = {name: getattr(pypolychord_utils, name, None) for name
+                      in ('pypolychord', 'pypolychord_settings')}
+        self.stub = StubPyPolyChord()
+        pypolychord_utils.pypolychord = self.stub
+        pypolychord_utils.pypolychord_settings = self.stub
+
+    def tearDown(self):
+        """Restore pypolychord in pypolychord_utils."""
+        for name, value in self.saved.items():
+            if value is None:
+                delattr(self.module, name)
+            else:
+                setattr(self.module, name, value)
+
+    def test_worker_rank(self):
+        """Check runs on MPI ranks other than 0 (for which settings_dict is
+        None) use the settings broadcast from rank 0."""
+        run_func = self.module.RunPyPolyChord(
+            likelihoods.Gaussian(), priors.BlockPrior(
+                [priors.Uniform(), priors.Uniform()], [1, 1], speeds=[1, 2]),
+            2)
+        bcast = self.stub.PolyChordSettings(2, 0, file_root='bcast')
+        run_func(None, comm=StubMPIComm(1, bcast))
+        self.assertEqual(self.stub.runs, [bcast])
+        # On rank 0 grade_dims is added using the prior's speeds
+        run_func({'file_root': 'root'}, comm=StubMPIComm(0))
+        self.assertEqual(self.stub.runs[-1].file_root, 'root')
+        self.assertEqual(self.stub.runs[-1].grade_dims,
+                         run_func.prior.grade_dims())
+
+    def test_worker_rank_surrogate(self):
+        """Check a surrogate likelihood follows the dead points of the run
+        using the settings broadcast from rank 0, and is only used without
+        clustering."""
+        func = dyPolyChord.surrogate.SurrogateLikelihood(
+            likelihoods.Gaussian())
+        func.surrogate.centers = np.zeros((1, 2))  # mark as fitted
+        run_func = self.module.RunPyPolyChord(func, priors.Uniform(), 2)
+        run_func(None, comm=StubMPIComm(1, self.stub.PolyChordSettings(
+            2, 0, base_dir='base', file_root='temp_dyn',
+            do_clustering=False)))
+        self.assertEqual(func.reader.path,
+                         os.path.join('base', 'temp_dyn_dead-birth.txt'))
+        self.assertTrue(func.active)
+        with warnings.catch_warnings(record=True) as war:
+            warnings.simplefilter('always')
+            run_func({'base_dir': 'base', 'file_root': 'temp_dyn'})
+            self.assertEqual(len(war), 1)
+        self.assertFalse(func.active)
+
+
 class TestPythonPriors(unittest.TestCase):
 
     """Tests for the python_priors.py module."""
@@ -614,6 +1745,33 @@ class TestPythonPriors(unittest.TestCase):
             np.full(cube.shape, np.nan),
             dyPolyChord.python_priors.Uniform(adaptive=True, sort=True)(cube))
 
+    @staticmethod
+    def test_old_signature_prior():
+        """Check BasePrior subclasses whose cube_to_physical does not take an
+        out argument still work, including in a BlockPrior."""
+
+        class Double(dyPolyChord.python_priors.BasePrior):
+
+            """Prior written without an out argument."""
+
+            def cube_to_physical(self, cube):
+                """Double the hypercube values."""
+                return 2 * cube
+
+        cube = np.random.random(4)
+        for prior in [Double(), Double(preallocate=True)]:
+            numpy.testing.assert_allclose(prior(cube), 2 * cube)
+            out = np.empty(4)
+            numpy.testing.assert_allclose(prior(cube, out=out), 2 * cube)
+            numpy.testing.assert_allclose(out, 2 * cube)
+        numpy.testing.assert_allclose(
+            Double(sort=True)(cube),
+            2 * dyPolyChord.python_priors.forced_identifiability(cube))
+        block = dyPolyChord.python_priors.BlockPrior(
+            [Double(), dyPolyChord.python_priors.Uniform(0, 1)], [2, 2])
+        numpy.testing.assert_allclose(
+            block(cube), np.concatenate((2 * cube[:2], cube[2:])))
+
     @staticmethod
     def test_uniform():
         """Check uniform prior."""
@@ -684,6 +1842,34 @@ class TestPythonPriors(unittest.TestCase):
         theta_check = copy.deepcopy(hypercube)
         theta_check[block_sizes[0]:] += 1
         numpy.testing.assert_allclose(theta_prior, theta_check)
+        # Check with a function prior and writing to a preallocated array
+        prior_blocks[1] = lambda x: x + 1
+        block_prior = dyPolyChord.python_priors.BlockPrior(
+            prior_blocks, block_sizes, preallocate=True)
+        out = block_prior(hypercube)
+        numpy.testing.assert_allclose(out, theta_check)
+        assert block_prior(hypercube) is out
+
+    @staticmethod
+    def test_prior_out():
+        """Check priors give the same results when writing to an output
+        array."""
+        prior_list = [
+            dyPolyChord.python_priors.Uniform(-1, 2, sort=True),
+            dyPolyChord.python_priors.Gaussian(2, mu=1, adaptive=True),
+            dyPolyChord.python_priors.Gaussian(2, half=True),
+            dyPolyChord.python_priors.PowerUniform(0.1, 2, power=-2),
+            dyPolyChord.python_priors.PowerUniform(0.1, 2, power=3),
+            dyPolyChord.python_priors.Exponential(2)]
+        hypercube = np.random.random(5)
+        cube_copy = copy.deepcopy(hypercube)
+        for prior in prior_list:
+            out = np.zeros(hypercube.shape)
+            theta = prior(hypercube, out=out)
+            assert theta is out
+            numpy.testing.assert_allclose(theta, prior(hypercube))
+        # Input should not have been edited
+        numpy.testing.assert_array_equal(hypercube, cube_copy)
 
 
     @staticmethod
@@ -747,9 +1933,25 @@ class TestPythonLikelihoods(unittest.TestCase):
         """Check the Gaussian mixture model likelihood."""
         dim = 5
         theta = np.random.random(dim)
-        _, phi = likelihoods.GaussianMix()(theta)
+        likelihood = likelihoods.GaussianMix()
+        logl, phi = likelihood(theta)
         self.assertIsInstance(phi, list)
         self.assertEqual(len(phi), 0)
+        # Check vs sum of the components' likelihoods
+        logls = []
+        for i, pos in enumerate(likelihood.positions):
+            th_comp = copy.deepcopy(theta)
+            th_comp[:2] -= pos
+            logls.append(likelihoods.Gaussian()(th_comp)[0]
+                         + np.log(likelihood.weights[i]))
+        self.assertAlmostEqual(logl, scipy.special.logsumexp(logls),
+                               places=12)
+        # Check batched input
+        thetas = np.random.random((3, dim))
+        logl, phi = likelihoods.GaussianMix(nderived=1)(thetas)
+        self.assertEqual(phi.shape, (3, 1))
+        numpy.testing.assert_allclose(
+            logl, [likelihood(th)[0] for th in thetas], rtol=0, atol=1e-12)
 
     def test_loggamma_mix(self):
         """Check the loggamma mixture model likelihood."""
@@ -777,6 +1979,102 @@ class TestPythonLikelihoods(unittest.TestCase):
         self.assertIsInstance(phi, list)
         self.assertEqual(len(phi), 0)
 
+    def test_cached_likelihood(self):
+        """Check the caching likelihood wrapper."""
+        try:
+            os.makedirs(TEST_CACHE_DIR)
+        except OSError:
+            pass
+        cache_path = os.path.join(TEST_CACHE_DIR, 'cache.pkl')
+        thetas = [np.random.random(3) for _ in range(2)]
+        func = likelihoods.CachedLikelihood(
+            likelihoods.Gaussian(nderived=1), max_size=1,
+            cache_path=cache_path)
+        for theta in [thetas[0], thetas[0], thetas[1], thetas[0]]:
+            logl, phi = func(theta)
+            self.assertEqual((logl, phi), likelihoods.Gaussian(nderived=1)(
+                theta))
+        # Second call is a hit, but max_size=1 so thetas[0] has been
+        # discarded by the time it is evaluated for the third time
+        self.assertEqual((func.nhit, func.nmiss), (1, 3))
+        func.save()
+        func = likelihoods.CachedLikelihood(
+            likelihoods.Gaussian(nderived=1), cache_path=cache_path)
+        func(thetas[0])
+        self.assertEqual((func.nhit, func.nmiss), (1, 0))
+        shutil.rmtree(TEST_CACHE_DIR)
+
+    def test_surrogate_likelihood(self):
+        """Check the surrogate likelihood wrapper skips points far below the
+        contour and switches off if its checks fail."""
+        try:
+            os.makedirs(TEST_CACHE_DIR)
+        except OSError:
+            pass
+        ndim = 2
+        gaussian = likelihoods.Gaussian(sigma=1., nderived=1)
+        state = np.random.RandomState(0)
+        theta = state.uniform(-5, 5, size=(500, ndim))
+        logl = np.asarray([gaussian(th)[0] for th in theta])
+        # Dead-birth files have theta, derived params, logl and birth logl
+        np.savetxt(os.path.join(TEST_CACHE_DIR, 'surr_init_dead-birth.txt'),
+                   np.hstack([theta, np.zeros((500, 2)), logl[:, None],
+                              np.full((500, 1), -1e30)]))
+        func = dyPolyChord.surrogate.SurrogateLikelihood(
+            gaussian, surrogate=dyPolyChord.surrogate.RBFSurrogate(seed=0),
+            check_every=2, update_every=1)
+        self.assertRaises(
+            TypeError, dyPolyChord.surrogate.SurrogateLikelihood, gaussian,
+            unexpected=1)
+        func.start_run(os.path.join(TEST_CACHE_DIR, 'surr_dyn'), ndim,
+                       do_clustering=False)
+        self.assertTrue(func.active)
+        self.assertLess(func.surrogate.margin, 1)
+        # The surrogate is accurate away from the edges of the samples
+        test_theta = state.uniform(-3, 3, size=(20, ndim))
+        numpy.testing.assert_allclose(
+            func.surrogate.predict(test_theta),
+            [gaussian(th)[0] for th in test_theta], atol=func.surrogate.margin)
+        # No dead points yet, so all points are evaluated
+        self.assertEqual(func(np.full(ndim, 3.)), gaussian(np.full(ndim, 3.)))
+        # Add a dead point with logl -3, giving a lower bound on the contour
+        with open(os.path.join(TEST_CACHE_DIR, 'surr_dyn_dead-birth.txt'),
+                  'w') as dead_file:
+            dead_file.write('0 0 0 -3 -1e30\n')
+        for _ in range(4):
+            logl, phi = func(np.full(ndim, 3.))
+            self.assertEqual(func.contour, -3)
+            self.assertLess(logl, -3)
+            self.assertEqual(len(phi), 1)
+        self.assertEqual(func(np.zeros(ndim)), gaussian(np.zeros(ndim)))
+        self.assertEqual((func.ncall, func.nskip, func.ncheck, func.nmiss),
+                         (6, 2, 2, 0))
+        self.assertAlmostEqual(func.skip_frac, 2 / 6.)
+        # Points above the contour which the surrogate would skip are misses
+        func.surrogate.margin = -100
+        func.min_checks = 3
+        with warnings.catch_warnings(record=True) as war:
+            warnings.simplefilter('always')
+            for _ in range(2):
+                func(np.zeros(ndim))
+            self.assertEqual(len(war), 1)
+        self.assertFalse(func.active)
+        self.assertEqual((func.ncheck, func.nmiss), (3, 1))
+        shutil.rmtree(TEST_CACHE_DIR)
+
+    def test_nested_likelihood_wrappers(self):
+        """Check CachedLikelihood is found inside a SurrogateLikelihood."""
+        gaussian = likelihoods.Gaussian(sigma=1., nderived=1)
+        cached = likelihoods.CachedLikelihood(gaussian)
+        func = dyPolyChord.surrogate.SurrogateLikelihood(cached)
+        self.assertIs(likelihoods.find_wrapper(
+            func, likelihoods.CachedLikelihood), cached)
+        self.assertIsNone(likelihoods.find_wrapper(
+            gaussian, likelihoods.CachedLikelihood))
+        for _ in range(3):
+            func(np.zeros(2))
+        self.assertEqual((cached.nhit, cached.nmiss), (2, 1))
+
 
 # Helper functions
 # ----------------
@@ -843,5 +2141,56 @@ class DummyMPIComm(object):
         if root == 0:
             raise AssertionError
 
+
+class StubMPIComm(DummyMPIComm):
+
+    """A dummy mpi4py MPI.COMM object whose bcast returns the data from rank
+    0."""
+
+    def __init__(self, rank, root_data=None):
+        DummyMPIComm.__init__(self, rank)
+        self.root_data = root_data
+
+    def bcast(self, data, root=0):
+        """Dummy version of mpi4py MPI.COMM's bcast(data, root=0)."""
+        assert root == 0
+        return data if self.rank == 0 else self.root_data
+
+
+class StubSettings(object):
+
+    """Stub for pypolychord's settings object, with the same defaults for the
+    settings used by dyPolyChord."""
+
+    def __init__(self, **kwargs):
+        self.base_dir = 'chains'
+        self.file_root = 'test'
+        self.do_clustering = True
+        self.__dict__.update(kwargs)
+
+
+class StubPyPolyChord(object):
+
+    """Stub for the pypolychord module and its settings submodule, which
+    records the settings of each run."""
+
+    def __init__(self):
+        self.runs = []
+
+    @staticmethod
+    def PolyChordSettings(ndim, nderived,  # pylint: disable=invalid-name
+                          **kwargs):
+        """Stub for pypolychord.settings.PolyChordSettings, with the same
+        defaults for the settings used by dyPolyChord."""
+        assert isinstance(ndim, int) and isinstance(nderived, int)
+        return StubSettings(**kwargs)
+
+    def run_polychord(self, likelihood, ndim, nderived, settings, prior=None):
+        """Stub for pypolychord.run_polychord."""
+        assert callable(likelihood) and callable(prior)
+        assert isinstance(ndim, int) and isinstance(nderived, int)
+        self.runs.append(settings)
+
+
 if __name__ == '__main__':
     unittest.main()